@@ -0,0 +1,142 @@
+# antiflood.py
+import logging
+import os
+import sys
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Не больше ANTIFLOOD_LIMIT сообщений за ANTIFLOOD_WINDOW секунд от пользователя (0 - выключить)
+ANTIFLOOD_LIMIT = int(os.getenv('ANTIFLOOD_LIMIT', '8'))
+ANTIFLOOD_WINDOW = float(os.getenv('ANTIFLOOD_WINDOW', '10'))
+ANTIFLOOD_MAX_USERS = int(os.getenv('ANTIFLOOD_MAX_USERS', '20000'))
+
+class UserWindow:
+    """Скользящее окно одного пользователя: счетчики текущего и прошлого окна"""
+
+    __slots__ = ('started', 'current', 'previous', 'seen', 'dropped')
+
+    def __init__(self, now):
+        self.started = now
+        self.current = 0
+        self.previous = 0
+        self.seen = now
+        self.dropped = 0
+
+class AntiFloodMiddleware(BaseMiddleware):
+    """Внешний middleware сообщений: ограничение частоты по пользователю.
+
+    Вместо списка отметок времени на пользователя хранится пара счетчиков
+    (текущее и прошлое окно), и частота оценивается как скользящее окно:
+    previous * (доля прошлого окна, попавшая в интервал) + current.
+    Пользователи лежат в OrderedDict по времени последнего сообщения:
+    молчащие дольше двух окон (их счетчики уже нулевые) и самые давние
+    сверх max_users вытесняются, так что память ограничена.
+
+    Сообщения сверх лимита не доходят до обработчиков - ни записи в БД,
+    ни ответа. Их число копится в памяти и пишется одним взаимодействием
+    flood_dropped, когда пользователь снова укладывается в лимит или
+    вытесняется из памяти. Админы не ограничиваются.
+    """
+
+    def __init__(self, database, admin_ids, limit=ANTIFLOOD_LIMIT, window=ANTIFLOOD_WINDOW, max_users=ANTIFLOOD_MAX_USERS):
+        self.database = database
+        self.admin_ids = admin_ids
+        self.limit = limit
+        self.window = window
+        self.max_users = max_users
+        self.users = OrderedDict()
+        # Отброшенные сообщения вытесненных пользователей: (user_id, количество)
+        self.evicted_drops = []
+        self.dropped_total = 0
+        self.flooders_total = 0
+
+    def _evict(self, now):
+        idle_before = now - 2 * self.window
+        while self.users:
+            user_id, entry = next(iter(self.users.items()))
+            if entry.seen >= idle_before and len(self.users) <= self.max_users:
+                break
+            self.users.popitem(last=False)
+            if entry.dropped:
+                self.evicted_drops.append((user_id, entry.dropped))
+
+    def hit(self, user_id, now=None):
+        """Учитываем сообщение: True - обрабатываем, False - отбрасываем"""
+        now = time.monotonic() if now is None else now
+        entry = self.users.get(user_id)
+        if entry is None:
+            entry = self.users[user_id] = UserWindow(now)
+        else:
+            self.users.move_to_end(user_id)
+        entry.seen = now
+        self._evict(now)
+
+        elapsed = now - entry.started
+        if elapsed >= self.window:
+            # Сдвигаем окно; если прошло больше двух окон - прошлое уже пустое
+            entry.previous = entry.current if elapsed < 2 * self.window else 0
+            entry.current = 0
+            entry.started = now - elapsed % self.window
+            elapsed = now - entry.started
+
+        rate = entry.previous * (1 - elapsed / self.window) + entry.current
+        if rate >= self.limit:
+            if not entry.dropped:
+                self.flooders_total += 1
+                logger.warning(f"🌊 Флуд от пользователя {user_id}: сообщения сверх {self.limit} за {self.window:g} с отбрасываются")
+            entry.dropped += 1
+            self.dropped_total += 1
+            return False
+
+        entry.current += 1
+        return True
+
+    def take_dropped(self, user_id):
+        """Сколько сообщений пользователя отброшено с прошлой записи (и обнуляем)"""
+        entry = self.users.get(user_id)
+        if entry is None or not entry.dropped:
+            return 0
+        dropped, entry.dropped = entry.dropped, 0
+        return dropped
+
+    async def _log_dropped(self, user_id):
+        drops = self.evicted_drops
+        self.evicted_drops = []
+        dropped = self.take_dropped(user_id)
+        if dropped:
+            drops.append((user_id, dropped))
+        for drop_user_id, count in drops:
+            await self.database.log_interaction(drop_user_id, 'flood_dropped', str(count))
+
+    async def __call__(self, handler, event, data):
+        user = event.from_user
+        if self.limit <= 0 or user is None or user.id in self.admin_ids:
+            return await handler(event, data)
+
+        if not self.hit(user.id):
+            return None
+
+        if self.evicted_drops or self.users[user.id].dropped:
+            await self._log_dropped(user.id)
+        return await handler(event, data)
+
+    def stats(self):
+        """Состояние лимитера и примерный объем памяти"""
+        # Ключ int и UserWindow со слотами; сами числа внутри - небольшие int/float
+        entry_size = sys.getsizeof(UserWindow(0.0)) + sys.getsizeof(2 ** 40) + 3 * sys.getsizeof(0.0)
+        # Таблица OrderedDict растет вместе с числом пользователей
+        table_size = sys.getsizeof(self.users)
+        table_limit = table_size * self.max_users / len(self.users) if self.users else table_size
+        return {
+            'users': len(self.users),
+            'max_users': self.max_users,
+            'limited_now': sum(1 for entry in self.users.values() if entry.dropped),
+            'dropped_total': self.dropped_total,
+            'flooders_total': self.flooders_total,
+            'memory_bytes': table_size + len(self.users) * entry_size,
+            'memory_limit_bytes': max(table_size, table_limit) + self.max_users * entry_size,
+        }
@@ -0,0 +1,7 @@
+# benchmarks/__init__.py
+"""Замеры производительности. Запускаются из корня репозитория:
+
+    python -m benchmarks.bench_sharding
+    python -m benchmarks.bench_start
+    python -m benchmarks.bench_write_latency
+"""
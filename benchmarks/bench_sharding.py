@@ -0,0 +1,108 @@
+# benchmarks/bench_sharding.py
+"""Пропускная способность режима с процессами-обработчиками: 1, 2 и 4 воркера.
+
+Фронт раскладывает синтетические апдейты (сценарии loadtest.py) по
+очередям воркеров так же, как sharding.run_sharded - по from_user.id.
+Воркеры - настоящие sharding._worker с фейковой сессией Bot API и общей
+временной SQLite-базой. Время считается от первого апдейта до завершения
+всех воркеров (очереди разобраны, исходящие досланы):
+
+    python -m benchmarks.bench_sharding --users 300 --workers 1 2 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from loadtest import FLOWS, FakeSession, build_update
+
+# dialog_message требует заранее открытых диалогов - в этом замере не нужен
+BENCH_FLOWS = tuple(flow for flow in FLOWS if flow != 'dialog_message')
+
+def _bench_worker_main(index, workers, queue, ready, latency):
+    logging.basicConfig(level=logging.WARNING)
+    import bot as app
+    import sharding
+
+    from outbound import OutboundRequestMiddleware
+    from perf import RequestTimingMiddleware
+
+    session = FakeSession(latency)
+    session.middleware(OutboundRequestMiddleware(app.outbound))
+    if app.perf.enabled:
+        session.middleware(RequestTimingMiddleware())
+    app.bot.session = session
+    # _worker делит лимит на число процессов - лимиты Telegram здесь не измеряем
+    app.outbound.bucket.rate = app.outbound.bucket.capacity = 1e6 * workers
+    app.outbound.per_chat_interval = 0
+    app.outbound.workers_count = 64
+    app.antiflood.limit = 0
+    asyncio.run(sharding._worker(index, workers, queue, ready))
+
+def run_once(workers, users, latency, queue_size=1000):
+    """Один прогон на чистой базе, возвращает (апдейтов, секунд)"""
+    workdir = tempfile.mkdtemp(prefix='bot_bench_sharding_')
+    os.environ['DB_PATH'] = os.path.join(workdir, 'bench.db')
+    try:
+        from database import Database
+
+        database = Database(os.environ['DB_PATH'])
+        database.migrate()
+        database.conn.close()
+
+        context = multiprocessing.get_context('spawn')
+        queues = [context.Queue(maxsize=queue_size) for _ in range(workers)]
+        events = [context.Event() for _ in range(workers)]
+        processes = [
+            context.Process(target=_bench_worker_main, args=(index, workers, queue, event, latency / 1000))
+            for index, (queue, event) in enumerate(zip(queues, events))
+        ]
+        for process in processes:
+            process.start()
+        for event in events:
+            if not event.wait(120):
+                raise RuntimeError("воркер не запустился за 120 с")
+
+        started = time.perf_counter()
+        update_id = 0
+        for flow in BENCH_FLOWS:
+            for user_id in range(1_000_000, 1_000_000 + users):
+                update_id += 1
+                # Как sharding.shard_for: все апдейты пользователя - в один процесс
+                queues[user_id % workers].put(json.dumps(build_update(update_id, flow, user_id)))
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join()
+        return update_id, time.perf_counter() - started
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность при 1/2/4 процессах-обработчиках")
+    parser.add_argument('--users', type=int, default=300, help="синтетических пользователей")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="варианты числа процессов")
+    parser.add_argument('--latency', type=float, default=50.0, help="задержка ответа Bot API, мс")
+    args = parser.parse_args()
+
+    os.environ['BOT_TOKEN'] = '123456:BENCH'
+    # Без админов: уведомления о регистрации в один чат шли бы по одному в секунду
+    os.environ['ADMIN_IDS'] = ''
+    logging.basicConfig(level=logging.WARNING)
+
+    print(f"🚀 {args.users} пользователей × {len(BENCH_FLOWS)} сценариев, задержка API {args.latency:g} мс")
+    baseline = None
+    for workers in args.workers:
+        updates, elapsed = run_once(workers, args.users, args.latency)
+        rate = updates / elapsed
+        baseline = baseline or rate
+        print(f"  воркеров {workers}: {updates} апдейтов за {elapsed:.2f} с, "
+              f"{rate:.0f} upd/s (×{rate / baseline:.2f})")
+
+if __name__ == "__main__":
+    main()
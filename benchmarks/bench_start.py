@@ -0,0 +1,107 @@
+"""Задержка одного /start: прежние отдельные вызовы против register_start.
+
+Прежний обработчик делал add_user, COUNT(*) по interactions через
+get_user_interactions_count и запись start_command, каждый со своим
+commit, а новому пользователю - еще два schedule_reminder. Сейчас все это
+делает register_start одной транзакцией, а повторный /start берет счетчик
+из кеша пользователей. Замер синхронный, прямо на Database, на базе с
+историей взаимодействий у повторных пользователей:
+
+    python -m benchmarks.bench_start --users 2000 --history 200
+"""
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+from perf import percentile
+
+def old_start(database, user_data):
+    """/start как до register_start: пять отдельных commit для нового пользователя"""
+    user_id = user_data['user_id']
+    is_new = database.add_user(user_data)
+    # Кеша не было - каждый /start считал взаимодействия заново
+    database.user_cache.counts.pop(user_id, None)
+    interaction_count = database.get_user_interactions_count(user_id)
+    database.log_interaction(user_id, 'start_command')
+    database.flush_interactions()
+    if is_new:
+        database.schedule_reminder(user_id, '30_hours', 30)
+        database.schedule_reminder(user_id, '72_hours', 72)
+    return interaction_count
+
+def new_start(database, user_data):
+    return database.register_start(user_data)['interaction_count']
+
+def measure(call, database, user_ids):
+    latencies = []
+    for user_id in user_ids:
+        started = time.perf_counter()
+        call(database, {'user_id': user_id, 'first_name': 'bench', 'source': 'bench'})
+        latencies.append(time.perf_counter() - started)
+    return sorted(latencies)
+
+def seed(database, users, history):
+    """Повторные пользователи 1..users, у каждого history взаимодействий"""
+    now = datetime.now().isoformat()
+    database.import_users([{'user_id': user_id, 'created_at': now} for user_id in range(1, users + 1)])
+    rows = (
+        (user_id, 'start_command', None, now)
+        for _ in range(history) for user_id in range(1, users + 1)
+    )
+    with database.conn:
+        database.conn.executemany('INSERT INTO interactions (user_id, action, data, timestamp) VALUES (?, ?, ?, ?)', rows)
+
+def report(name, latencies):
+    print(
+        f"  {name:<34} p50 {percentile(latencies, 50) * 1000:6.3f} мс   "
+        f"p95 {percentile(latencies, 95) * 1000:6.3f} мс   p99 {percentile(latencies, 99) * 1000:6.3f} мс"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарк обработки /start")
+    parser.add_argument('--users', type=int, default=2000, help="пользователей в каждой группе")
+    parser.add_argument('--history', type=int, default=200, help="взаимодействий у повторного пользователя")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bot_bench_start_')
+    # database.py создает глобальную базу при импорте - тоже во временной папке
+    os.environ['DB_PATH'] = os.path.join(workdir, 'global.db')
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('database').setLevel(logging.WARNING)
+    try:
+        from database import Database
+
+        database = Database(os.path.join(workdir, 'bench.db'))
+        database.migrate()
+        users = args.users
+        print(f"🌱 {users} повторных пользователей по {args.history} взаимодействий...")
+        seed(database, users, args.history)
+
+        print(f"🚀 /start по {users} раз в каждом варианте")
+        # Новые пользователи: разные диапазоны id, чтобы оба варианта добавляли
+        old_new = measure(old_start, database, range(users + 1, 2 * users + 1))
+        new_new = measure(new_start, database, range(2 * users + 1, 3 * users + 1))
+        report("новый, отдельные вызовы", old_new)
+        report("новый, register_start", new_new)
+
+        repeat = range(1, users + 1)
+        old_repeat = measure(old_start, database, repeat)
+        # Первый проход заполняет кеш (COUNT по разу на пользователя), второй - из кеша
+        cold_repeat = measure(new_start, database, repeat)
+        warm_repeat = measure(new_start, database, repeat)
+        report("повторный, отдельные вызовы", old_repeat)
+        report("повторный, register_start без кеша", cold_repeat)
+        report("повторный, register_start из кеша", warm_repeat)
+
+        for name, before, after in (('новый', old_new, new_new), ('повторный', old_repeat, warm_repeat)):
+            print(f"  {name}: p50 быстрее в {percentile(before, 50) / percentile(after, 50):.1f} раза")
+        database.conn.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
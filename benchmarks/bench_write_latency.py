@@ -0,0 +1,142 @@
+"""Задержка записи /start, пока админы гоняют аналитику.
+
+Пишущие задачи вызывают register_start для новых пользователей через
+AsyncDatabase, параллельно читающие задачи без пауз запрашивают /stats,
+воронку и список новых пользователей по базе с заранее залитой историей.
+Три прогона на одной базе:
+
+    idle    - только записи, без аналитики
+    shared  - аналитика на соединении писателя в его потоке, как до WAL и пула
+    pool    - аналитика через пул read-only соединений (текущая схема)
+
+    python -m benchmarks.bench_write_latency --interactions 300000 --seconds 5
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from perf import percentile
+
+class SharedConnection:
+    """Вместо пула отдает соединение писателя - чтение и запись идут по очереди"""
+
+    def __init__(self, database):
+        self.database = database
+        self.size = 1
+
+    @contextmanager
+    def connection(self):
+        yield self.database.conn
+
+    def close(self):
+        pass
+
+def seed(database, users, interactions):
+    """Заливаем пользователей и сегодняшние взаимодействия по шагам воронки"""
+    from funnel import FUNNEL_ACTIONS
+
+    now = datetime.now()
+    database.import_users([
+        {'user_id': user_id, 'first_name': f'user{user_id}', 'source': 'bench', 'created_at': now.isoformat()}
+        for user_id in range(1, users + 1)
+    ])
+    day = now.date().isoformat()
+    rows = (
+        (index % users + 1, FUNNEL_ACTIONS[index % len(FUNNEL_ACTIONS)], None, f'{day}T{index % 86400 // 3600:02d}:00:00')
+        for index in range(interactions)
+    )
+    with database.conn:
+        database.conn.executemany(
+            'INSERT INTO interactions (user_id, action, data, timestamp) VALUES (?, ?, ?, ?)', rows
+        )
+
+async def run_mode(async_db, readers, writers, seconds, first_user_id):
+    """Записи и (если readers) аналитика seconds секунд; задержки записей"""
+    from funnel import FUNNEL_ACTIONS
+
+    day = datetime.now().date().isoformat()
+    stop_at = time.perf_counter() + seconds
+    latencies = []
+    reports = 0
+    next_user_id = first_user_id
+
+    async def writer():
+        nonlocal next_user_id
+        while time.perf_counter() < stop_at:
+            user_id = next_user_id
+            next_user_id += 1
+            started = time.perf_counter()
+            await async_db.register_start({'user_id': user_id, 'first_name': 'bench'})
+            latencies.append(time.perf_counter() - started)
+
+    async def reader():
+        nonlocal reports
+        while time.perf_counter() < stop_at:
+            await async_db.get_today_stats(day)
+            await async_db.get_funnel_masks(day, day, FUNNEL_ACTIONS)
+            await async_db.get_new_users_page(day)
+            reports += 1
+
+    await asyncio.gather(*(writer() for _ in range(writers)), *(reader() for _ in range(readers)))
+    return sorted(latencies), reports, next_user_id
+
+def run(mode, path, readers, writers, seconds, first_user_id):
+    from database import AsyncDatabase, Database
+
+    database = Database(path)
+    if mode == 'shared':
+        # Как до изменения: одно соединение, аналитика в потоке писателя
+        database.read_pool = SharedConnection(database)
+        database.READ_METHODS = frozenset()
+    async_db = AsyncDatabase(database)
+    try:
+        return asyncio.run(run_mode(async_db, readers if mode != 'idle' else 0, writers, seconds, first_user_id))
+    finally:
+        async_db.close()
+        database.conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Задержка записи при параллельной аналитике")
+    parser.add_argument('--users', type=int, default=50000, help="пользователей в базе")
+    parser.add_argument('--interactions', type=int, default=300000, help="сегодняшних взаимодействий в базе")
+    parser.add_argument('--readers', type=int, default=2, help="параллельных запросов аналитики")
+    parser.add_argument('--writers', type=int, default=4, help="параллельных /start")
+    parser.add_argument('--seconds', type=float, default=5.0, help="длительность каждого прогона")
+    parser.add_argument('--modes', nargs='+', choices=('idle', 'shared', 'pool'), default=['idle', 'shared', 'pool'])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bot_bench_writes_')
+    # database.py создает глобальную базу при импорте - тоже во временной папке
+    os.environ['DB_PATH'] = os.path.join(workdir, 'global.db')
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('database').setLevel(logging.WARNING)
+    try:
+        from database import Database
+
+        path = os.path.join(workdir, 'bench.db')
+        database = Database(path)
+        database.migrate()
+        print(f"🌱 Заливаем {args.users} пользователей и {args.interactions} взаимодействий...")
+        seed(database, args.users, args.interactions)
+        database.conn.close()
+
+        print(f"🚀 /start: {args.writers} параллельно, аналитика: {args.readers} параллельно, {args.seconds:g} с на прогон")
+        first_user_id = args.users + 1
+        for mode in args.modes:
+            latencies, reports, first_user_id = run(mode, path, args.readers, args.writers, args.seconds, first_user_id)
+            print(
+                f"  {mode:<7} записей {len(latencies):>6}, отчетов {reports:>4}   "
+                f"p50 {percentile(latencies, 50) * 1000:7.2f} мс   p95 {percentile(latencies, 95) * 1000:7.2f} мс   "
+                f"p99 {percentile(latencies, 99) * 1000:7.2f} мс   max {(latencies[-1] if latencies else 0) * 1000:7.1f} мс"
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,33 @@
 # bot.py
 import logging
 import asyncio
+import argparse
 import os
-from datetime import datetime, date
+import secrets
+import time
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
 
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
-from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, FSInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 
-from database import db
+from database import async_db, archive_cutoff
+from reminder_scheduler import ReminderScheduler
+from outbound import OutboundDispatcher, OutboundRequestMiddleware, PRIORITY_DIALOG, PRIORITY_NORMAL, PRIORITY_BULK
+from broadcast import BroadcastEngine
+from outbox import Outbox
+from fsm_storage import SQLiteStorage
+from dialogs import DialogRegistry
+from webhook import run_webhook
+from export import export_table, EXPORT_TABLES, EXPORT_FORMATS
+from perf import perf, setup_perf, start_metrics_server
+from antiflood import AntiFloodMiddleware
+from query_profiler import query_profiler
+from funnel import FunnelEngine, format_funnel
+from retention import format_retention, run_nightly as run_retention_nightly
 
 # Настройка логирования
 logging.basicConfig(
@@ -22,11 +38,35 @@ logging.basicConfig(
 # Получение токена из переменных окружения
 BOT_TOKEN = os.getenv('BOT_TOKEN', '8288540260:AAF5Mf1U0QU-BHLY7dvhgvBO-wafexMZUaI')
 ADMIN_ID = os.getenv('ADMIN_ID', '5067425279')
+# Несколько админов можно указать через запятую: ADMIN_IDS=111,222
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv('ADMIN_IDS', ADMIN_ID).split(',') if admin_id.strip()}
+# Через сколько часов без изменений сбрасывается состояние FSM (брошенная регистрация)
+FSM_STATE_TTL_HOURS = float(os.getenv('FSM_STATE_TTL_HOURS', '48'))
+# Взаимодействия старше стольких дней переносятся в помесячные архивные таблицы
+INTERACTIONS_RETENTION_DAYS = int(os.getenv('INTERACTIONS_RETENTION_DAYS', '90'))
+# Telegram принимает от ботов файлы до 50 МБ
+EXPORT_MAX_FILE_SIZE = 50 * 1024 * 1024
+# Порт HTTP-эндпоинта /metrics для Prometheus (не задан - эндпоинт выключен)
+METRICS_PORT = os.getenv('METRICS_PORT')
+# Секрет для проверки запросов Telegram в режиме webhook
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
 
 # Инициализация бота и диспетчера
 bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+storage = SQLiteStorage(async_db, ttl=FSM_STATE_TTL_HOURS * 3600)
 dp = Dispatcher(storage=storage)
+# Все исходящие сообщения идут через общую очередь с учетом лимитов Telegram
+outbound = OutboundDispatcher(bot)
+# Ответы обработчиков (message.answer и т.п.) тоже проходят через очередь
+bot.session.middleware(OutboundRequestMiddleware(outbound))
+# Замеры времени обработчиков, апдейтов и вызовов Bot API (PERF_ENABLED=0 - выключить)
+setup_perf(dp, bot)
+# Ограничение частоты сообщений от пользователя до обработчиков и записи в БД
+antiflood = AntiFloodMiddleware(async_db, ADMIN_IDS)
+dp.message.outer_middleware(antiflood)
+broadcast_engine = BroadcastEngine(bot, async_db, outbound)
+# Сообщения, которые нельзя потерять, сначала сохраняются в БД и досылаются с повторами
+outbox = Outbox(async_db, outbound)
 
 # Состояния FSM
 class RegistrationStates(StatesGroup):
@@ -35,8 +75,20 @@ class RegistrationStates(StatesGroup):
 class AdminStates(StatesGroup):
     in_dialog = State()
 
-# Хранилище активных диалогов {user_id: admin_id}
-active_dialogs = {}
+# Реестр активных диалогов: user_id -> admin_id и admin_id -> {user_id}
+dialogs = DialogRegistry(async_db)
+# Воронка конверсии с кешем по прошедшим дням
+funnel_engine = FunnelEngine(async_db)
+
+# Итог отправки через outbox для ответов админу
+OUTBOX_STATUS_TEXT = {
+    'blocked': 'пользователь заблокировал бота',
+    'failed': 'сообщение отклонено Telegram',
+    None: 'сообщение уже в очереди'
+}
+
+def is_admin(user_id: int) -> bool:
+    return user_id in ADMIN_IDS
 
 # Создаем Reply-клавиатуру с кнопкой "Начать" (всегда внизу)
 start_keyboard = ReplyKeyboardMarkup(
@@ -62,12 +114,15 @@ async def send_to_admin(user_info: str, registration_data: str, user_id: int):
             [InlineKeyboardButton(text="❌ Закрыть", callback_data=f"close_dialog_{user_id}")]
         ])
         
-        await bot.send_message(
-            chat_id=ADMIN_ID,
-            text=message_text,
-            reply_markup=reply_keyboard
-        )
-        logging.info(f"✅ Данные отправлены админу {ADMIN_ID} с кнопкой диалога")
+        # Уведомляем всех админов: диалог начнет тот, кто первым нажмет кнопку
+        for admin_id in ADMIN_IDS:
+            await outbox.send_message(
+                chat_id=admin_id,
+                text=message_text,
+                reply_markup=reply_keyboard,
+                priority=PRIORITY_NORMAL
+            )
+        logging.info(f"✅ Данные отправлены админам {ADMIN_IDS} с кнопкой диалога")
     except Exception as e:
         logging.error(f"❌ Ошибка отправки данных админу: {e}")
 
@@ -75,14 +130,14 @@ async def send_to_admin(user_info: str, registration_data: str, user_id: int):
 @dp.message(Command("stats"))
 async def cmd_stats(message: types.Message):
     """Показывает статистику за сегодня"""
-    if str(message.from_user.id) != ADMIN_ID:
+    if not is_admin(message.from_user.id):
         await message.answer("❌ У вас нет прав для этой команды")
         return
     
     try:
         # Получаем статистику за сегодня
         today = date.today().isoformat()
-        stats = db.get_today_stats(today)
+        stats = await async_db.get_today_stats(today)
         
         if not stats:
             await message.answer("📊 Статистика за сегодня\n\nНет активностей за сегодня")
@@ -140,98 +195,488 @@ async def cmd_stats(message: types.Message):
         logging.error(f"Ошибка получения статистики: {e}")
         await message.answer(f"❌ Ошибка получения статистики: {e}")
 
+# Отчеты /user_stats и /new_users показываются постранично
+REPORT_PAGE_SIZE = 20
+# Сколько символов data показывать в строке отчета (страница должна влезать в 4096)
+REPORT_DATA_PREVIEW = 100
+# Параметры открытых отчетов: token -> сессия (callback_data ограничен 64 байтами)
+report_sessions = OrderedDict()
+REPORT_SESSIONS_LIMIT = 1000
+
+ACTION_NAMES = {
+    'start_command': '🚀 Старт',
+    'viewed_vip_benefits': '🎯 VIP преимущества', 
+    'selected_has_broker': '📈 Есть брокер',
+    'selected_completed_registration': '📋 Регистрация',
+    'clicked_make_payment': '💳 Оплата',
+    'submitted_registration_data': '✅ Отправил данные',
+    'sent_message': '💬 Сообщение',
+    'user_message_dialog': '💬 Сообщение в диалоге',
+    'admin_message': '👨‍💼 Ответ админа'
+}
+
+def parse_date_range(args):
+    """Период отчета из аргументов команды: [с YYYY-MM-DD] [по YYYY-MM-DD], по умолчанию - сегодня"""
+    date_from = date.fromisoformat(args[0]) if args else date.today()
+    date_to = date.fromisoformat(args[1]) if len(args) > 1 else date_from
+    if date_to < date_from:
+        date_from, date_to = date_to, date_from
+    return date_from.isoformat(), date_to.isoformat()
+
+def format_period(session):
+    if session['date_from'] == session['date_to']:
+        return f"за {session['date_from']}"
+    return f"с {session['date_from']} по {session['date_to']}"
+
+def open_report(session):
+    token = secrets.token_hex(4)
+    report_sessions[token] = session
+    if len(report_sessions) > REPORT_SESSIONS_LIMIT:
+        report_sessions.popitem(last=False)
+    return token
+
+async def load_report_page(session, direction='next'):
+    """Загружаем страницу отчета относительно текущей и запоминаем ее границы"""
+    if direction == 'next':
+        cursor = session.get('last')
+    else:
+        cursor = session.get('first')
+
+    if session['kind'] == 'user_stats':
+        page = await async_db.get_user_stats_page(
+            session['user_id'], session['date_from'], session['date_to'],
+            cursor=cursor, direction=direction, limit=REPORT_PAGE_SIZE
+        )
+        rows = page['actions'] if page else []
+        key = 'timestamp'
+    else:
+        page = await async_db.get_new_users_page(
+            session['date_from'], session['date_to'],
+            cursor=cursor, direction=direction, limit=REPORT_PAGE_SIZE
+        )
+        rows = page['users'] if page else []
+        key = 'created_at'
+
+    if page and rows:
+        session['first'] = (rows[0][key], rows[0]['id'])
+        session['last'] = (rows[-1][key], rows[-1]['id'])
+        if cursor is not None:
+            session['page'] += 1 if direction == 'next' else -1
+    return page
+
+def report_keyboard(token, page):
+    buttons = []
+    if page['has_prev']:
+        buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"report:{token}:prev"))
+    if page['has_next']:
+        buttons.append(InlineKeyboardButton(text="Далее ➡️", callback_data=f"report:{token}:next"))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+def render_user_stats(session, page):
+    user_id = session['user_id']
+    user_info = f"👤 Пользователь: {page['user_info']['first_name'] or 'Не указано'}\n"
+    user_info += f"📱 ID: {user_id}\n"
+    if page['user_info']['username']:
+        user_info += f"🔗 Username: @{page['user_info']['username']}\n"
+    
+    stats_text = f"📊 Статистика пользователя {format_period(session)}\n\n{user_info}\n"
+    stats_text += f"📈 Всего действий: {page['total_actions']}\n\n"
+    
+    if not page['actions']:
+        return stats_text + "Нет действий за этот период"
+    
+    stats_text += f"История действий (стр. {session['page']}):\n"
+    for action in page['actions']:
+        moment = datetime.fromisoformat(action['timestamp'])
+        time = moment.strftime('%H:%M:%S') if session['date_from'] == session['date_to'] else moment.strftime('%d.%m %H:%M:%S')
+        action_name = ACTION_NAMES.get(action['action'], action['action'])
+        
+        data = action['data'] or ""
+        if len(data) > REPORT_DATA_PREVIEW:
+            data = data[:REPORT_DATA_PREVIEW] + "…"
+        data = f" - {data}" if data else ""
+        stats_text += f"• {time} - {action_name}{data}\n"
+    return stats_text
+
+def render_new_users(session, page):
+    stats_text = f"📊 Новые пользователи {format_period(session)}\n\n"
+    
+    if not page['users']:
+        return stats_text + "Нет новых пользователей за этот период"
+    
+    for user in page['users']:
+        user_info = f"👤 ID: {user['user_id']}"
+        if user['first_name']:
+            user_info += f" - {user['first_name']}"
+        if user['username']:
+            user_info += f" (@{user['username']})"
+        
+        moment = datetime.fromisoformat(user['created_at'])
+        time = moment.strftime('%H:%M') if session['date_from'] == session['date_to'] else moment.strftime('%d.%m %H:%M')
+        stats_text += f"• {time} - {user_info}\n"
+    
+    stats_text += f"\nВсего новых: {page['total']} (стр. {session['page']})"
+    return stats_text
+
+def render_report(session, page):
+    if session['kind'] == 'user_stats':
+        return render_user_stats(session, page)
+    return render_new_users(session, page)
+
 # Команда для детального просмотра действий пользователя
 @dp.message(Command("user_stats"))
 async def cmd_user_stats(message: types.Message):
-    """Показывает детальную статистику по пользователю"""
-    if str(message.from_user.id) != ADMIN_ID:
+    """Показывает детальную статистику по пользователю за период"""
+    if not is_admin(message.from_user.id):
         await message.answer("❌ У вас нет прав для этой команды")
         return
     
     try:
-        # Получаем аргумент - user_id
+        # Получаем аргументы - user_id и необязательный период
         args = message.text.split()
         if len(args) < 2:
-            await message.answer("❌ Укажите ID пользователя: /user_stats <user_id>")
+            await message.answer("❌ Укажите ID пользователя: /user_stats <user_id> [YYYY-MM-DD] [YYYY-MM-DD]")
             return
         
-        user_id = int(args[1])
-        today = date.today().isoformat()
-        user_stats = db.get_user_today_stats(user_id, today)
-        
-        if not user_stats:
-            await message.answer(f"❌ Нет активностей у пользователя {user_id} за сегодня")
+        try:
+            user_id = int(args[1])
+        except ValueError:
+            await message.answer("❌ Неверный формат ID пользователя")
             return
+        date_from, date_to = parse_date_range(args[2:])
         
-        user_info = f"👤 Пользователь: {user_stats['user_info']['first_name'] or 'Не указано'}\n"
-        user_info += f"📱 ID: {user_id}\n"
-        if user_stats['user_info']['username']:
-            user_info += f"🔗 Username: @{user_stats['user_info']['username']}\n"
-        
-        stats_text = f"📊 Статистика пользователя за сегодня\n\n{user_info}\n"
-        stats_text += f"📈 Всего действий: {user_stats['total_actions']}\n\n"
+        session = {'kind': 'user_stats', 'user_id': user_id, 'date_from': date_from, 'date_to': date_to, 'page': 1}
+        page = await load_report_page(session)
         
-        stats_text += "История действий:\n"
-        for action in user_stats['actions']:
-            time = datetime.fromisoformat(action['timestamp']).strftime('%H:%M:%S')
-            action_name = {
-                'start_command': '🚀 Старт',
-                'viewed_vip_benefits': '🎯 VIP преимущества', 
-                'selected_has_broker': '📈 Есть брокер',
-                'selected_completed_registration': '📋 Регистрация',
-                'clicked_make_payment': '💳 Оплата',
-                'submitted_registration_data': '✅ Отправил данные',
-                'sent_message': '💬 Сообщение',
-                'user_message_dialog': '💬 Сообщение в диалоге',
-                'admin_message': '👨‍💼 Ответ админа'
-            }.get(action['action'], action['action'])
-            
-            data = f" - {action['data']}" if action['data'] else ""
-            stats_text += f"• {time} - {action_name}{data}\n"
+        if not page:
+            await message.answer(f"❌ Пользователь {user_id} не найден")
+            return
         
-        await message.answer(stats_text)
+        token = open_report(session)
+        await message.answer(render_report(session, page), reply_markup=report_keyboard(token, page))
         
     except ValueError:
-        await message.answer("❌ Неверный формат ID пользователя")
+        await message.answer("❌ Неверный формат даты, используйте YYYY-MM-DD")
     except Exception as e:
         logging.error(f"Ошибка получения статистики пользователя: {e}")
         await message.answer(f"❌ Ошибка получения статистики: {e}")
 
-# Команда для просмотра новых пользователей за сегодня
+# Команда для просмотра новых пользователей за период
 @dp.message(Command("new_users"))
 async def cmd_new_users(message: types.Message):
-    """Показывает новых пользователей за сегодня"""
-    if str(message.from_user.id) != ADMIN_ID:
+    """Показывает новых пользователей за период (по умолчанию - за сегодня)"""
+    if not is_admin(message.from_user.id):
         await message.answer("❌ У вас нет прав для этой команды")
         return
     
     try:
-        today = date.today().isoformat()
-        new_users = db.get_new_users_today(today)
+        date_from, date_to = parse_date_range(message.text.split()[1:])
+        
+        session = {'kind': 'new_users', 'date_from': date_from, 'date_to': date_to, 'page': 1}
+        page = await load_report_page(session)
         
-        if not new_users:
-            await message.answer("📊 Новые пользователи за сегодня\n\nНет новых пользователей за сегодня")
+        if not page:
+            await message.answer("❌ Ошибка получения данных")
             return
         
-        stats_text = "📊 Новые пользователи за сегодня\n\n"
+        token = open_report(session)
+        await message.answer(render_report(session, page), reply_markup=report_keyboard(token, page))
         
-        for user in new_users:
-            user_info = f"👤 ID: {user['user_id']}"
-            if user['first_name']:
-                user_info += f" - {user['first_name']}"
-            if user['username']:
-                user_info += f" (@{user['username']})"
-            
-            time = datetime.fromisoformat(user['created_at']).strftime('%H:%M')
-            stats_text += f"• {time} - {user_info}\n"
+    except ValueError:
+        await message.answer("❌ Неверный формат даты, используйте YYYY-MM-DD")
+    except Exception as e:
+        logging.error(f"Ошибка получения новых пользователей: {e}")
+        await message.answer(f"❌ Ошибка получения данных: {e}")
+
+# Листание страниц отчетов
+@dp.callback_query(F.data.startswith("report:"))
+async def handle_report_page(callback: CallbackQuery):
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет прав", show_alert=True)
+        return
+    
+    _, token, direction = callback.data.split(":")
+    session = report_sessions.get(token)
+    if session is None:
+        await callback.answer("⌛ Отчет устарел, запросите его заново", show_alert=True)
+        return
+    report_sessions.move_to_end(token)
+    
+    try:
+        page = await load_report_page(session, direction)
+        if not page:
+            await callback.answer("❌ Ошибка получения данных", show_alert=True)
+            return
         
-        stats_text += f"\nВсего новых: {len(new_users)}"
+        await callback.message.edit_text(render_report(session, page), reply_markup=report_keyboard(token, page))
+        await callback.answer()
+    except Exception as e:
+        logging.error(f"Ошибка листания отчета: {e}")
+        await callback.answer("❌ Ошибка получения данных", show_alert=True)
+
+# Команда для просмотра воронки конверсии
+@dp.message(Command("funnel"))
+async def cmd_funnel(message: types.Message):
+    """Воронка за период: /funnel [с YYYY-MM-DD] [по YYYY-MM-DD], по умолчанию - 7 дней"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав для этой команды")
+        return
+    
+    try:
+        args = message.text.split()[1:]
+        if args:
+            date_from, date_to = parse_date_range(args)
+        else:
+            date_to = date.today()
+            date_from, date_to = (date_to - timedelta(days=6)).isoformat(), date_to.isoformat()
         
-        await message.answer(stats_text)
+        funnel = await funnel_engine.compute(date_from, date_to)
+        if not funnel:
+            await message.answer("❌ Ошибка расчета воронки")
+            return
         
+        await message.answer(format_funnel(funnel))
+    except ValueError:
+        await message.answer("❌ Неверный формат даты, используйте YYYY-MM-DD")
     except Exception as e:
-        logging.error(f"Ошибка получения новых пользователей: {e}")
-        await message.answer(f"❌ Ошибка получения данных: {e}")
+        logging.error(f"Ошибка расчета воронки: {e}")
+        await message.answer(f"❌ Ошибка расчета воронки: {e}")
+
+# Команда для просмотра удержания когорт
+@dp.message(Command("retention"))
+async def cmd_retention(message: types.Message):
+    """Возвраты на D1/D3/D7 по когортам первого /start (из предрасчитанной матрицы)"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав для этой команды")
+        return
+    
+    try:
+        args = message.text.split()
+        limit = max(1, min(int(args[1]), 31)) if len(args) > 1 else 14
+        rows = await async_db.get_retention(limit)
+        text = format_retention(rows)
+        # 31 когорта с сегментами не влезает в одно сообщение
+        for start in range(0, len(text), 4000):
+            await message.answer(text[start:start + 4000])
+    except ValueError:
+        await message.answer("❌ Использование: /retention [число когорт]")
+    except Exception as e:
+        logging.error(f"Ошибка получения удержания: {e}")
+        await message.answer(f"❌ Ошибка получения удержания: {e}")
+
+# Команда для рассылки сообщения всем пользователям
+@dp.message(Command("broadcast"))
+async def cmd_broadcast(message: types.Message):
+    """Запускает рассылку текста всем пользователям"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав для этой команды")
+        return
+    
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2 or not parts[1].strip():
+        await message.answer("❌ Укажите текст рассылки: /broadcast <текст>")
+        return
+    
+    try:
+        job = await broadcast_engine.start(message.chat.id, parts[1].strip())
+        if not job:
+            await message.answer("❌ Не удалось создать рассылку")
+    except Exception as e:
+        logging.error(f"Ошибка запуска рассылки: {e}")
+        await message.answer(f"❌ Ошибка запуска рассылки: {e}")
+
+# Команда для выгрузки таблиц в gzip CSV/JSONL
+@dp.message(Command("export"))
+async def cmd_export(message: types.Message):
+    """Отправляет таблицу users, interactions или reminders файлом"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав для этой команды")
+        return
+    
+    args = message.text.split()
+    table = args[1] if len(args) > 1 else None
+    fmt = args[2] if len(args) > 2 else 'csv'
+    if table not in EXPORT_TABLES or fmt not in EXPORT_FORMATS:
+        await message.answer(
+            f"❌ Использование: /export <{'|'.join(EXPORT_TABLES)}> [{'|'.join(EXPORT_FORMATS)}]"
+        )
+        return
+    
+    path = None
+    try:
+        await message.answer(f"📦 Готовлю выгрузку {table}...")
+        # Выгрузка идет в потоке чтения и не мешает обработке апдейтов
+        await async_db.flush_interactions()
+        loop = asyncio.get_running_loop()
+        path, rows = await loop.run_in_executor(
+            async_db.read_executor, export_table, async_db.database, table, fmt
+        )
+        
+        if os.path.getsize(path) > EXPORT_MAX_FILE_SIZE:
+            await message.answer(
+                f"❌ Файл больше {EXPORT_MAX_FILE_SIZE // (1024 * 1024)} МБ, "
+                f"используйте на сервере: python export.py {table} --format {fmt}"
+            )
+            return
+        
+        filename = f"{table}_{date.today().isoformat()}.{fmt}.gz"
+        await message.answer_document(
+            FSInputFile(path, filename=filename),
+            caption=f"📦 {table}: {rows} строк"
+        )
+    except Exception as e:
+        logging.error(f"Ошибка выгрузки {table}: {e}")
+        await message.answer(f"❌ Ошибка выгрузки: {e}")
+    finally:
+        if path and os.path.exists(path):
+            os.remove(path)
+
+# Команда для просмотра задержек обработчиков, БД и Bot API
+@dp.message(Command("perf"))
+async def cmd_perf(message: types.Message):
+    """Показывает p50/p95/p99 по обработчикам, запросам к БД и вызовам API"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав для этой команды")
+        return
+    
+    if not perf.enabled:
+        await message.answer("📈 Метрики выключены (PERF_ENABLED=0)")
+        return
+    
+    titles = {
+        'update': '📥 Апдейты',
+        'handler': '⚙️ Обработчики',
+        'db': '🗄 Запросы к БД',
+        'api': '📤 Вызовы Bot API'
+    }
+    text = f"📈 Производительность за {perf.window // 60} мин (мс: p50 / p95 / p99, кол-во)\n"
+    for kind, title in titles.items():
+        rows = perf.report(kind)[:10]
+        text += f"\n{title}:\n"
+        if not rows:
+            text += "• нет данных\n"
+        for name, stats in rows:
+            text += f"• {name}: {stats['p50'] * 1000:.1f} / {stats['p95'] * 1000:.1f} / " \
+                    f"{stats['p99'] * 1000:.1f}, {stats['count']}\n"
+    
+    database = async_db.database
+    text += f"\n🗄 Буфер взаимодействий: {len(database.pending_interactions)} в очереди " \
+            f"(лимит {database.max_pending_interactions}), отброшено с запуска {database.dropped_interactions}\n"
+    
+    await message.answer(text)
+
+# Команда для просмотра состояния напоминаний
+@dp.message(Command("reminders"))
+async def cmd_reminders(message: types.Message):
+    """Сколько напоминаний ждет, ушло и сколько отправок удалось избежать"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав для этой команды")
+        return
+    
+    stats = await async_db.get_reminder_stats()
+    if stats is None:
+        await message.answer("❌ Ошибка получения статистики напоминаний")
+        return
+    
+    def by_type(counts):
+        return ', '.join(f"{reminder_type}: {count}" for reminder_type, count in sorted(counts.items())) or '0'
+    
+    reasons = {
+        'submitted_registration_data': '📋 отправили данные',
+        'clicked_make_payment': '💳 перешли к оплате',
+        'dialog_started': '💬 диалог с менеджером',
+        'blocked': '🚫 заблокировали бота'
+    }
+    avoided = sum(sum(counts.values()) for counts in stats['cancelled'].values())
+    
+    text = "⏰ Напоминания\n\n"
+    text += f"⏳ Ожидают: {by_type(stats['pending'])}\n"
+    text += f"✅ Отправлены: {by_type(stats['sent'])}\n"
+    text += f"\n🔕 Отменено (отправок не было): {avoided}\n"
+    for reason, counts in stats['cancelled'].items():
+        text += f"• {reasons.get(reason, reason)}: {by_type(counts)}\n"
+    text += f"\n♻️ Повторных напоминаний не создано с запуска: {stats['duplicates']}"
+    
+    await message.answer(text)
+
+# Команда для просмотра очереди надежной отправки
+@dp.message(Command("outbox"))
+async def cmd_outbox(message: types.Message):
+    """Глубина outbox, возраст самого старого сообщения и итоги доставки за сутки"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав для этой команды")
+        return
+    
+    stats = await outbox.stats()
+    if stats is None:
+        await message.answer("❌ Ошибка получения состояния outbox")
+        return
+    
+    text = "📮 Outbox\n\n"
+    text += f"⏳ В очереди: {stats['pending']} (из них с повторами: {stats['retrying']})\n"
+    if stats['oldest_created_at']:
+        age = int(time.time() - stats['oldest_created_at'])
+        text += f"🕰 Самое старое ждет: {age // 3600} ч {age % 3600 // 60} мин {age % 60} с\n"
+    
+    finished = stats['finished']
+    text += "\nЗа 24 часа:\n"
+    text += f"✅ Доставлено: {finished.get('sent', 0)}\n"
+    text += f"🚫 Бот заблокирован: {finished.get('blocked', 0)}\n"
+    text += f"❌ Не доставлено: {finished.get('failed', 0)}\n"
+    if stats['errors']:
+        text += "\nЧастые ошибки:\n"
+        for error, count in stats['errors']:
+            text += f"• {count} × {error}\n"
+    
+    await message.answer(text)
+
+# Команда для просмотра состояния антифлуда
+@dp.message(Command("antiflood"))
+async def cmd_antiflood(message: types.Message):
+    """Сколько пользователей отслеживается, сколько сообщений отброшено и сколько занято памяти"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав для этой команды")
+        return
+    
+    if antiflood.limit <= 0:
+        await message.answer("🌊 Антифлуд выключен (ANTIFLOOD_LIMIT=0)")
+        return
+    
+    stats = antiflood.stats()
+    text = f"🌊 Антифлуд: не больше {antiflood.limit} сообщений за {antiflood.window:g} с\n\n"
+    text += f"👥 В памяти: {stats['users']} из {stats['max_users']} пользователей\n"
+    text += f"🚫 Ограничены сейчас: {stats['limited_now']}\n"
+    text += f"🗑 Отброшено с запуска: {stats['dropped_total']} (флудеров: {stats['flooders_total']})\n"
+    text += f"💾 Память: ~{stats['memory_bytes'] / 1024:.0f} КБ (предел ~{stats['memory_limit_bytes'] / 1024:.0f} КБ)"
+    
+    await message.answer(text)
+
+# Команда для просмотра самых тяжелых запросов к БД
+@dp.message(Command("slow_queries"))
+async def cmd_slow_queries(message: types.Message):
+    """Рейтинг запросов к SQLite: /slow_queries [total|max|count|slow|reset]"""
+    if not is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав для этой команды")
+        return
+    
+    if not query_profiler.enabled:
+        await message.answer("🐢 Профайлер запросов выключен (задайте DB_SLOW_QUERY_MS)")
+        return
+    
+    args = message.text.split()
+    order = args[1] if len(args) > 1 else 'total'
+    if order == 'reset':
+        query_profiler.reset()
+        await message.answer("🐢 Статистика запросов сброшена")
+        return
+    if order not in ('total', 'max', 'count', 'slow'):
+        await message.answer("❌ Использование: /slow_queries [total|max|count|slow|reset]")
+        return
+    
+    report = query_profiler.format_report(limit=10, order=order)
+    # Отчет с планами может не влезть в одно сообщение
+    for start in range(0, len(report), 4000):
+        await message.answer(report[start:start + 4000])
 
 async def show_vip_benefits_from_start(message: types.Message):
     """Показывает VIP преимущества сразу (для возвращающихся пользователей)"""
@@ -284,11 +729,10 @@ async def process_start(message: types.Message):
         'source': 'start_command'
     }
     
-    # Проверяем, новый ли пользователь и считаем взаимодействия
-    is_new_user = db.add_user(user_data)
-    interaction_count = db.get_user_interactions_count(user.id)
-    
-    db.log_interaction(user.id, 'start_command')
+    # Регистрация, проверка повторного визита, лог и напоминания - одной транзакцией
+    start_info = await async_db.register_start(user_data)
+    is_new_user = start_info['is_new']
+    interaction_count = start_info['interaction_count']
     
     # Если пользователь не новый ИЛИ у него больше 1 взаимодействия, показываем VIP сразу
     if not is_new_user or interaction_count > 1:
@@ -296,8 +740,8 @@ async def process_start(message: types.Message):
         return
     
     # Для новых пользователей - стандартное приветствие
-    db.schedule_reminder(user.id, "30_hours", 30)
-    db.schedule_reminder(user.id, "72_hours", 72)
+    for scheduled in start_info['scheduled_reminders']:
+        reminder_scheduler.notify(*scheduled)
     
     welcome_text = f"👋 Приветствую, {user.first_name}!\n\nДобро пожаловать в элитное сообщество трейдеров!\n\nЯ помогу вам получить доступ к VIP сигналам по золоту и премиум обучению."
     
@@ -310,7 +754,7 @@ async def process_start(message: types.Message):
 @dp.callback_query(F.data == "vip_benefits")
 async def show_vip_benefits(callback: CallbackQuery):
     user_id = callback.from_user.id
-    db.log_interaction(user_id, 'viewed_vip_benefits')
+    await async_db.log_interaction(user_id, 'viewed_vip_benefits')
     
     vip_text = """🎯 *Преимущества VIP:*
 
@@ -340,7 +784,7 @@ https://nmofficialru.com/o2o7sqk1265d
 @dp.callback_query(F.data == "has_broker")
 async def show_has_broker_options(callback: CallbackQuery):
     user_id = callback.from_user.id
-    db.log_interaction(user_id, 'selected_has_broker')
+    await async_db.log_interaction(user_id, 'selected_has_broker')
     
     broker_text = """📈 *VIP группа Скальпинг Золото* 🥇 3-7 сигналов в день 
 
@@ -364,7 +808,7 @@ async def show_has_broker_options(callback: CallbackQuery):
 @dp.callback_query(F.data == "make_payment")
 async def show_payment_instructions(callback: CallbackQuery):
     user_id = callback.from_user.id
-    db.log_interaction(user_id, 'clicked_make_payment')
+    await async_db.log_interaction(user_id, 'clicked_make_payment')
     
     payment_text = """💳 *Для оформления оплаты:*
 
@@ -387,7 +831,7 @@ async def show_payment_instructions(callback: CallbackQuery):
 async def show_completed_registration(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     user = callback.from_user
-    db.log_interaction(user_id, 'selected_completed_registration')
+    await async_db.log_interaction(user_id, 'selected_completed_registration')
     
     registration_text = """После регистрации отправьте мне следующую информацию:
 
@@ -422,8 +866,8 @@ async def handle_registration_data(message: types.Message, state: FSMContext):
     user_data_text = message.text
     
     # Сохраняем данные в базу
-    db.save_registration_data(user_id, user_data_text)
-    db.log_interaction(user_id, 'submitted_registration_data', user_data_text)
+    await async_db.save_registration_data(user_id, user_data_text)
+    await async_db.log_interaction(user_id, 'submitted_registration_data', user_data_text)
     
     # Формируем информацию о пользователе для админа
     user_info = f"ID: {user.id}\n" \
@@ -453,14 +897,15 @@ async def handle_registration_data(message: types.Message, state: FSMContext):
 @dp.callback_query(F.data.startswith("start_dialog_"))
 async def handle_start_dialog(callback: CallbackQuery, state: FSMContext):
     """Обрабатывает нажатие кнопки 'Начать диалог' админом"""
-    if str(callback.from_user.id) != ADMIN_ID:
+    if not is_admin(callback.from_user.id):
         await callback.answer("❌ У вас нет прав для этого действия", show_alert=True)
         return
     
     user_id = int(callback.data.replace("start_dialog_", ""))
     
-    # Начинаем диалог
-    active_dialogs[user_id] = ADMIN_ID
+    # Начинаем диалог (dialog_started отменяет напоминания пользователю)
+    await dialogs.open(user_id, callback.from_user.id)
+    await async_db.log_interaction(user_id, 'dialog_started')
     await state.set_state(AdminStates.in_dialog)
     await state.update_data(target_user_id=user_id)
     
@@ -474,14 +919,15 @@ async def handle_start_dialog(callback: CallbackQuery, state: FSMContext):
     )
     
     # Уведомляем пользователя
-    try:
-        await bot.send_message(
-            chat_id=user_id,
-            text="💬 *Менеджер подключился к чату*\n\nТеперь вы можете общаться напрямую!",
-            parse_mode='Markdown'
-        )
-    except Exception as e:
-        await callback.message.answer(f"❌ Не удалось уведомить пользователя: {e}")
+    status = await outbox.send_message(
+        chat_id=user_id,
+        text="💬 *Менеджер подключился к чату*\n\nТеперь вы можете общаться напрямую!",
+        parse_mode='Markdown',
+        priority=PRIORITY_DIALOG,
+        wait=True
+    )
+    if status not in ('sent', 'pending'):
+        await callback.message.answer(f"❌ Не удалось уведомить пользователя: {OUTBOX_STATUS_TEXT.get(status, status)}")
     
     await callback.answer("Диалог начат!")
 
@@ -489,15 +935,21 @@ async def handle_start_dialog(callback: CallbackQuery, state: FSMContext):
 @dp.callback_query(F.data.startswith("close_dialog_"))
 async def handle_close_dialog(callback: CallbackQuery):
     """Обрабатывает нажатие кнопки 'Закрыть' админом"""
-    if str(callback.from_user.id) != ADMIN_ID:
+    if not is_admin(callback.from_user.id):
         await callback.answer("❌ У вас нет прав для этого действия", show_alert=True)
         return
     
     user_id = int(callback.data.replace("close_dialog_", ""))
     
+    # Кнопка приходит всем админам - чужой активный диалог не закрываем
+    dialog_admin_id = dialogs.admin_for(user_id)
+    if dialog_admin_id is not None and dialog_admin_id != callback.from_user.id:
+        await callback.answer("❌ С этим пользователем уже ведет диалог другой админ", show_alert=True)
+        return
+    
     # Закрываем диалог
-    if user_id in active_dialogs:
-        del active_dialogs[user_id]
+    if dialog_admin_id is not None:
+        await dialogs.close(user_id)
     
     await callback.message.edit_reply_markup(reply_markup=None)
     await callback.message.answer(f"❌ Диалог с пользователем {user_id} закрыт")
@@ -507,17 +959,14 @@ async def handle_close_dialog(callback: CallbackQuery):
 @dp.message(Command("stop_dialog"))
 async def stop_dialog_command(message: types.Message, state: FSMContext):
     """Завершает текущий диалог"""
-    if str(message.from_user.id) != ADMIN_ID:
+    if not is_admin(message.from_user.id):
         return
     
     current_state = await state.get_state()
     
-    # Проверяем есть ли активный диалог
-    active_dialog_user_id = None
-    for user_id, admin_id in active_dialogs.items():
-        if str(admin_id) == ADMIN_ID:
-            active_dialog_user_id = user_id
-            break
+    # Проверяем есть ли активный диалог (последний активный диалог этого админа)
+    admin_users = dialogs.users_for(message.from_user.id)
+    active_dialog_user_id = admin_users[0] if admin_users else None
     
     if not active_dialog_user_id and current_state != AdminStates.in_dialog:
         await message.answer("❌ Сейчас нет активного диалога")
@@ -525,20 +974,27 @@ async def stop_dialog_command(message: types.Message, state: FSMContext):
     
     # Получаем ID пользователя из состояния или из активных диалогов
     data = await state.get_data()
-    target_user_id = data.get('target_user_id') or active_dialog_user_id
-    
-    if target_user_id and target_user_id in active_dialogs:
-        del active_dialogs[target_user_id]
+    target_user_id = data.get('target_user_id')
+    if dialogs.admin_for(target_user_id) != message.from_user.id:
+        # Диалог из состояния уже закрыт или его перехватил другой админ
+        target_user_id = active_dialog_user_id
     
     await state.clear()
     
+    if not target_user_id:
+        await message.answer("✅ Режим диалога завершен (активного диалога у вас нет)")
+        return
+    
+    await dialogs.close(target_user_id)
+    
     # Уведомляем пользователя С КНОПКОЙ "НАЧАТЬ"
     try:
-        await bot.send_message(
+        await outbox.send_message(
             chat_id=target_user_id,
             text="💬 *Диалог с менеджером завершен*\n\nСпасибо за общение! Если у вас остались вопросы, используйте кнопку 'Начать'.",
             parse_mode='Markdown',
-            reply_markup=start_keyboard
+            reply_markup=start_keyboard,
+            priority=PRIORITY_DIALOG
         )
     except Exception as e:
         logging.error(f"Ошибка уведомления пользователя: {e}")
@@ -549,7 +1005,7 @@ async def stop_dialog_command(message: types.Message, state: FSMContext):
 @dp.message(AdminStates.in_dialog)
 async def handle_admin_dialog_message(message: types.Message, state: FSMContext):
     """Обрабатывает сообщения админа в режиме диалога"""
-    if str(message.from_user.id) != ADMIN_ID:
+    if not is_admin(message.from_user.id):
         return
     
     # Если админ отправил команду /stop_dialog во время диалога
@@ -560,22 +1016,28 @@ async def handle_admin_dialog_message(message: types.Message, state: FSMContext)
     data = await state.get_data()
     target_user_id = data.get('target_user_id')
     
-    if not target_user_id or target_user_id not in active_dialogs:
+    if not target_user_id or dialogs.admin_for(target_user_id) != message.from_user.id:
         await message.answer("❌ Диалог не активен. Используйте /stop_dialog для выхода.")
         return
     
-    try:
-        # Отправляем сообщение пользователю от имени бота
-        await bot.send_message(
-            chat_id=target_user_id,
-            text=message.text
-        )
-        
-        # Логируем сообщение админа
-        db.log_interaction(target_user_id, 'admin_message', message.text)
-        
-    except Exception as e:
-        await message.answer(f"❌ Ошибка отправки сообщения: {e}")
+    await dialogs.touch(target_user_id)
+    
+    # Отправляем сообщение пользователю от имени бота
+    status = await outbox.send_message(
+        chat_id=target_user_id,
+        text=message.text,
+        priority=PRIORITY_DIALOG,
+        wait=True
+    )
+    
+    if status == 'pending':
+        await message.answer("⏳ Сообщение не доставлено сразу - бот повторит отправку")
+    elif status != 'sent':
+        await message.answer(f"❌ Ошибка отправки сообщения: {OUTBOX_STATUS_TEXT.get(status, status)}")
+        return
+    
+    # Логируем сообщение админа
+    await async_db.log_interaction(target_user_id, 'admin_message', message.text)
 
 # Обработка сообщений пользователей (пересылка админу если есть активный диалог)
 @dp.message()
@@ -589,7 +1051,10 @@ async def handle_user_messages(message: types.Message):
         return
     
     # Если у пользователя активный диалог с админом
-    if user_id in active_dialogs:
+    dialog_admin_id = dialogs.admin_for(user_id)
+    if dialog_admin_id is not None:
+        await dialogs.touch(user_id)
+        
         # Пересылаем сообщение админу
         user_info = f"👤 Пользователь: {message.from_user.first_name} (ID: {user_id})"
         if message.from_user.username:
@@ -598,55 +1063,111 @@ async def handle_user_messages(message: types.Message):
         admin_message = f"💬 Сообщение от пользователя:\n\n{user_data_text}\n\n{user_info}"
         
         try:
-            await bot.send_message(
-                chat_id=ADMIN_ID,
-                text=admin_message
+            await outbox.send_message(
+                chat_id=dialog_admin_id,
+                text=admin_message,
+                priority=PRIORITY_DIALOG
             )
             
             # Логируем сообщение пользователя
-            db.log_interaction(user_id, 'user_message_dialog', user_data_text)
+            await async_db.log_interaction(user_id, 'user_message_dialog', user_data_text)
             
         except Exception as e:
             logging.error(f"Ошибка пересылки сообщения админу: {e}")
     
     else:
         # Стандартная обработка для пользователей без активного диалога
-        db.log_interaction(user_id, 'sent_message', user_data_text)
+        await async_db.log_interaction(user_id, 'sent_message', user_data_text)
         response_text = "🤖 Я бот для подключения к VIP сигналам по золоту.\n\nИспользуйте кнопку 'Начать' для навигации."
         await message.answer(response_text, reply_markup=start_keyboard)
 
-# Фоновая задача для напоминаний
-async def check_reminders():
+# Отправка наступившего напоминания (вызывается планировщиком)
+async def send_reminder(reminder):
+    user_id = reminder['user_id']
+    reminder_type = reminder['reminder_type']
+    first_name = reminder['first_name']
+    
+    if reminder_type == "30_hours":
+        message_text = f"👋 Привет, {first_name}! Я зарезервировал одно место в VIP, жду ответа 🙏"
+    elif reminder_type == "72_hours":
+        message_text = f"🤝 Привет, {first_name}! Я все еще держу место для тебя, отпишись как будешь готов 🤝"
+    else:
+        return
+    
+    # reminder_sent_* запишется в interactions только после доставки
+    outbox_id = await outbox.send_message(
+        chat_id=user_id,
+        text=message_text,
+        reply_markup=start_keyboard,
+        priority=PRIORITY_BULK,
+        dedupe_key=f"reminder:{reminder['id']}",
+        sent_action=f"reminder_sent_{reminder_type}"
+    )
+    
+    if outbox_id:
+        logging.info(f"Напоминание {reminder_type} для пользователя {user_id} поставлено в очередь")
+
+reminder_scheduler = ReminderScheduler(async_db, send_reminder)
+
+# Фоновая задача для записи буфера взаимодействий
+async def flush_interactions_periodically():
     while True:
+        await asyncio.sleep(async_db.flush_interval)
         try:
-            reminders = db.get_pending_reminders()
-            for reminder in reminders:
-                try:
-                    user_id = reminder['user_id']
-                    reminder_type = reminder['reminder_type']
-                    first_name = reminder['first_name']
-                    
-                    if reminder_type == "30_hours":
-                        message_text = f"👋 Привет, {first_name}! Я зарезервировал одно место в VIP, жду ответа 🙏"
-                    elif reminder_type == "72_hours":
-                        message_text = f"🤝 Привет, {first_name}! Я все еще держу место для тебя, отпишись как будешь готов 🤝"
-                    else:
-                        continue
-                    
-                    await bot.send_message(chat_id=user_id, text=message_text, reply_markup=start_keyboard)
-                    db.mark_reminder_sent(reminder['id'])
-                    db.log_interaction(user_id, f"reminder_sent_{reminder_type}")
-                    
-                    logging.info(f"Отправлено напоминание {reminder_type} пользователю {user_id}")
-                    
-                except Exception as e:
-                    logging.error(f"Ошибка отправки напоминания: {e}")
+            await async_db.flush_interactions()
+            # Напоминания разблокированных пользователей снова ждут отправки - сообщаем планировщику
+            for reminder_id, scheduled_time in await async_db.take_rearmed_reminders():
+                reminder_scheduler.notify(reminder_id, scheduled_time)
         except Exception as e:
-            logging.error(f"Ошибка в обработчике напоминаний: {e}")
-        
-        await asyncio.sleep(60)
+            logging.error(f"Ошибка записи буфера взаимодействий: {e}")
+
+async def archive_interactions_periodically(interval=24 * 3600, chunk_pause=0.1):
+    """Раз в сутки переносим старые взаимодействия в архив и освобождаем место.
 
-async def main():
+    Каждая порция - отдельный вызов в потоке записи БД, между порциями
+    пауза: накопившиеся /start, буфер взаимодействий и FSM успевают записаться.
+    """
+    while True:
+        try:
+            cutoff = archive_cutoff(INTERACTIONS_RETENTION_DAYS)
+            moved = 0
+            while True:
+                count = await async_db.archive_interactions_chunk(cutoff)
+                if not count:
+                    break
+                moved += count
+                await asyncio.sleep(chunk_pause)
+            if moved:
+                logging.info(f"🗄 В архив перенесено взаимодействий: {moved} (старше {cutoff})")
+                await async_db.compact_database()
+        except Exception as e:
+            logging.error(f"Ошибка архивации взаимодействий: {e}")
+        await asyncio.sleep(interval)
+
+async def start_services(background_tasks=True):
+    """Запускаем очередь исходящих сообщений и фоновые задачи"""
+    outbound.start()
+    await dialogs.load()
+    # Повторы outbox безопасны и при нескольких процессах: сообщения забираются с арендой
+    outbox.start()
+    if background_tasks:
+        await broadcast_engine.resume_unfinished()
+        asyncio.create_task(dialogs.run_expiry())
+        asyncio.create_task(reminder_scheduler.run())
+        asyncio.create_task(archive_interactions_periodically())
+        asyncio.create_task(run_retention_nightly(async_db))
+    asyncio.create_task(flush_interactions_periodically())
+
+async def stop_services():
+    """Досылаем очередь и сбрасываем буферы перед выходом"""
+    if query_profiler.enabled:
+        logging.info(query_profiler.format_report(with_plans=False))
+    await outbox.stop()
+    await outbound.stop()
+    await storage.close()
+    async_db.close()
+
+async def main(mode='polling', webhook_url=None, host='0.0.0.0', port=8080, webhook_path='/webhook'):
     # Проверяем токен бота
     try:
         bot_info = await bot.get_me()
@@ -656,28 +1177,75 @@ async def main():
         return
     
     # Создаем таблицы
-    db.create_tables()
+    if not await async_db.migrate():
+        print("❌ Ошибка миграции базы данных, бот не запущен")
+        return
     print("✅ База данных готова")
     
-    # Запускаем фоновую задачу для напоминаний
-    asyncio.create_task(check_reminders())
+    # Запускаем очередь исходящих сообщений и фоновую задачу для напоминаний
+    await start_services()
     
     print("🟢 Бот запущен и готов к работе!")
     print("🔍 Найдите бота в Telegram и отправьте /start или нажмите кнопку 'Начать'")
     print("⏰ Система напоминаний активирована")
     print("⏳ Напоминания: 30ч → 1-е, 72ч → 2-е")
     print("👨‍💼 Менеджер: https://t.me/m/XCFTGFzeNzVi")
-    print(f"📨 Уведомления админу: {ADMIN_ID}")
+    print(f"📨 Уведомления админам: {', '.join(map(str, ADMIN_IDS))}")
     print("🔄 Кнопка 'Начать' всегда доступна внизу экрана")
     print("💬 Система диалогов активирована")
     print("📊 Команды статистики для админа:")
     print("   /stats - общая статистика за сегодня")
-    print("   /user_stats <user_id> - статистика по пользователю") 
-    print("   /new_users - новые пользователи за сегодня")
+    print("   /user_stats <user_id> [с] [по] - статистика по пользователю") 
+    print("   /new_users [с] [по] - новые пользователи (по умолчанию за сегодня)")
+    print("   /funnel [с] [по] - воронка конверсии (по умолчанию за 7 дней)")
+    print("   /retention [N] - удержание когорт D1/D3/D7")
+    print("   /broadcast <текст> - рассылка всем пользователям")
+    print("   /export <таблица> [csv|jsonl] - выгрузка данных файлом")
+    print("   /perf - задержки обработчиков, БД и Bot API")
+    print("   /slow_queries - самые тяжелые запросы к БД (при DB_SLOW_QUERY_MS)")
+    print("   /antiflood - ограничение частоты сообщений и его память")
+    print("   /outbox - очередь надежной отправки и ошибки доставки")
+    print("   /reminders - напоминания: ожидают, отправлены, отменены")
     print("   /stop_dialog - завершить диалог")
     
+    metrics_runner = None
+    if METRICS_PORT and perf.enabled:
+        metrics_runner = await start_metrics_server(host, int(METRICS_PORT))
+    
     # Запускаем бота
-    await dp.start_polling(bot)
+    try:
+        if mode == 'webhook':
+            print(f"🌐 Режим webhook: {webhook_url}")
+            await run_webhook(bot, dp, webhook_url, host=host, port=port, path=webhook_path, secret_token=WEBHOOK_SECRET)
+        else:
+            # Long polling не работает, пока установлен webhook
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await stop_services()
+        print("💾 Буфер взаимодействий записан")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Telegram бот VIP сигналов")
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default=os.getenv('BOT_MODE', 'polling'),
+                        help="способ получения апдейтов")
+    parser.add_argument('--webhook-url', default=os.getenv('WEBHOOK_URL'), help="публичный URL webhook")
+    parser.add_argument('--host', default=os.getenv('WEBHOOK_HOST', '0.0.0.0'), help="адрес локального сервера")
+    parser.add_argument('--port', type=int, default=int(os.getenv('WEBHOOK_PORT', '8080')), help="порт локального сервера")
+    parser.add_argument('--webhook-path', default=os.getenv('WEBHOOK_PATH', '/webhook'), help="путь webhook на сервере")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('BOT_WORKERS', '1')),
+                        help="число процессов-обработчиков (больше 1 - шардирование по пользователям)")
+    args = parser.parse_args()
+    
+    if args.mode == 'webhook' and not args.webhook_url:
+        parser.error("для режима webhook нужен --webhook-url (или WEBHOOK_URL)")
+    
+    if args.workers > 1:
+        if args.mode != 'polling':
+            parser.error("шардирование по процессам поддерживается только в режиме polling")
+        from sharding import run_sharded
+        run_sharded(args.workers)
+    else:
+        asyncio.run(main(args.mode, args.webhook_url, args.host, args.port, args.webhook_path))
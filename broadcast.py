@@ -0,0 +1,139 @@
+# broadcast.py
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.methods import EditMessageText
+
+from outbound import PRIORITY_BULK, PRIORITY_NORMAL
+
+logger = logging.getLogger(__name__)
+
+# Ответы Telegram, после которых писать пользователю бессмысленно
+BLOCKED_ERRORS = ('chat not found', 'user is deactivated', 'bot was blocked')
+
+class BroadcastEngine:
+    """Рассылка сообщения всем пользователям.
+
+    Получатели читаются из SQLite страницами по keyset-курсору user_id,
+    страница отправляется параллельно через очередь исходящих (она держит
+    лимиты Telegram), результаты по каждому получателю сохраняются в
+    broadcast_deliveries. После перезапуска рассылка продолжается с места
+    остановки, а заблокировавшие бота пользователи пропускаются.
+    """
+
+    def __init__(self, bot, database, outbound, page_size=30, progress_interval=5):
+        self.bot = bot
+        self.database = database
+        self.outbound = outbound
+        self.page_size = page_size
+        self.progress_interval = progress_interval
+        self.tasks = {}
+
+    async def start(self, admin_chat_id, text):
+        """Создаем рассылку и запускаем ее в фоне"""
+        job = await self.database.create_broadcast_job(text, admin_chat_id)
+        if not job:
+            return None
+        progress = await self.outbound.send_message(
+            admin_chat_id, self._format_progress(job, 0, 0), priority=PRIORITY_NORMAL
+        )
+        await self.database.set_broadcast_progress_message(job['id'], progress.message_id)
+        job['progress_message_id'] = progress.message_id
+        self._spawn(job)
+        return job
+
+    async def resume_unfinished(self):
+        """Продолжаем рассылки, прерванные перезапуском бота"""
+        for job in await self.database.get_unfinished_broadcast_jobs():
+            logger.info(f"📣 Возобновляем рассылку #{job['id']} с user_id > {job['last_user_id']}")
+            self._spawn(job)
+
+    def _spawn(self, job):
+        if job['id'] not in self.tasks:
+            task = asyncio.create_task(self.run(job))
+            self.tasks[job['id']] = task
+            task.add_done_callback(lambda _: self.tasks.pop(job['id'], None))
+
+    async def run(self, job):
+        job_id = job['id']
+        cursor = job['last_user_id']
+        started = time.monotonic()
+        done_at_start = job['sent'] + job['failed'] + job['blocked']
+        last_progress = started
+
+        try:
+            while True:
+                page = await self.database.get_broadcast_recipients(job_id, cursor, self.page_size)
+                if not page:
+                    break
+
+                statuses = await asyncio.gather(*(self._deliver(user_id, job['text']) for user_id in page))
+                cursor = page[-1]
+                updated = await self.database.record_broadcast_deliveries(job_id, list(zip(page, statuses)), cursor)
+                if updated:
+                    job = updated
+
+                if time.monotonic() - last_progress >= self.progress_interval:
+                    last_progress = time.monotonic()
+                    done = job['sent'] + job['failed'] + job['blocked']
+                    await self._update_progress(job, done - done_at_start, last_progress - started)
+
+            await self.database.finish_broadcast_job(job_id)
+            job = await self.database.get_broadcast_job(job_id) or job
+            done = job['sent'] + job['failed'] + job['blocked']
+            await self._update_progress(job, done - done_at_start, time.monotonic() - started)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка рассылки #{job_id}: {e}")
+
+    async def _deliver(self, user_id, text):
+        """Отправка одному получателю, возвращает статус для broadcast_deliveries"""
+        try:
+            await self.outbound.send_message(user_id, text, priority=PRIORITY_BULK)
+            return 'sent'
+        except TelegramForbiddenError:
+            return 'blocked'
+        except TelegramBadRequest as e:
+            if any(error in str(e).lower() for error in BLOCKED_ERRORS):
+                return 'blocked'
+            logger.warning(f"⚠️ Рассылка: ошибка отправки {user_id}: {e}")
+            return 'failed'
+        except Exception as e:
+            logger.warning(f"⚠️ Рассылка: ошибка отправки {user_id}: {e}")
+            return 'failed'
+
+    def _format_progress(self, job, processed, elapsed):
+        done = job['sent'] + job['failed'] + job['blocked']
+        total = max(job['total'], done)
+        text = f"📣 Рассылка #{job['id']}\n\n" \
+               f"✅ Отправлено: {job['sent']} из {total}\n" \
+               f"⚠️ Ошибок: {job['failed']}\n" \
+               f"🚫 Заблокировали бота: {job['blocked']}\n"
+
+        if job['status'] != 'running':
+            return text + "\n🏁 Рассылка завершена"
+
+        if processed and elapsed > 0:
+            speed = processed / elapsed
+            eta = int((total - done) / speed) if speed else 0
+            text += f"\n⚡ Скорость: {speed:.1f} сообщ./с\n⏳ Осталось: ~{eta // 60} мин {eta % 60} с"
+        return text
+
+    async def _update_progress(self, job, processed, elapsed):
+        """Редактируем одно сообщение с прогрессом вместо новых сообщений"""
+        if not job.get('progress_message_id'):
+            return
+        try:
+            await self.outbound.send(EditMessageText(
+                chat_id=job['admin_chat_id'],
+                message_id=job['progress_message_id'],
+                text=self._format_progress(job, processed, elapsed)
+            ), priority=PRIORITY_NORMAL)
+        except TelegramBadRequest as e:
+            # "message is not modified" и подобное не мешает рассылке
+            logger.debug(f"Прогресс рассылки не обновлен: {e}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления прогресса рассылки: {e}")
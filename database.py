@@ -1,79 +1,226 @@
 # database.py
 import sqlite3
 import logging
+import asyncio
+import functools
+import threading
+import time
+import queue
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import os
 
+from migrations import apply_migrations, get_schema_version
+from perf import perf
+from query_profiler import connection_factory
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def day_range(date_from, date_to=None):
+    """Полуоткрытый интервал дат [date_from, date_to + 1 день) в виде строк.
+
+    Сравнение `timestamp >= start AND timestamp < end` позволяет SQLite
+    использовать индекс, в отличие от `DATE(timestamp) = DATE(?)`.
+    """
+    start = datetime.fromisoformat(str(date_from)[:10])
+    end = datetime.fromisoformat(str(date_to or date_from)[:10]) + timedelta(days=1)
+    return start.date().isoformat(), end.date().isoformat()
+
+# Старые взаимодействия переносятся в помесячные таблицы interactions_archive_YYYY_MM
+ARCHIVE_TABLE_PREFIX = 'interactions_archive_'
+INTERACTION_COLUMNS = 'id, user_id, action, data, timestamp'
+
+# Через сколько дней после первого /start проверяем возврат пользователя
+RETENTION_OFFSETS = (1, 3, 7)
+
+# После этих действий напоминания пользователю не нужны - отменяем ожидающие
+REMINDER_CANCEL_ACTIONS = frozenset({'submitted_registration_data', 'clicked_make_payment', 'dialog_started'})
+
+# Действия, которые пишутся под user_id пользователя, но совершает их не он
+# (админ, бот, антифлуд) - не считаются его активностью
+NON_USER_ACTIONS = frozenset({'admin_message', 'dialog_started', 'flood_dropped'})
+NON_USER_ACTION_PREFIXES = ('reminder_sent_',)
+
+def is_user_action(action):
+    """Действие совершил сам пользователь (входящий апдейт от него)"""
+    return action not in NON_USER_ACTIONS and not action.startswith(NON_USER_ACTION_PREFIXES)
+
+def user_action_condition(column='action'):
+    """SQL-условие is_user_action для колонки действия (значения - константы выше)"""
+    excluded = ', '.join(f"'{action}'" for action in sorted(NON_USER_ACTIONS))
+    prefixes = ' '.join(f"AND {column} NOT LIKE '{prefix}%'" for prefix in NON_USER_ACTION_PREFIXES)
+    return f"{column} NOT IN ({excluded}) {prefixes}"
+
+def archive_cutoff(retention_days):
+    """Дата, взаимодействия раньше которой переносятся в архив"""
+    return (datetime.now() - timedelta(days=retention_days)).date().isoformat()
+
+def month_bounds(timestamp):
+    """Первый день месяца и первый день следующего месяца для метки времени"""
+    year, month = int(timestamp[:4]), int(timestamp[5:7])
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return f"{year:04d}-{month:02d}-01", f"{next_year:04d}-{next_month:02d}-01"
+
+# Настройки SQLite: WAL позволяет читать снапшот, не блокируя писателя
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-20000',
+    'PRAGMA busy_timeout=5000',
+]
+
+class ReadConnectionPool:
+    """Небольшой пул read-only соединений для тяжелых аналитических запросов"""
+
+    def __init__(self, db_path, size=4):
+        self.db_path = db_path
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def _open(self):
+        uri = Path(self.db_path).resolve().as_uri() + '?mode=ro'
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, factory=connection_factory())
+        conn.row_factory = sqlite3.Row
+        for pragma in SQLITE_PRAGMAS[2:]:
+            conn.execute(pragma)
+        conn.execute('PRAGMA query_only=ON')
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Берем соединение из пула (или ждем освобождения, если все заняты)"""
+        conn = None
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                can_open = self.created < self.size
+                if can_open:
+                    self.created += 1
+            if can_open:
+                try:
+                    conn = self._open()
+                except Exception:
+                    with self.lock:
+                        self.created -= 1
+                    raise
+            else:
+                conn = self.idle.get()
+        
+        try:
+            yield conn
+        finally:
+            # Завершаем транзакцию чтения, чтобы следующий запрос видел свежий снапшот
+            conn.rollback()
+            self.idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+class UserCache:
+    """Ограниченный LRU-кеш известных пользователей: user_id -> число взаимодействий.
+
+    Заполняется только в register_start (пользователь точно есть в users).
+    Счетчик включает события, которые еще лежат в буфере, поэтому повторный
+    /start не делает COUNT(*) по interactions.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.counts = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.lock:
+            count = self.counts.get(user_id)
+            if count is not None:
+                self.counts.move_to_end(user_id)
+            return count
+
+    def put(self, user_id, count):
+        with self.lock:
+            self.counts[user_id] = count
+            self.counts.move_to_end(user_id)
+            if len(self.counts) > self.max_size:
+                self.counts.popitem(last=False)
+
+    def increment(self, user_id):
+        with self.lock:
+            if user_id in self.counts:
+                self.counts[user_id] += 1
+
 class Database:
-    def __init__(self, db_path='bot_database.db'):
+    # Тяжелые запросы только на чтение: выполняются через пул read-only соединений
+    READ_METHODS = frozenset({
+        'get_today_stats', 'get_user_stats_page', 'get_new_users_page', 'get_funnel_masks', 'get_retention',
+        'get_reminder_stats', 'aggregate_retention'
+    })
+    
+    def __init__(self, db_path='bot_database.db', batch_size=100, flush_interval=0.5, read_pool_size=4, user_cache_size=10000,
+                 max_pending_interactions=10000):
         self.db_path = db_path
         self.conn = None
+        self.read_pool = ReadConnectionPool(db_path, read_pool_size)
+        self.user_cache = UserCache(user_cache_size)
+        # Буфер взаимодействий: пишем пачкой через executemany в одной транзакции
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending_interactions = []
+        self.buffer_lock = threading.Lock()
+        # Если запись долго не проходит (БД заблокирована), буфер не растет
+        # дальше max_pending_interactions: самые старые события отбрасываются
+        self.max_pending_interactions = max_pending_interactions
+        self.dropped_interactions = 0
+        # Напоминания, снова ожидающие отправки после разблокировки: (id, время) для планировщика
+        self.rearmed_reminders = []
+        # Напоминания, не созданные повторно из-за UNIQUE (user_id, reminder_type), с запуска
+        self.reminder_duplicates = 0
         self.connect()
     
     def connect(self):
         """Подключаемся к базе данных"""
         try:
-            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            # При заданном DB_SLOW_QUERY_MS соединение замеряет каждый запрос
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False, factory=connection_factory())
             self.conn.row_factory = sqlite3.Row
+            # Для новой (пустой) БД включаем инкрементальное освобождение места;
+            # на существующей БД режим меняет только VACUUM (см. compact_database)
+            self.conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            for pragma in SQLITE_PRAGMAS:
+                self.conn.execute(pragma)
             logger.info("✅ Подключение к SQLite установлено")
         except Exception as e:
             logger.error(f"❌ Ошибка подключения к SQLite: {e}")
     
-    def create_tables(self):
-        """Создаем таблицы если их нет"""
+    def migrate(self):
+        """Создаем/обновляем схему через версионированные миграции"""
         try:
-            cursor = self.conn.cursor()
-            
-            # Таблица пользователей
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER UNIQUE NOT NULL,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    source TEXT,
-                    registration_data TEXT,
-                    registration_date TEXT,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Таблица взаимодействий
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS interactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    action TEXT NOT NULL,
-                    data TEXT,
-                    timestamp TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Таблица напоминаний
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS reminders (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    reminder_type TEXT NOT NULL,
-                    scheduled_time TEXT NOT NULL,
-                    sent BOOLEAN DEFAULT FALSE,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            self.conn.commit()
-            logger.info("✅ SQLite таблицы созданы/проверены")
-            
+            applied = apply_migrations(self.conn)
+            version = get_schema_version(self.conn)
+            if applied:
+                logger.info(f"✅ Схема обновлена до версии {version}")
+            else:
+                logger.info(f"✅ Схема актуальна (версия {version})")
+            return True
         except Exception as e:
-            logger.error(f"❌ Ошибка создания таблиц: {e}")
+            logger.error(f"❌ Ошибка миграции базы данных: {e}")
+            return False
     
     def add_user(self, user_data):
         """Добавляем пользователя"""
         try:
+            created_at = datetime.now().isoformat()
             cursor = self.conn.cursor()
             cursor.execute('''
                 INSERT OR IGNORE INTO users 
@@ -85,10 +232,16 @@ class Database:
                 user_data.get('first_name'),
                 user_data.get('last_name'),
                 user_data.get('source', 'start_command'),
-                datetime.now().isoformat()
+                created_at
             ))
             
             is_new = cursor.rowcount > 0
+            if is_new:
+                # Счетчик новых пользователей обновляется в той же транзакции
+                cursor.execute('''
+                    INSERT INTO daily_user_counts (day, new_users) VALUES (?, 1)
+                    ON CONFLICT(day) DO UPDATE SET new_users = new_users + 1
+                ''', (created_at[:10],))
             self.conn.commit()
             
             if is_new:
@@ -102,17 +255,280 @@ class Database:
             logger.error(f"❌ Ошибка добавления пользователя: {e}")
             return False
     
-    def log_interaction(self, user_id, action, data=None):
-        """Логируем взаимодействие"""
+    def import_users(self, users):
+        """Массовая загрузка пользователей (например, из users.json) одной транзакцией.
+
+        Новые пользователи добавляются через executemany во временную таблицу
+        и переносятся в users одним INSERT ... SELECT вместе с дневными
+        счетчиками; у существующих заполняются только пустые данные регистрации.
+        Возвращает (добавлено, обновлено).
+        """
+        rows = [
+            (
+                user.get('user_id'), user.get('username'), user.get('first_name'),
+                user.get('last_name'), user.get('source'), user.get('registration_data'),
+                user.get('registration_date'), user.get('created_at') or datetime.now().isoformat()
+            )
+            for user in users if user.get('user_id') is not None
+        ]
         try:
             cursor = self.conn.cursor()
+            cursor.execute('DROP TABLE IF EXISTS temp.users_import')
             cursor.execute('''
-                INSERT INTO interactions (user_id, action, data, timestamp)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, action, data, datetime.now().isoformat()))
-            self.conn.commit()
+                CREATE TEMP TABLE users_import (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT,
+                    first_name TEXT,
+                    last_name TEXT,
+                    source TEXT,
+                    registration_data TEXT,
+                    registration_date TEXT,
+                    created_at TEXT
+                )
+            ''')
+            with self.conn:
+                # Повтор user_id в файле - берем последнюю запись
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO users_import 
+                    (user_id, username, first_name, last_name, source, registration_data, registration_date, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', rows)
+                
+                cursor.execute('''
+                    INSERT INTO daily_user_counts (day, new_users)
+                    SELECT substr(i.created_at, 1, 10), COUNT(*) FROM users_import i
+                    WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = i.user_id)
+                    GROUP BY 1
+                    ON CONFLICT(day) DO UPDATE SET new_users = new_users + excluded.new_users
+                ''')
+                cursor.execute('''
+                    INSERT INTO users 
+                    (user_id, username, first_name, last_name, source, registration_data, registration_date, created_at)
+                    SELECT user_id, username, first_name, last_name, source, registration_data, registration_date, created_at
+                    FROM users_import i
+                    WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = i.user_id)
+                    ORDER BY created_at
+                ''')
+                added = cursor.rowcount
+                
+                cursor.execute('''
+                    UPDATE users SET 
+                        registration_data = i.registration_data,
+                        registration_date = i.registration_date
+                    FROM users_import i
+                    WHERE users.user_id = i.user_id
+                      AND users.registration_data IS NULL AND i.registration_data IS NOT NULL
+                ''')
+                updated = cursor.rowcount
+            
+            cursor.execute('DROP TABLE IF EXISTS temp.users_import')
+            logger.info(f"✅ Импорт пользователей: добавлено {added}, обновлено {updated}")
+            return added, updated
+        except Exception as e:
+            logger.error(f"❌ Ошибка импорта пользователей: {e}")
+            return None
+    
+    def log_interaction(self, user_id, action, data=None):
+        """Логируем взаимодействие (в буфер, запись в БД пачками).
+
+        При полном буфере запись идет тут же, в потоке БД: если БД занята,
+        вызов ждет busy_timeout, и вызывающие (через семафор AsyncDatabase)
+        притормаживают вместе с ним.
+        """
+        with self.buffer_lock:
+            self.pending_interactions.append(
+                (user_id, action, data, datetime.now().isoformat())
+            )
+            buffer_full = len(self.pending_interactions) >= self.batch_size
+        self.user_cache.increment(user_id)
+        
+        if buffer_full:
+            self.flush_interactions()
+    
+    def flush_interactions(self):
+        """Записываем накопленные взаимодействия одной транзакцией"""
+        with self.buffer_lock:
+            rows = self.pending_interactions
+            self.pending_interactions = []
+        
+        if not rows:
+            return 0
+        
+        try:
+            with self.conn:
+                self._insert_interactions(rows)
+            return len(rows)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи взаимодействий ({len(rows)} шт.): {e}")
+            # Возвращаем события в буфер, чтобы не потерять их (в пределах лимита)
+            with self.buffer_lock:
+                self.pending_interactions = rows + self.pending_interactions
+                excess = len(self.pending_interactions) - self.max_pending_interactions
+                if excess > 0:
+                    del self.pending_interactions[:excess]
+                    self.dropped_interactions += excess
+            if excess > 0:
+                logger.error(f"❌ Буфер взаимодействий переполнен: отброшено {excess}, всего с запуска {self.dropped_interactions}")
+            return 0
+    
+    def _insert_interactions(self, rows):
+        """Вставка взаимодействий и дневных счетчиков (в транзакции вызывающего)"""
+        # Счетчики по дням считаем в памяти и пишем в той же транзакции
+        action_counts = Counter((row[3][:10], row[1]) for row in rows)
+        self.conn.executemany('''
+            INSERT INTO interactions (user_id, action, data, timestamp)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+        self.conn.executemany('''
+            INSERT INTO daily_action_counts (day, action, count) VALUES (?, ?, ?)
+            ON CONFLICT(day, action) DO UPDATE SET count = count + excluded.count
+        ''', [(day, action, count) for (day, action), count in action_counts.items()])
+        
+        # Апдейт от пользователя значит, что бот снова не заблокирован
+        active = {row[0] for row in rows if is_user_action(row[1])}
+        if active:
+            self._clear_blocked(active)
+        
+        converted = {row[0]: row[1] for row in rows if row[1] in REMINDER_CANCEL_ACTIONS}
+        if converted:
+            self._cancel_reminders(converted.items())
+    
+    def _clear_blocked(self, user_ids, chunk_size=500):
+        """Снимаем отметку blocked_at с вернувшихся пользователей (в транзакции вызывающего).
+
+        Их напоминания, отмененные из-за блокировки и еще не наступившие,
+        снова ждут отправки: (id, время) копятся в rearmed_reminders, откуда
+        их забирает take_rearmed_reminders для планировщика. Возвращает
+        число разблокированных.
+        """
+        user_ids = list(user_ids)
+        now = datetime.now().isoformat()
+        unblocked = 0
+        rearmed = []
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            placeholders = ', '.join('?' * len(chunk))
+            cursor = self.conn.execute(f'''
+                UPDATE users SET blocked_at = NULL
+                WHERE blocked_at IS NOT NULL AND user_id IN ({placeholders})
+                RETURNING user_id
+            ''', chunk)
+            chunk = [row[0] for row in cursor.fetchall()]
+            if not chunk:
+                continue
+            unblocked += len(chunk)
+            placeholders = ', '.join('?' * len(chunk))
+            cursor = self.conn.execute(f'''
+                UPDATE reminders SET sent = FALSE, cancel_reason = NULL
+                WHERE cancel_reason = 'blocked' AND scheduled_time > ? AND user_id IN ({placeholders})
+                RETURNING id, scheduled_time
+            ''', [now] + chunk)
+            rearmed += [(row[0], datetime.fromisoformat(row[1])) for row in cursor.fetchall()]
+        
+        if rearmed:
+            with self.buffer_lock:
+                self.rearmed_reminders += rearmed
+        if unblocked:
+            logger.info(f"🔓 Снова доступны после блокировки: {unblocked} польз., напоминаний: {len(rearmed)}")
+        return unblocked
+
+    def take_rearmed_reminders(self):
+        """Забираем напоминания, снова ожидающие отправки: [(id, время)]"""
+        with self.buffer_lock:
+            rearmed, self.rearmed_reminders = self.rearmed_reminders, []
+        return rearmed
+    
+    def _cancel_reminders(self, reasons):
+        """Отменяем ожидающие напоминания пачкой (в транзакции вызывающего).
+
+        reasons - пары (user_id, причина). Возвращает число отмененных.
+        """
+        cursor = self.conn.executemany('''
+            UPDATE reminders SET sent = TRUE, cancel_reason = ?
+            WHERE user_id = ? AND sent = FALSE
+        ''', [(reason, user_id) for user_id, reason in reasons])
+        if cursor.rowcount > 0:
+            logger.info(f"🔕 Отменено напоминаний: {cursor.rowcount}")
+        return cursor.rowcount
+    
+    def register_start(self, user_data, reminders=(("30_hours", 30), ("72_hours", 72))):
+        """Обработка /start одной транзакцией.
+
+        Добавляет пользователя, определяет, возвращается ли он, логирует
+        start_command и для новых пользователей планирует напоминания.
+        Возвращает dict: is_new, interaction_count (до этого /start) и
+        scheduled_reminders [(id, время отправки)].
+        """
+        user_id = user_data['user_id']
+        now = datetime.now()
+        created_at = now.isoformat()
+        try:
+            cursor = self.conn.cursor()
+            interaction_count = self.user_cache.get(user_id)
+            is_new = False
+            scheduled_reminders = []
+            
+            with self.conn:
+                if interaction_count is None:
+                    cursor.execute('''
+                        INSERT OR IGNORE INTO users 
+                        (user_id, username, first_name, last_name, source, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', (
+                        user_id,
+                        user_data.get('username'),
+                        user_data.get('first_name'),
+                        user_data.get('last_name'),
+                        user_data.get('source', 'start_command'),
+                        created_at
+                    ))
+                    is_new = cursor.rowcount > 0
+                    
+                    if is_new:
+                        cursor.execute('''
+                            INSERT INTO daily_user_counts (day, new_users) VALUES (?, 1)
+                            ON CONFLICT(day) DO UPDATE SET new_users = new_users + 1
+                        ''', (created_at[:10],))
+                        interaction_count = 0
+                    else:
+                        # Вместе с архивами - как get_user_interactions_count
+                        source = self._interactions_source(cursor)
+                        cursor.execute(f'SELECT COUNT(*) FROM ({source}) WHERE user_id = ?', (user_id,))
+                        interaction_count = cursor.fetchone()[0] + self._pending_interactions_count(user_id)
+                
+                self._insert_interactions([(user_id, 'start_command', None, created_at)])
+                
+                if is_new:
+                    for reminder_type, hours_later in reminders:
+                        scheduled_time = now + timedelta(hours=hours_later)
+                        cursor.execute('''
+                            INSERT INTO reminders (user_id, reminder_type, scheduled_time)
+                            VALUES (?, ?, ?)
+                            ON CONFLICT(user_id, reminder_type) DO NOTHING
+                        ''', (user_id, reminder_type, scheduled_time.isoformat()))
+                        if cursor.rowcount > 0:
+                            scheduled_reminders.append((cursor.lastrowid, scheduled_time))
+                        else:
+                            self.reminder_duplicates += 1
+            
+            self.user_cache.put(user_id, interaction_count + 1)
+            
+            if is_new:
+                logger.info(f"✅ Добавлен новый пользователь: {user_id}")
+            
+            return {
+                'is_new': is_new,
+                'interaction_count': interaction_count,
+                'scheduled_reminders': scheduled_reminders
+            }
         except Exception as e:
-            logger.error(f"❌ Ошибка логирования взаимодействия: {e}")
+            logger.error(f"❌ Ошибка обработки /start для {user_id}: {e}")
+            return {'is_new': False, 'interaction_count': 0, 'scheduled_reminders': []}
+    
+    def _pending_interactions_count(self, user_id):
+        """Количество еще не записанных взаимодействий пользователя"""
+        with self.buffer_lock:
+            return sum(1 for row in self.pending_interactions if row[0] == user_id)
     
     def save_registration_data(self, user_id, data):
         """Сохраняем данные регистрации"""
@@ -129,34 +545,89 @@ class Database:
             logger.error(f"❌ Ошибка сохранения данных регистрации: {e}")
     
     def schedule_reminder(self, user_id, reminder_type, hours_later):
-        """Планируем напоминание"""
+        """Планируем напоминание, возвращаем (id, время отправки) или None, если такое уже есть"""
         try:
             scheduled_time = datetime.now() + timedelta(hours=hours_later)
             cursor = self.conn.cursor()
             cursor.execute('''
                 INSERT INTO reminders (user_id, reminder_type, scheduled_time)
                 VALUES (?, ?, ?)
+                ON CONFLICT(user_id, reminder_type) DO NOTHING
             ''', (user_id, reminder_type, scheduled_time.isoformat()))
             self.conn.commit()
+            if cursor.rowcount <= 0:
+                self.reminder_duplicates += 1
+                return None
             logger.info(f"⏰ Запланировано напоминание {reminder_type} для {user_id}")
+            return cursor.lastrowid, scheduled_time
         except Exception as e:
             logger.error(f"❌ Ошибка планирования напоминания: {e}")
+            return None
     
-    def get_pending_reminders(self):
-        """Получаем ожидающие напоминания"""
+    def get_pending_reminders(self, limit=100):
+        """Получаем ожидающие напоминания (не больше limit, самые ранние)"""
         try:
             cursor = self.conn.cursor()
             cursor.execute('''
                 SELECT r.*, u.first_name 
                 FROM reminders r
                 JOIN users u ON r.user_id = u.user_id
-                WHERE r.sent = FALSE AND r.scheduled_time <= ?
-            ''', (datetime.now().isoformat(),))
+                WHERE r.sent = FALSE AND r.scheduled_time <= ? AND u.blocked_at IS NULL
+                ORDER BY r.scheduled_time
+                LIMIT ?
+            ''', (datetime.now().isoformat(), limit))
             return [dict(row) for row in cursor.fetchall()]
         except Exception as e:
             logger.error(f"❌ Ошибка получения напоминаний: {e}")
             return []
     
+    def get_upcoming_reminders(self, limit=1000):
+        """Ближайшие неотправленные напоминания: [(id, время отправки)]"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                SELECT r.id, r.scheduled_time FROM reminders r
+                JOIN users u ON r.user_id = u.user_id
+                WHERE r.sent = FALSE AND u.blocked_at IS NULL
+                ORDER BY r.scheduled_time
+                LIMIT ?
+            ''', (limit,))
+            return [(row[0], datetime.fromisoformat(row[1])) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки ближайших напоминаний: {e}")
+            return []
+    
+    def claim_due_reminders(self, limit=50):
+        """Забираем пачку наступивших напоминаний и сразу отмечаем их отправленными.
+
+        Выборка и отметка идут в одной транзакции BEGIN IMMEDIATE, поэтому
+        напоминание не будет взято дважды (и не уйдет повторно после падения).
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute('''
+                    SELECT r.*, u.first_name 
+                    FROM reminders r
+                    JOIN users u ON r.user_id = u.user_id
+                    WHERE r.sent = FALSE AND r.scheduled_time <= ? AND u.blocked_at IS NULL
+                    ORDER BY r.scheduled_time
+                    LIMIT ?
+                ''', (datetime.now().isoformat(), limit))
+                reminders = [dict(row) for row in cursor.fetchall()]
+                cursor.executemany('''
+                    UPDATE reminders SET sent = TRUE WHERE id = ?
+                ''', [(reminder['id'],) for reminder in reminders])
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            return reminders
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения напоминаний: {e}")
+            return []
+    
     def mark_reminder_sent(self, reminder_id):
         """Отмечаем напоминание как отправленное"""
         try:
@@ -168,16 +639,252 @@ class Database:
         except Exception as e:
             logger.error(f"❌ Ошибка отметки напоминания: {e}")
     
+    def get_reminder_stats(self):
+        """Напоминания по состояниям: ожидают, отправлены и отменены по причинам"""
+        try:
+            with self.read_pool.connection() as conn:
+                rows = conn.execute('''
+                    SELECT CASE WHEN cancel_reason IS NOT NULL THEN cancel_reason
+                                WHEN sent THEN 'sent' ELSE 'pending' END,
+                           reminder_type, COUNT(*)
+                    FROM reminders GROUP BY 1, 2
+                ''').fetchall()
+            stats = {'pending': Counter(), 'sent': Counter(), 'cancelled': {}}
+            for state, reminder_type, count in rows:
+                if state in ('pending', 'sent'):
+                    stats[state][reminder_type] += count
+                else:
+                    stats['cancelled'].setdefault(state, Counter())[reminder_type] += count
+            stats['duplicates'] = self.reminder_duplicates
+            return stats
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения статистики напоминаний: {e}")
+            return None
+    
+    def mark_user_blocked(self, user_id):
+        """Отмечаем, что пользователь заблокировал бота или удален, и отменяем его напоминания"""
+        try:
+            with self.conn:
+                self.conn.execute('''
+                    UPDATE users SET blocked_at = ? WHERE user_id = ? AND blocked_at IS NULL
+                ''', (datetime.now().isoformat(), user_id))
+                self._cancel_reminders([(user_id, 'blocked')])
+        except Exception as e:
+            logger.error(f"❌ Ошибка отметки заблокировавшего пользователя: {e}")
+    
+    def create_broadcast_job(self, text, admin_chat_id):
+        """Создаем задачу рассылки, возвращаем ее как dict"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM users WHERE blocked_at IS NULL')
+            total = cursor.fetchone()[0]
+            cursor.execute('''
+                INSERT INTO broadcast_jobs (text, admin_chat_id, total, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', (text, admin_chat_id, total, datetime.now().isoformat()))
+            job_id = cursor.lastrowid
+            self.conn.commit()
+            logger.info(f"📣 Создана рассылка #{job_id} на {total} пользователей")
+            return self.get_broadcast_job(job_id)
+        except Exception as e:
+            logger.error(f"❌ Ошибка создания рассылки: {e}")
+            return None
+    
+    def get_broadcast_job(self, job_id):
+        """Получаем задачу рассылки"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT * FROM broadcast_jobs WHERE id = ?', (job_id,))
+            row = cursor.fetchone()
+            return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения рассылки: {e}")
+            return None
+    
+    def get_unfinished_broadcast_jobs(self):
+        """Рассылки, прерванные перезапуском"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT * FROM broadcast_jobs WHERE status = 'running' ORDER BY id")
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения незавершенных рассылок: {e}")
+            return []
+    
+    def set_broadcast_progress_message(self, job_id, message_id):
+        """Запоминаем сообщение, в котором показываем прогресс рассылки"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                UPDATE broadcast_jobs SET progress_message_id = ? WHERE id = ?
+            ''', (message_id, job_id))
+            self.conn.commit()
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения сообщения прогресса: {e}")
+    
+    def get_broadcast_recipients(self, job_id, after_user_id, limit=100):
+        """Следующая страница получателей по keyset-курсору user_id"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                SELECT u.user_id FROM users u
+                WHERE u.user_id > ? AND u.blocked_at IS NULL
+                  AND NOT EXISTS (
+                      SELECT 1 FROM broadcast_deliveries d
+                      WHERE d.job_id = ? AND d.user_id = u.user_id
+                  )
+                ORDER BY u.user_id
+                LIMIT ?
+            ''', (after_user_id, job_id, limit))
+            return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения получателей рассылки: {e}")
+            return []
+    
+    def record_broadcast_deliveries(self, job_id, results, last_user_id):
+        """Сохраняем результаты страницы рассылки одной транзакцией.
+
+        results - список (user_id, status), где status: sent / failed / blocked.
+        Возвращаем обновленную задачу.
+        """
+        try:
+            counts = Counter(status for _, status in results)
+            blocked_at = datetime.now().isoformat()
+            with self.conn:
+                self.conn.executemany('''
+                    INSERT OR REPLACE INTO broadcast_deliveries (job_id, user_id, status)
+                    VALUES (?, ?, ?)
+                ''', [(job_id, user_id, status) for user_id, status in results])
+                self.conn.executemany('''
+                    UPDATE users SET blocked_at = ? WHERE user_id = ? AND blocked_at IS NULL
+                ''', [(blocked_at, user_id) for user_id, status in results if status == 'blocked'])
+                self._cancel_reminders((user_id, 'blocked') for user_id, status in results if status == 'blocked')
+                self.conn.execute('''
+                    UPDATE broadcast_jobs
+                    SET sent = sent + ?, failed = failed + ?, blocked = blocked + ?,
+                        last_user_id = MAX(last_user_id, ?)
+                    WHERE id = ?
+                ''', (counts['sent'], counts['failed'], counts['blocked'], last_user_id, job_id))
+            return self.get_broadcast_job(job_id)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения прогресса рассылки: {e}")
+            return None
+    
+    def finish_broadcast_job(self, job_id, status='done'):
+        """Завершаем рассылку"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                UPDATE broadcast_jobs SET status = ?, finished_at = ? WHERE id = ?
+            ''', (status, datetime.now().isoformat(), job_id))
+            self.conn.commit()
+            logger.info(f"📣 Рассылка #{job_id} завершена: {status}")
+        except Exception as e:
+            logger.error(f"❌ Ошибка завершения рассылки: {e}")
+    
+    def load_fsm_record(self, key):
+        """Читаем состояние FSM: (state, data, updated_at) или None"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT state, data, updated_at FROM fsm_states WHERE key = ?', (key,))
+            row = cursor.fetchone()
+            return tuple(row) if row else None
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения состояния FSM: {e}")
+            return None
+    
+    def save_fsm_records(self, rows):
+        """Сохраняем пачку состояний FSM одной транзакцией.
+
+        rows - список (key, state, data_json, updated_at); пустые записи удаляются.
+        """
+        try:
+            empty = [(key,) for key, state, data, _ in rows if state is None and data == '{}']
+            filled = [row for row in rows if not (row[1] is None and row[2] == '{}')]
+            with self.conn:
+                self.conn.executemany('DELETE FROM fsm_states WHERE key = ?', empty)
+                self.conn.executemany('''
+                    INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        state = excluded.state, data = excluded.data, updated_at = excluded.updated_at
+                ''', filled)
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения состояний FSM: {e}")
+            return False
+    
+    def delete_expired_fsm_records(self, cutoff):
+        """Удаляем состояния FSM, не менявшиеся с момента cutoff (unix time)"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM fsm_states WHERE updated_at < ?', (cutoff,))
+            deleted = cursor.rowcount
+            self.conn.commit()
+            if deleted:
+                logger.info(f"🧹 Удалено устаревших состояний FSM: {deleted}")
+            return deleted
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки состояний FSM: {e}")
+            return 0
+    
+    def get_dialogs(self):
+        """Активные диалоги: [(user_id, admin_id, last_activity)]"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT user_id, admin_id, last_activity FROM dialogs')
+            return [tuple(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ Ошибка загрузки диалогов: {e}")
+            return []
+    
+    def save_dialog(self, user_id, admin_id, last_activity):
+        """Сохраняем/обновляем диалог пользователя с админом"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                INSERT INTO dialogs (user_id, admin_id, last_activity) VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    admin_id = excluded.admin_id, last_activity = excluded.last_activity
+            ''', (user_id, admin_id, last_activity))
+            self.conn.commit()
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения диалога: {e}")
+    
+    def delete_dialog(self, user_id):
+        """Удаляем диалог пользователя"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM dialogs WHERE user_id = ?', (user_id,))
+            self.conn.commit()
+        except Exception as e:
+            logger.error(f"❌ Ошибка удаления диалога: {e}")
+    
+    def delete_expired_dialogs(self, cutoff):
+        """Удаляем диалоги без активности с момента cutoff (unix time)"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM dialogs WHERE last_activity < ?', (cutoff,))
+            self.conn.commit()
+            return cursor.rowcount
+        except Exception as e:
+            logger.error(f"❌ Ошибка очистки диалогов: {e}")
+            return 0
+    
     def get_user_interactions_count(self, user_id):
         """Получаем количество взаимодействий пользователя"""
+        cached = self.user_cache.get(user_id)
+        if cached is not None:
+            return cached
         try:
             cursor = self.conn.cursor()
-            cursor.execute('''
-                SELECT COUNT(*) FROM interactions 
+            source = self._interactions_source(cursor)
+            cursor.execute(f'''
+                SELECT COUNT(*) FROM ({source}) 
                 WHERE user_id = ?
             ''', (user_id,))
             result = cursor.fetchone()
-            return result[0] if result else 0
+            count = result[0] if result else 0
+            return count + self._pending_interactions_count(user_id)
         except Exception as e:
             logger.error(f"❌ Ошибка получения количества взаимодействий: {e}")
             return 0
@@ -192,57 +899,325 @@ class Database:
             logger.error(f"❌ Ошибка проверки пользователя: {e}")
             return False
 
-    def get_today_stats(self, date):
-        """Получаем статистику за сегодня"""
+    def _archive_tables(self, cursor, start=None, end=None):
+        """Архивные таблицы, месяцы которых пересекаются с [start, end)"""
+        cursor.execute('''
+            SELECT table_name FROM interaction_archives
+            WHERE (? IS NULL OR month_end > ?) AND (? IS NULL OR month_start < ?)
+            ORDER BY month_start
+        ''', (start, start, end, end))
+        return [row[0] for row in cursor.fetchall()]
+    
+    def _interactions_source(self, cursor, start=None, end=None):
+        """Подзапрос по взаимодействиям за период: горячая таблица + нужные архивы.
+
+        Архивы подключаются через UNION ALL только если период их задевает,
+        условия WHERE внешнего запроса SQLite переносит внутрь каждой ветки.
+        """
+        tables = self._archive_tables(cursor, start, end) + ['interactions']
+        return ' UNION ALL '.join(f'SELECT {INTERACTION_COLUMNS} FROM {table}' for table in tables)
+    
+    def _create_archive_table(self, cursor, table):
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                action TEXT NOT NULL,
+                data TEXT,
+                timestamp TEXT
+            )
+        ''')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_user_timestamp ON {table} (user_id, timestamp)')
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_timestamp ON {table} (timestamp)')
+    
+    def archive_interactions(self, retention_days, chunk_size=5000):
+        """Переносим взаимодействия старше retention_days дней в помесячные архивы.
+
+        Синхронный вариант для init_db.py: порции подряд, пока есть что
+        переносить. Бот вызывает archive_interactions_chunk по одной порции,
+        чтобы между порциями поток записи БД обслуживал новые события.
+        Возвращает число перенесенных строк.
+        """
+        cutoff = archive_cutoff(retention_days)
+        moved = 0
+        while True:
+            count = self.archive_interactions_chunk(cutoff, chunk_size)
+            if not count:
+                break
+            moved += count
+        if moved:
+            logger.info(f"🗄 В архив перенесено взаимодействий: {moved} (старше {cutoff})")
+        return moved
+    
+    def archive_interactions_chunk(self, cutoff, chunk_size=5000):
+        """Переносим одну порцию (до chunk_size строк) взаимодействий старше cutoff.
+
+        Порция - одна короткая транзакция: INSERT в архив месяца самой старой
+        строки + DELETE из interactions. Дневные счетчики не меняются.
+        Возвращает число перенесенных строк, 0 - переносить нечего, None - ошибка.
+        """
         try:
             cursor = self.conn.cursor()
+            cursor.execute('SELECT MIN(timestamp) FROM interactions WHERE timestamp < ?', (cutoff,))
+            oldest = cursor.fetchone()[0]
+            if oldest is None:
+                return 0
             
-            # Общее количество пользователей
-            cursor.execute('SELECT COUNT(*) FROM users')
-            total_users = cursor.fetchone()[0]
+            month_start, month_end = month_bounds(oldest)
+            end = min(month_end, cutoff)
+            table = ARCHIVE_TABLE_PREFIX + month_start[:7].replace('-', '_')
             
-            # Новые пользователи за сегодня
+            # Граница порции - метка времени последней строки порции
             cursor.execute('''
-                SELECT COUNT(*) FROM users 
-                WHERE DATE(created_at) = DATE(?)
-            ''', (date,))
-            new_users = cursor.fetchone()[0]
+                SELECT timestamp FROM interactions
+                WHERE timestamp >= ? AND timestamp < ?
+                ORDER BY timestamp
+                LIMIT 1 OFFSET ?
+            ''', (oldest, end, chunk_size - 1))
+            row = cursor.fetchone()
+            if row:
+                condition, params = 'timestamp >= ? AND timestamp <= ?', (oldest, row[0])
+            else:
+                condition, params = 'timestamp >= ? AND timestamp < ?', (oldest, end)
             
-            # Всего действий за сегодня
+            self._create_archive_table(cursor, table)
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute(f'''
+                    INSERT INTO {table} ({INTERACTION_COLUMNS})
+                    SELECT {INTERACTION_COLUMNS} FROM interactions WHERE {condition}
+                ''', params)
+                cursor.execute(f'DELETE FROM interactions WHERE {condition}', params)
+                count = cursor.rowcount
+                cursor.execute('''
+                    INSERT INTO interaction_archives (table_name, month_start, month_end, rows, archived_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(table_name) DO UPDATE SET
+                        rows = rows + excluded.rows,
+                        archived_at = excluded.archived_at
+                ''', (table, month_start, month_end, count, datetime.now().isoformat()))
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            return count
+        except Exception as e:
+            logger.error(f"❌ Ошибка архивации взаимодействий: {e}")
+            return None
+    
+    def compact_database(self, pages=2000, full=False):
+        """Возвращаем ОС место, освободившееся после архивации.
+
+        В режиме auto_vacuum=INCREMENTAL освобождаем не больше pages страниц
+        за вызов. Существующую БД в этот режим переводит только полный VACUUM
+        (full=True) - он блокирует базу, поэтому запускается вручную.
+        """
+        try:
+            self.flush_interactions()
+            cursor = self.conn.cursor()
+            cursor.execute('PRAGMA auto_vacuum')
+            mode = cursor.fetchone()[0]
+            
+            if full:
+                cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+                cursor.execute('VACUUM')
+                logger.info("🧹 Выполнен VACUUM базы данных")
+                return True
+            
+            if mode != 2:
+                logger.warning("⚠️ auto_vacuum не INCREMENTAL: запустите `python init_db.py --vacuum`")
+                return False
+            
+            cursor.execute('PRAGMA freelist_count')
+            free_pages = cursor.fetchone()[0]
+            if free_pages:
+                cursor.execute(f'PRAGMA incremental_vacuum({int(pages)})')
+                cursor.fetchall()
+                logger.info(f"🧹 Освобождено страниц: {min(free_pages, pages)} из {free_pages}")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка сжатия базы данных: {e}")
+            return False
+    
+    def get_archive_summary(self):
+        """Сводка по архивам: (таблица, месяц, строк)"""
+        try:
+            cursor = self.conn.cursor()
             cursor.execute('''
-                SELECT COUNT(*) FROM interactions 
-                WHERE DATE(timestamp) = DATE(?)
-            ''', (date,))
-            total_actions = cursor.fetchone()[0]
+                SELECT table_name, substr(month_start, 1, 7), rows 
+                FROM interaction_archives ORDER BY month_start
+            ''')
+            return [tuple(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения списка архивов: {e}")
+            return []
+
+    def rebuild_daily_aggregates(self, chunk_size=10000):
+        """Пересобираем дневные счетчики из сырых таблиц.
+
+        Взаимодействия читаются порциями по id во вспомогательную таблицу,
+        затем счетчики подменяются одной короткой транзакцией. События,
+        записанные во время пересборки (id > граница), досчитываются там же.
+        """
+        self.flush_interactions()
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM interactions')
+            max_id = cursor.fetchone()[0]
+            archives = self._archive_tables(cursor)
             
-            # Топ действий за сегодня
+            cursor.execute('DROP TABLE IF EXISTS temp.daily_action_counts_rebuild')
             cursor.execute('''
-                SELECT action, COUNT(*) as count 
-                FROM interactions 
-                WHERE DATE(timestamp) = DATE(?)
-                GROUP BY action 
-                ORDER BY count DESC
-            ''', (date,))
-            top_actions = [(row[0], row[1]) for row in cursor.fetchall()]
+                CREATE TEMP TABLE daily_action_counts_rebuild (
+                    day TEXT NOT NULL,
+                    action TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (day, action)
+                )
+            ''')
+            
+            # Архивы не меняются, их считаем целиком; горячую таблицу - до границы max_id
+            for table in archives + ['interactions']:
+                if table == 'interactions':
+                    table_max_id = max_id
+                else:
+                    cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}')
+                    table_max_id = cursor.fetchone()[0]
+                
+                last_id = 0
+                while last_id < table_max_id:
+                    chunk_end = min(last_id + chunk_size, table_max_id)
+                    cursor.execute(f'''
+                        INSERT INTO daily_action_counts_rebuild (day, action, count)
+                        SELECT substr(timestamp, 1, 10), action, COUNT(*)
+                        FROM {table}
+                        WHERE id > ? AND id <= ?
+                        GROUP BY 1, 2
+                        ON CONFLICT(day, action) DO UPDATE SET count = count + excluded.count
+                    ''', (last_id, chunk_end))
+                    self.conn.commit()
+                    last_id = chunk_end
+            
+            with self.conn:
+                cursor.execute('DELETE FROM daily_action_counts')
+                cursor.execute('''
+                    INSERT INTO daily_action_counts (day, action, count)
+                    SELECT day, action, count FROM daily_action_counts_rebuild
+                ''')
+                cursor.execute('''
+                    INSERT INTO daily_action_counts (day, action, count)
+                    SELECT substr(timestamp, 1, 10), action, COUNT(*)
+                    FROM interactions
+                    WHERE id > ?
+                    GROUP BY 1, 2
+                    ON CONFLICT(day, action) DO UPDATE SET count = count + excluded.count
+                ''', (max_id,))
+                cursor.execute('DELETE FROM daily_user_counts')
+                cursor.execute('''
+                    INSERT INTO daily_user_counts (day, new_users)
+                    SELECT substr(created_at, 1, 10), COUNT(*) FROM users GROUP BY 1
+                ''')
+            
+            cursor.execute('DROP TABLE IF EXISTS temp.daily_action_counts_rebuild')
+            logger.info(f"✅ Дневные счетчики пересобраны (interactions до id {max_id})")
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка пересборки дневных счетчиков: {e}")
+            return False
+    
+    def check_daily_aggregates(self):
+        """Сравниваем дневные счетчики с сырыми данными, возвращаем расхождения"""
+        self.flush_interactions()
+        try:
+            cursor = self.conn.cursor()
+            mismatches = []
+            
+            source = self._interactions_source(cursor)
+            cursor.execute(f'''
+                WITH raw AS (
+                    SELECT substr(timestamp, 1, 10) AS day, action, COUNT(*) AS count
+                    FROM ({source}) GROUP BY 1, 2
+                )
+                SELECT raw.day, raw.action, raw.count, agg.count
+                FROM raw
+                LEFT JOIN daily_action_counts agg ON agg.day = raw.day AND agg.action = raw.action
+                WHERE agg.count IS NULL OR agg.count != raw.count
+                UNION ALL
+                SELECT agg.day, agg.action, 0, agg.count
+                FROM daily_action_counts agg
+                LEFT JOIN raw ON raw.day = agg.day AND raw.action = agg.action
+                WHERE agg.count != 0 AND raw.count IS NULL
+            ''')
+            for day, action, raw_count, agg_count in cursor.fetchall():
+                mismatches.append({'day': day, 'action': action, 'raw': raw_count, 'aggregated': agg_count or 0})
             
-            # Последние активности
             cursor.execute('''
-                SELECT i.*, u.first_name, u.username 
-                FROM interactions i
-                LEFT JOIN users u ON i.user_id = u.user_id
-                WHERE DATE(i.timestamp) = DATE(?)
-                ORDER BY i.timestamp DESC
-                LIMIT 10
-            ''', (date,))
-            recent_activities = [dict(row) for row in cursor.fetchall()]
+                SELECT raw.day, raw.count, agg.new_users
+                FROM (
+                    SELECT substr(created_at, 1, 10) AS day, COUNT(*) AS count
+                    FROM users GROUP BY 1
+                ) raw
+                LEFT JOIN daily_user_counts agg ON agg.day = raw.day
+                WHERE agg.new_users IS NULL OR agg.new_users != raw.count
+            ''')
+            for day, raw_count, agg_count in cursor.fetchall():
+                mismatches.append({'day': day, 'action': 'new_users', 'raw': raw_count, 'aggregated': agg_count or 0})
             
-            return {
-                'total_users': total_users,
-                'new_users': new_users,
-                'total_actions': total_actions,
-                'top_actions': top_actions,
-                'recent_activities': recent_activities
-            }
+            return mismatches
+        except Exception as e:
+            logger.error(f"❌ Ошибка проверки дневных счетчиков: {e}")
+            return None
+
+    def get_today_stats(self, date):
+        """Получаем статистику за сегодня"""
+        try:
+            with self.read_pool.connection() as conn:
+                cursor = conn.cursor()
+                start, end = day_range(date)
+                
+                # Счетчики берем из предагрегированных таблиц, без пересчета истории
+                # Общее количество пользователей
+                cursor.execute('SELECT COALESCE(SUM(new_users), 0) FROM daily_user_counts')
+                total_users = cursor.fetchone()[0]
+                
+                # Новые пользователи за сегодня
+                cursor.execute('''
+                    SELECT COALESCE(SUM(new_users), 0) FROM daily_user_counts 
+                    WHERE day = ?
+                ''', (start,))
+                new_users = cursor.fetchone()[0]
+                
+                # Топ действий за сегодня
+                cursor.execute('''
+                    SELECT action, count 
+                    FROM daily_action_counts 
+                    WHERE day = ?
+                    ORDER BY count DESC
+                ''', (start,))
+                top_actions = [(row[0], row[1]) for row in cursor.fetchall()]
+                
+                # Всего действий за сегодня
+                total_actions = sum(count for _, count in top_actions)
+                
+                # Последние активности
+                source = self._interactions_source(cursor, start, end)
+                cursor.execute(f'''
+                    SELECT i.*, u.first_name, u.username 
+                    FROM ({source}) i
+                    LEFT JOIN users u ON i.user_id = u.user_id
+                    WHERE i.timestamp >= ? AND i.timestamp < ?
+                    ORDER BY i.timestamp DESC
+                    LIMIT 10
+                ''', (start, end))
+                recent_activities = [dict(row) for row in cursor.fetchall()]
+                
+                return {
+                    'total_users': total_users,
+                    'new_users': new_users,
+                    'total_actions': total_actions,
+                    'top_actions': top_actions,
+                    'recent_activities': recent_activities
+                }
             
         except Exception as e:
             logger.error(f"❌ Ошибка получения статистики: {e}")
@@ -254,66 +1229,501 @@ class Database:
                 'recent_activities': []
             }
 
-    def get_user_today_stats(self, user_id, date):
-        """Получаем статистику пользователя за сегодня"""
+    def get_user_stats_page(self, user_id, date_from, date_to=None, cursor=None, direction='next', limit=20):
+        """Страница действий пользователя за период.
+
+        Пагинация по keyset-курсору (timestamp, id): cursor - граница
+        текущей страницы, direction - 'next' (дальше по времени) или 'prev'.
+        Читаются только строки показываемой страницы (+1 для проверки продолжения).
+        """
         try:
-            cursor = self.conn.cursor()
+            with self.read_pool.connection() as conn:
+                db_cursor = conn.cursor()
+                start, end = day_range(date_from, date_to)
+                
+                # Информация о пользователе
+                db_cursor.execute('''
+                    SELECT first_name, username FROM users 
+                    WHERE user_id = ?
+                ''', (user_id,))
+                user_row = db_cursor.fetchone()
+                
+                if not user_row:
+                    return None
+                
+                user_info = {
+                    'first_name': user_row[0],
+                    'username': user_row[1]
+                }
+                
+                # Старые периоды читаются и из архивных таблиц
+                source = self._interactions_source(db_cursor, start, end)
+                
+                # Всего действий пользователя за период (по индексу, без чтения строк)
+                db_cursor.execute(f'''
+                    SELECT COUNT(*) FROM ({source}) 
+                    WHERE user_id = ? AND timestamp >= ? AND timestamp < ?
+                ''', (user_id, start, end))
+                total_actions = db_cursor.fetchone()[0]
+                
+                # Действия пользователя: одна страница
+                if cursor is None:
+                    keyset, order, params = '', 'ASC', ()
+                elif direction == 'prev':
+                    keyset, order, params = 'AND (timestamp, id) < (?, ?)', 'DESC', tuple(cursor)
+                else:
+                    keyset, order, params = 'AND (timestamp, id) > (?, ?)', 'ASC', tuple(cursor)
+                
+                db_cursor.execute(f'''
+                    SELECT id, action, data, timestamp 
+                    FROM ({source}) 
+                    WHERE user_id = ? AND timestamp >= ? AND timestamp < ? {keyset}
+                    ORDER BY timestamp {order}, id {order}
+                    LIMIT ?
+                ''', (user_id, start, end) + params + (limit + 1,))
+                actions = [dict(row) for row in db_cursor.fetchall()]
+                
+                has_more = len(actions) > limit
+                actions = actions[:limit]
+                if direction == 'prev' and cursor is not None:
+                    actions.reverse()
+                    has_prev, has_next = has_more, True
+                else:
+                    has_prev, has_next = cursor is not None, has_more
+                
+                return {
+                    'user_info': user_info,
+                    'total_actions': total_actions,
+                    'actions': actions,
+                    'has_prev': has_prev,
+                    'has_next': has_next
+                }
             
-            # Информация о пользователе
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения статистики пользователя: {e}")
+            return None
+
+    def get_new_users_page(self, date_from, date_to=None, cursor=None, direction='next', limit=20):
+        """Страница новых пользователей за период, новые - первыми.
+
+        Пагинация по keyset-курсору (created_at, id), как в get_user_stats_page.
+        """
+        try:
+            with self.read_pool.connection() as conn:
+                db_cursor = conn.cursor()
+                start, end = day_range(date_from, date_to)
+                
+                # Всего новых за период - из дневных счетчиков
+                db_cursor.execute('''
+                    SELECT COALESCE(SUM(new_users), 0) FROM daily_user_counts
+                    WHERE day >= ? AND day < ?
+                ''', (start, end))
+                total = db_cursor.fetchone()[0]
+                
+                if cursor is None:
+                    keyset, order, params = '', 'DESC', ()
+                elif direction == 'prev':
+                    keyset, order, params = 'AND (created_at, id) > (?, ?)', 'ASC', tuple(cursor)
+                else:
+                    keyset, order, params = 'AND (created_at, id) < (?, ?)', 'DESC', tuple(cursor)
+                
+                db_cursor.execute(f'''
+                    SELECT id, user_id, first_name, username, created_at 
+                    FROM users 
+                    WHERE created_at >= ? AND created_at < ? {keyset}
+                    ORDER BY created_at {order}, id {order}
+                    LIMIT ?
+                ''', (start, end) + params + (limit + 1,))
+                users = [dict(row) for row in db_cursor.fetchall()]
+                
+                has_more = len(users) > limit
+                users = users[:limit]
+                if direction == 'prev' and cursor is not None:
+                    users.reverse()
+                    has_prev, has_next = has_more, True
+                else:
+                    has_prev, has_next = cursor is not None, has_more
+                
+                return {
+                    'users': users,
+                    'total': total,
+                    'has_prev': has_prev,
+                    'has_next': has_next
+                }
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения новых пользователей: {e}")
+            return None
+
+    def get_funnel_masks(self, date_from, date_to, actions):
+        """Какие шаги воронки прошел каждый пользователь в каждый день периода.
+
+        Один проход по interactions (и архивам) за период: для пары
+        (день, пользователь) возвращается битовая маска, бит i - действие actions[i].
+        Результат: список (day, user_id, mask).
+        """
+        try:
+            with self.read_pool.connection() as conn:
+                cursor = conn.cursor()
+                start, end = day_range(date_from, date_to)
+                source = self._interactions_source(cursor, start, end)
+                mask = ' | '.join(f'(MAX(action = ?) << {bit})' for bit in range(len(actions)))
+                placeholders = ', '.join('?' for _ in actions)
+                cursor.execute(f'''
+                    SELECT substr(timestamp, 1, 10) AS day, user_id, {mask} AS mask
+                    FROM ({source})
+                    WHERE timestamp >= ? AND timestamp < ? AND action IN ({placeholders})
+                    GROUP BY day, user_id
+                ''', tuple(actions) + (start, end) + tuple(actions))
+                return [tuple(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ Ошибка расчета воронки: {e}")
+            return None
+
+    def get_retention_start(self):
+        """С какого дня когорт нужно (пере)считать удержание"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT MIN(cohort_day) FROM retention_cohorts WHERE final = 0')
+            start = cursor.fetchone()[0]
+            if start:
+                return start
+            cursor.execute('SELECT MAX(cohort_day) FROM retention_cohorts')
+            last = cursor.fetchone()[0]
+            if last:
+                return (datetime.fromisoformat(last) + timedelta(days=1)).date().isoformat()
+            cursor.execute('SELECT MIN(created_at) FROM users')
+            first = cursor.fetchone()[0]
+            return first[:10] if first else None
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения состояния удержания: {e}")
+            return None
+    
+    def compute_retention(self, date_from, date_to):
+        """Пересчитываем удержание когорт с date_from по date_to включительно.
+
+        Агрегация читает снапшот через пул read-only соединений, в поток
+        записи уходит только короткая замена строк (save_retention).
+        Возвращает число строк или None при ошибке.
+        """
+        rows = self.aggregate_retention(date_from, date_to)
+        if rows is None:
+            return None
+        return self.save_retention(date_from, date_to, rows)
+
+    def aggregate_retention(self, date_from, date_to):
+        """Строки матрицы удержания когорт с date_from по date_to включительно (только чтение).
+
+        Когорта - пользователи, впервые нажавшие /start в день D (users.created_at).
+        Возврат на D+1/D+3/D+7 - действие, которое пользователь совершил сам
+        (is_user_action): напоминания, сообщения админа и отметки антифлуда
+        не считаются. Сегмент - маска полученных
+        напоминаний: 1 - 30 часов, 2 - 72 часа. Активность каждого
+        пользователя читается одним проходом, без самосоединения interactions.
+        Результат: список (день, сегмент, users, d1, d3, d7).
+        """
+        try:
+            with self.read_pool.connection() as conn:
+                cursor = conn.cursor()
+                start, end = day_range(date_from, date_to)
+                activity_end = (datetime.fromisoformat(end) + timedelta(days=max(RETENTION_OFFSETS))).date().isoformat()
+                source = self._interactions_source(cursor, start, activity_end)
+                returns = ', '.join(
+                    f'COALESCE(MAX(a.offset = {offset}), 0) AS d{offset}' for offset in RETENTION_OFFSETS
+                )
+                sums = ', '.join(f'SUM(d{offset})' for offset in RETENTION_OFFSETS)
+                
+                cursor.execute(f'''
+                    WITH cohort AS (
+                        SELECT user_id, substr(created_at, 1, 10) AS day FROM users
+                        WHERE created_at >= ? AND created_at < ?
+                    ),
+                    events AS (
+                        SELECT i.user_id, substr(i.timestamp, 1, 10) AS day, i.action
+                        FROM ({source}) i
+                        WHERE i.timestamp >= ? AND i.timestamp < ?
+                          AND i.user_id IN (SELECT user_id FROM cohort)
+                    ),
+                    activity AS (
+                        SELECT DISTINCT e.user_id, CAST(julianday(e.day) - julianday(c.day) AS INTEGER) AS offset
+                        FROM events e JOIN cohort c ON c.user_id = e.user_id
+                        WHERE {user_action_condition('e.action')}
+                    ),
+                    reminded AS (
+                        SELECT user_id, MAX(action = 'reminder_sent_30_hours') 
+                                        | (MAX(action = 'reminder_sent_72_hours') << 1) AS mask
+                        FROM events
+                        WHERE action LIKE 'reminder_sent_%'
+                        GROUP BY user_id
+                    ),
+                    per_user AS (
+                        SELECT c.day, COALESCE(r.mask, 0) AS segment, {returns}
+                        FROM cohort c
+                        LEFT JOIN activity a ON a.user_id = c.user_id
+                        LEFT JOIN reminded r ON r.user_id = c.user_id
+                        GROUP BY c.user_id
+                    )
+                    SELECT day, segment, COUNT(*), {sums}
+                    FROM per_user
+                    GROUP BY day, segment
+                ''', (start, end, start, activity_end))
+                return [tuple(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ Ошибка расчета удержания: {e}")
+            return None
+    
+    def save_retention(self, date_from, date_to, rows):
+        """Заменяем строки матрицы удержания за период одной короткой транзакцией"""
+        try:
+            cursor = self.conn.cursor()
+            start, end = day_range(date_from, date_to)
+            # Когорта окончательная, когда день D+7 полностью прошел
+            final_before = (datetime.now() - timedelta(days=max(RETENTION_OFFSETS) + 1)).date().isoformat()
+            with self.conn:
+                cursor.execute('''
+                    DELETE FROM retention_cohorts WHERE cohort_day >= ? AND cohort_day < ?
+                ''', (start, end))
+                cursor.executemany('''
+                    INSERT INTO retention_cohorts (cohort_day, segment, users, d1, d3, d7, final)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', [tuple(row) + (int(row[0] <= final_before),) for row in rows])
+            return len(rows)
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения удержания: {e}")
+            return None
+    
+    def get_retention(self, limit=14):
+        """Последние limit когорт из матрицы удержания: (день, сегмент, users, d1, d3, d7)"""
+        try:
+            with self.read_pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT cohort_day, segment, users, d1, d3, d7 FROM retention_cohorts
+                    WHERE cohort_day >= (
+                        SELECT MIN(cohort_day) FROM (
+                            SELECT DISTINCT cohort_day FROM retention_cohorts 
+                            ORDER BY cohort_day DESC LIMIT ?
+                        )
+                    )
+                    ORDER BY cohort_day DESC, segment
+                ''', (limit,))
+                return [tuple(row) for row in cursor.fetchall()]
+        except Exception as e:
+            logger.error(f"❌ Ошибка получения удержания: {e}")
+            return []
+
+    def enqueue_outbox(self, chat_id, method, payload, priority=1, dedupe_key=None, sent_action=None):
+        """Сохраняем исходящее сообщение в outbox, возвращаем id (None - дубликат по dedupe_key)"""
+        try:
+            now = time.time()
+            with self.conn:
+                cursor = self.conn.execute('''
+                    INSERT INTO outbox 
+                    (chat_id, method, payload, priority, dedupe_key, sent_action, next_attempt_at, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(dedupe_key) DO NOTHING
+                ''', (chat_id, method, payload, priority, dedupe_key, sent_action, now, now))
+            return cursor.lastrowid if cursor.rowcount else None
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи в outbox: {e}")
+            return None
+    
+    def claim_outbox(self, limit=50, lease=60, min_priority=0, max_priority=None):
+        """Забираем пачку готовых к отправке сообщений с приоритетом в [min_priority, max_priority].
+
+        Сообщения остаются pending, но откладываются на lease секунд: если
+        процесс упадет до отметки результата, они будут отправлены повторно.
+        Пока сообщение отправляется, аренду продлевает renew_outbox_lease.
+        """
+        try:
+            now = time.time()
+            cursor = self.conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute('''
+                    SELECT id, chat_id, method, payload, priority, sent_action, attempts 
+                    FROM outbox
+                    WHERE status = 'pending' AND next_attempt_at <= ? AND priority BETWEEN ? AND ?
+                    ORDER BY priority, id
+                    LIMIT ?
+                ''', (now, min_priority, max_priority if max_priority is not None else 2 ** 31, limit))
+                rows = [dict(row) for row in cursor.fetchall()]
+                cursor.executemany('''
+                    UPDATE outbox SET next_attempt_at = ? WHERE id = ?
+                ''', [(now + lease, row['id']) for row in rows])
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+            return rows
+        except Exception as e:
+            logger.error(f"❌ Ошибка выборки из outbox: {e}")
+            return []
+    
+    def claim_outbox_message(self, outbox_id, lease=60):
+        """Забираем конкретное сообщение, если его еще не забрал другой воркер"""
+        try:
+            now = time.time()
+            with self.conn:
+                cursor = self.conn.execute('''
+                    UPDATE outbox SET next_attempt_at = ?
+                    WHERE id = ? AND status = 'pending' AND next_attempt_at <= ?
+                    RETURNING id, chat_id, method, payload, priority, sent_action, attempts
+                ''', (now + lease, outbox_id, now))
+                row = cursor.fetchone()
+            return dict(row) if row else None
+        except Exception as e:
+            logger.error(f"❌ Ошибка выборки из outbox: {e}")
+            return None
+    
+    def renew_outbox_lease(self, ids, lease=60):
+        """Продлеваем аренду сообщений, которые еще отправляются"""
+        try:
+            until = time.time() + lease
+            with self.conn:
+                self.conn.executemany('''
+                    UPDATE outbox SET next_attempt_at = ? WHERE id = ? AND status = 'pending'
+                ''', [(until, outbox_id) for outbox_id in ids])
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка продления аренды outbox: {e}")
+            return False
+    
+    def complete_outbox(self, results):
+        """Сохраняем результаты отправки: (id, status, attempts, next_attempt_at, error)"""
+        try:
+            now = time.time()
+            with self.conn:
+                self.conn.executemany('''
+                    UPDATE outbox SET 
+                        status = ?, attempts = ?, next_attempt_at = ?, last_error = ?,
+                        finished_at = CASE WHEN ? != 'pending' THEN ? END
+                    WHERE id = ?
+                ''', [
+                    (status, attempts, next_attempt_at, error, status, now, outbox_id)
+                    for outbox_id, status, attempts, next_attempt_at, error in results
+                ])
+            return True
+        except Exception as e:
+            logger.error(f"❌ Ошибка сохранения результатов outbox: {e}")
+            return False
+    
+    def get_next_outbox_attempt(self, min_priority=0, max_priority=None):
+        """Когда наступит ближайшая попытка отправки с приоритетом в [min_priority, max_priority] (None - таких нет)"""
+        try:
+            cursor = self.conn.cursor()
             cursor.execute('''
-                SELECT first_name, username FROM users 
-                WHERE user_id = ?
-            ''', (user_id,))
-            user_row = cursor.fetchone()
-            
-            if not user_row:
-                return None
-            
-            user_info = {
-                'first_name': user_row[0],
-                'username': user_row[1]
-            }
-            
-            # Всего действий пользователя за сегодня
+                SELECT MIN(next_attempt_at) FROM outbox 
+                WHERE status = 'pending' AND priority BETWEEN ? AND ?
+            ''', (min_priority, max_priority if max_priority is not None else 2 ** 31))
+            return cursor.fetchone()[0]
+        except Exception as e:
+            logger.error(f"❌ Ошибка чтения outbox: {e}")
+            return None
+    
+    def get_outbox_stats(self, since):
+        """Глубина очереди, возраст самого старого сообщения и итоги с момента since"""
+        try:
+            cursor = self.conn.cursor()
             cursor.execute('''
-                SELECT COUNT(*) FROM interactions 
-                WHERE user_id = ? AND DATE(timestamp) = DATE(?)
-            ''', (user_id, date))
-            total_actions = cursor.fetchone()[0]
-            
-            # Действия пользователя за сегодня
+                SELECT COUNT(*), MIN(created_at), COALESCE(SUM(attempts > 0), 0)
+                FROM outbox WHERE status = 'pending'
+            ''')
+            pending, oldest, retrying = cursor.fetchone()
             cursor.execute('''
-                SELECT action, data, timestamp 
-                FROM interactions 
-                WHERE user_id = ? AND DATE(timestamp) = DATE(?)
-                ORDER BY timestamp
-            ''', (user_id, date))
-            actions = [dict(row) for row in cursor.fetchall()]
-            
+                SELECT status, COUNT(*) FROM outbox 
+                WHERE finished_at >= ? GROUP BY status
+            ''', (since,))
+            finished = {status: count for status, count in cursor.fetchall()}
+            cursor.execute('''
+                SELECT last_error, COUNT(*) FROM outbox
+                WHERE status = 'failed' AND finished_at >= ?
+                GROUP BY last_error ORDER BY COUNT(*) DESC LIMIT 5
+            ''', (since,))
+            errors = [tuple(row) for row in cursor.fetchall()]
             return {
-                'user_info': user_info,
-                'total_actions': total_actions,
-                'actions': actions
+                'pending': pending,
+                'retrying': retrying,
+                'oldest_created_at': oldest,
+                'finished': finished,
+                'errors': errors
             }
-            
         except Exception as e:
-            logger.error(f"❌ Ошибка получения статистики пользователя: {e}")
+            logger.error(f"❌ Ошибка получения статистики outbox: {e}")
             return None
-
-    def get_new_users_today(self, date):
-        """Получаем новых пользователей за сегодня"""
+    
+    def purge_outbox(self, before):
+        """Удаляем завершенные сообщения старше before"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-                SELECT user_id, first_name, username, created_at 
-                FROM users 
-                WHERE DATE(created_at) = DATE(?)
-                ORDER BY created_at DESC
-            ''', (date,))
-            return [dict(row) for row in cursor.fetchall()]
+            with self.conn:
+                cursor = self.conn.execute('''
+                    DELETE FROM outbox WHERE status != 'pending' AND finished_at < ?
+                ''', (before,))
+            return cursor.rowcount
         except Exception as e:
-            logger.error(f"❌ Ошибка получения новых пользователей: {e}")
-            return []
+            logger.error(f"❌ Ошибка очистки outbox: {e}")
+            return 0
+
+def timed_call(name, call):
+    """Выполняем запрос в потоке БД и записываем его длительность в метрики"""
+    started = time.perf_counter()
+    try:
+        return call()
+    finally:
+        perf.record('db', name, time.perf_counter() - started)
+
+class AsyncDatabase:
+    """Асинхронная обертка над Database.
+
+    Все запросы выполняются в отдельном потоке БД, поэтому commit/fsync
+    не блокирует цикл событий. Методы те же, что у Database, но возвращают
+    awaitable: `await async_db.add_user(...)`.
+    """
+
+    def __init__(self, database, max_pending=1000):
+        self.database = database
+        # Один поток-писатель - все обращения к основному соединению идут последовательно
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+        # Аналитика читает снапшоты WAL в отдельных потоках и не ждет записи
+        self.read_executor = ThreadPoolExecutor(
+            max_workers=database.read_pool.size, thread_name_prefix='db-read'
+        )
+        # Ограничиваем очередь запросов: при всплеске обработчики ждут,
+        # а не копят задачи в памяти без предела
+        self.semaphore = asyncio.Semaphore(max_pending)
+
+    def __getattr__(self, name):
+        method = getattr(self.database, name)
+        if not callable(method):
+            return method
+
+        is_read = name in self.database.READ_METHODS
+
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            async with self.semaphore:
+                if is_read:
+                    # Сначала записываем буфер, чтобы отчет видел все события
+                    await loop.run_in_executor(self.executor, self.database.flush_interactions)
+                    executor = self.read_executor
+                else:
+                    executor = self.executor
+                call = functools.partial(method, *args, **kwargs)
+                if perf.enabled:
+                    call = functools.partial(timed_call, name, call)
+                return await loop.run_in_executor(executor, call)
+
+        # Кешируем обертку, чтобы не создавать ее на каждый вызов
+        setattr(self, name, wrapper)
+        return wrapper
+
+    def close(self):
+        """Дожидаемся выполнения запросов и останавливаем поток БД"""
+        self.read_executor.shutdown(wait=True)
+        self.executor.shutdown(wait=True)
+        self.database.flush_interactions()
+        self.database.read_pool.close()
 
-# Создаем глобальный экземпляр базы данных
-db = Database()
+# Создаем глобальный экземпляр базы данных (путь можно переопределить для тестов)
+db = Database(os.getenv('DB_PATH', 'bot_database.db'))
+async_db = AsyncDatabase(db)
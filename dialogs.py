@@ -0,0 +1,122 @@
+# dialogs.py
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class DialogRegistry:
+    """Реестр активных диалогов админов с пользователями.
+
+    Прямой индекс user_id -> admin_id проверяется на каждое входящее
+    сообщение за O(1), обратный admin_id -> {user_id} нужен для /stop_dialog
+    и нескольких админов одновременно. Диалоги хранятся в таблице dialogs
+    и восстанавливаются после перезапуска; диалоги без активности дольше
+    ttl секунд закрываются автоматически.
+    """
+
+    def __init__(self, database, ttl=6 * 3600, touch_interval=60):
+        self.database = database
+        self.ttl = ttl
+        self.touch_interval = touch_interval
+        # user_id -> [admin_id, last_activity, persisted_activity]
+        self.by_user = {}
+        self.by_admin = {}
+
+    async def load(self):
+        """Восстанавливаем диалоги из БД"""
+        await self.database.delete_expired_dialogs(time.time() - self.ttl)
+        self.by_user = {}
+        self.by_admin = {}
+        for user_id, admin_id, last_activity in await self.database.get_dialogs():
+            self._attach(user_id, admin_id, last_activity)
+        logger.info(f"💬 Восстановлено активных диалогов: {len(self.by_user)}")
+
+    async def sync(self):
+        """Перечитываем диалоги из БД (когда бот запущен в нескольких процессах)"""
+        rows = await self.database.get_dialogs()
+        previous = self.by_user
+        self.by_user = {}
+        self.by_admin = {}
+        for user_id, admin_id, last_activity in rows:
+            entry = previous.get(user_id)
+            if entry and entry[0] == admin_id:
+                last_activity = max(last_activity, entry[1])
+            self._attach(user_id, admin_id, last_activity)
+
+    async def run_sync(self, interval=2):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.error(f"❌ Ошибка синхронизации диалогов: {e}")
+
+    def _attach(self, user_id, admin_id, last_activity):
+        self.by_user[user_id] = [admin_id, last_activity, last_activity]
+        self.by_admin.setdefault(admin_id, set()).add(user_id)
+
+    def _detach(self, user_id):
+        entry = self.by_user.pop(user_id, None)
+        if entry:
+            users = self.by_admin.get(entry[0])
+            if users is not None:
+                users.discard(user_id)
+                if not users:
+                    del self.by_admin[entry[0]]
+        return entry
+
+    def admin_for(self, user_id):
+        """Админ, с которым у пользователя открыт диалог, или None"""
+        entry = self.by_user.get(user_id)
+        if entry is None:
+            return None
+        if time.time() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def users_for(self, admin_id):
+        """Пользователи в диалоге с админом, последний активный - первым"""
+        users = self.by_admin.get(admin_id, ())
+        return sorted(users, key=lambda user_id: self.by_user[user_id][1], reverse=True)
+
+    async def open(self, user_id, admin_id):
+        now = time.time()
+        self._detach(user_id)
+        self._attach(user_id, admin_id, now)
+        await self.database.save_dialog(user_id, admin_id, now)
+
+    async def close(self, user_id):
+        entry = self._detach(user_id)
+        await self.database.delete_dialog(user_id)
+        return entry[0] if entry else None
+
+    async def touch(self, user_id):
+        """Отмечаем активность; в БД пишем не чаще раза в touch_interval"""
+        entry = self.by_user.get(user_id)
+        if entry is None:
+            return
+        now = time.time()
+        entry[1] = now
+        if now - entry[2] >= self.touch_interval:
+            entry[2] = now
+            await self.database.save_dialog(user_id, entry[0], now)
+
+    async def expire(self):
+        """Закрываем диалоги без активности дольше ttl"""
+        cutoff = time.time() - self.ttl
+        expired = [user_id for user_id, entry in self.by_user.items() if entry[1] < cutoff]
+        for user_id in expired:
+            self._detach(user_id)
+        await self.database.delete_expired_dialogs(cutoff)
+        if expired:
+            logger.info(f"💬 Закрыто неактивных диалогов: {len(expired)}")
+        return expired
+
+    async def run_expiry(self, interval=300):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.expire()
+            except Exception as e:
+                logger.error(f"❌ Ошибка очистки диалогов: {e}")
@@ -0,0 +1,93 @@
+# export.py
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Таблицы, доступные для выгрузки
+EXPORT_TABLES = ('users', 'interactions', 'reminders')
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+def iter_chunks(cursor, query, params=(), chunk_size=1000):
+    """Отдаем результат запроса порциями fetchmany: (колонки, строки порции)"""
+    cursor.execute(query, params)
+    columns = [column[0] for column in cursor.description]
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield columns, rows
+
+def iter_table(database, cursor, table, chunk_size=1000):
+    """Порции строк таблицы по порядку id; interactions - вместе с архивами"""
+    if table == 'interactions':
+        tables = database._archive_tables(cursor) + ['interactions']
+    else:
+        tables = [table]
+    for name in tables:
+        yield from iter_chunks(cursor, f'SELECT * FROM {name} ORDER BY id', chunk_size=chunk_size)
+
+def export_table(database, table, fmt='csv', path=None, chunk_size=1000):
+    """Выгружаем таблицу в gzip-файл CSV или JSONL.
+
+    Строки читаются порциями и сразу пишутся в сжатый поток, поэтому память
+    не зависит от размера таблицы. Без path файл создается во временной
+    папке - удалить его должен вызывающий. Возвращает (путь, число строк).
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Неизвестная таблица: {table}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+
+    if path is None:
+        fd, path = tempfile.mkstemp(prefix=f'{table}_', suffix=f'.{fmt}.gz')
+        os.close(fd)
+
+    count = 0
+    try:
+        with database.read_pool.connection() as conn, \
+                gzip.open(path, 'wt', compresslevel=6, encoding='utf-8', newline='') as output:
+            cursor = conn.cursor()
+            # Кортежи вместо sqlite3.Row - заметно быстрее на миллионах строк
+            cursor.row_factory = None
+            writer = csv.writer(output) if fmt == 'csv' else None
+            header_written = False
+            for columns, rows in iter_table(database, cursor, table, chunk_size):
+                if writer:
+                    if not header_written:
+                        writer.writerow(columns)
+                        header_written = True
+                    writer.writerows(rows)
+                else:
+                    output.write(''.join(
+                        json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in rows
+                    ))
+                count += len(rows)
+        logger.info(f"📦 Выгружено {table}: {count} строк в {path}")
+        return path, count
+    except Exception:
+        os.remove(path)
+        raise
+
+if __name__ == "__main__":
+    from database import db
+
+    parser = argparse.ArgumentParser(description="Выгрузка таблиц бота в gzip CSV/JSONL")
+    parser.add_argument('table', choices=EXPORT_TABLES, help="таблица для выгрузки")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv', help="формат файла")
+    parser.add_argument('--output', help="путь к файлу (по умолчанию <table>.<format>.gz)")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="сколько строк читать за раз")
+    args = parser.parse_args()
+
+    db.flush_interactions()
+    output_path = args.output or f"{args.table}.{args.format}.gz"
+    try:
+        _, rows = export_table(db, args.table, args.format, output_path, args.chunk_size)
+        print(f"✅ Выгружено строк: {rows} → {output_path}")
+    except Exception as e:
+        print(f"❌ Ошибка выгрузки: {e}")
@@ -0,0 +1,120 @@
+# fsm_storage.py
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+logger = logging.getLogger(__name__)
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в файле SQLite бота.
+
+    Чтение идет из ограниченного LRU-кеша в памяти (в БД - только при
+    промахе), запись сразу попадает в кеш и пачкой сохраняется в таблицу
+    fsm_states раз в flush_interval секунд. Состояния старше ttl секунд
+    считаются пустыми и периодически удаляются из таблицы.
+    Состояния переживают перезапуск бота.
+    """
+
+    def __init__(self, database, ttl=48 * 3600, cache_size=10000, flush_interval=0.2, purge_interval=3600):
+        self.database = database
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.purge_interval = purge_interval
+        # key -> [state, data, updated_at]
+        self.cache = OrderedDict()
+        self.dirty = {}
+        self.flush_task = None
+        self.last_purge = time.time()
+
+    @staticmethod
+    def _key(key):
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:" \
+               f"{key.business_connection_id or ''}:{key.destiny}"
+
+    def _expired(self, record):
+        return record[2] and time.time() - record[2] > self.ttl
+
+    async def _get_record(self, key):
+        storage_key = self._key(key)
+        record = self.cache.get(storage_key)
+        if record is None:
+            # Запись могла быть вытеснена из кеша до сохранения
+            record = self.dirty.get(storage_key)
+        if record is None:
+            row = await self.database.load_fsm_record(storage_key)
+            # Пока ждали БД, запись мог загрузить параллельный апдейт
+            record = self.cache.get(storage_key)
+            if record is None:
+                if row:
+                    state, data, updated_at = row
+                    record = [state, json.loads(data) if data else {}, updated_at]
+                else:
+                    record = [None, {}, 0]
+
+        if self._expired(record):
+            record = [None, {}, 0]
+
+        self.cache[storage_key] = record
+        self.cache.move_to_end(storage_key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return storage_key, record
+
+    def _mark_dirty(self, storage_key, record):
+        record[2] = time.time()
+        self.dirty[storage_key] = record
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+            if not self.dirty:
+                break
+
+    async def flush(self):
+        """Сохраняем измененные состояния одной транзакцией"""
+        if self.dirty:
+            rows = [
+                (storage_key, record[0], json.dumps(record[1], ensure_ascii=False), record[2])
+                for storage_key, record in self.dirty.items()
+            ]
+            pending, self.dirty = self.dirty, {}
+            if not await self.database.save_fsm_records(rows):
+                # Не потеряем изменения: повторим при следующем сохранении
+                for storage_key, record in pending.items():
+                    self.dirty.setdefault(storage_key, record)
+
+        if time.time() - self.last_purge > self.purge_interval:
+            self.last_purge = time.time()
+            await self.database.delete_expired_fsm_records(time.time() - self.ttl)
+
+    async def set_state(self, key, state=None):
+        storage_key, record = await self._get_record(key)
+        record[0] = state.state if isinstance(state, State) else state
+        self._mark_dirty(storage_key, record)
+
+    async def get_state(self, key):
+        _, record = await self._get_record(key)
+        return record[0]
+
+    async def set_data(self, key, data):
+        storage_key, record = await self._get_record(key)
+        record[1] = data.copy()
+        self._mark_dirty(storage_key, record)
+
+    async def get_data(self, key):
+        _, record = await self._get_record(key)
+        return record[1].copy()
+
+    async def close(self):
+        if self.flush_task and not self.flush_task.done():
+            self.flush_task.cancel()
+        await self.flush()
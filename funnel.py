@@ -0,0 +1,145 @@
+# funnel.py
+import logging
+from collections import OrderedDict
+from datetime import date, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Действия воронки, индекс - номер бита в маске пользователя
+FUNNEL_ACTIONS = (
+    'start_command',
+    'viewed_vip_benefits',
+    'selected_has_broker',
+    'selected_completed_registration',
+    'clicked_make_payment',
+    'submitted_registration_data',
+)
+START, VIP, HAS_BROKER, REGISTRATION, PAYMENT, SUBMITTED = (1 << bit for bit in range(len(FUNNEL_ACTIONS)))
+
+# Шаги воронки: (название, маски-альтернативы). Шаг пройден, если у
+# пользователя есть хотя бы одно из действий шага и пройдены все прошлые шаги
+FUNNEL_STEPS = (
+    ('🚀 Старт', START),
+    ('🎯 VIP преимущества', VIP),
+    ('🔀 Выбрали путь', HAS_BROKER | REGISTRATION),
+    ('🏁 Целевое действие', PAYMENT | SUBMITTED),
+)
+
+# Ветки после выбора пути: (название, шаг ветки, результат ветки)
+FUNNEL_BRANCHES = (
+    ('📈 Есть брокер → 💳 Оплата', HAS_BROKER, PAYMENT),
+    ('📋 Регистрация → ✅ Отправил данные', REGISTRATION, SUBMITTED),
+)
+
+class FunnelEngine:
+    """Воронка конверсии по уникальным пользователям за период.
+
+    Для каждого дня хранится маска шагов каждого пользователя. Прошедшие
+    дни не меняются, поэтому их маски кешируются (LRU на cache_days дней),
+    а из БД одним запросом дочитываются только недостающие дни и сегодня.
+    Маски дней периода объединяются через OR - так пользователь, который
+    стартовал в один день, а купил в другой, проходит воронку целиком.
+    """
+
+    def __init__(self, database, cache_days=400):
+        self.database = database
+        self.cache_days = cache_days
+        # day -> {user_id: mask}
+        self.days = OrderedDict()
+
+    async def _load_days(self, date_from, date_to):
+        """Дочитываем недостающие дни в кеш, возвращаем маски за сегодня (или None при ошибке)"""
+        today = date.today().isoformat()
+        missing = [
+            day for day in iter_days(date_from, date_to)
+            if day >= today or day not in self.days
+        ]
+        if not missing:
+            return {}
+
+        rows = await self.database.get_funnel_masks(missing[0], missing[-1], FUNNEL_ACTIONS)
+        if rows is None:
+            return None
+
+        loaded = {day: {} for day in missing}
+        for day, user_id, mask in rows:
+            if day in loaded:
+                loaded[day][user_id] = mask
+
+        for day, masks in loaded.items():
+            if day >= today:
+                # Сегодняшний день еще пополняется - не кешируем
+                self.days.pop(day, None)
+                continue
+            self.days[day] = masks
+            self.days.move_to_end(day)
+        while len(self.days) > self.cache_days:
+            self.days.popitem(last=False)
+        return loaded.get(today, {})
+
+    async def compute(self, date_from, date_to):
+        """Шаги воронки за период [date_from, date_to] (даты YYYY-MM-DD)"""
+        today_masks = await self._load_days(date_from, date_to)
+        if today_masks is None:
+            return None
+
+        today = date.today().isoformat()
+        users = {}
+        for day in iter_days(date_from, date_to):
+            masks = today_masks if day == today else self.days.get(day, {})
+            for user_id, mask in masks.items():
+                users[user_id] = users.get(user_id, 0) | mask
+
+        steps = []
+        reached = list(users.values())
+        previous = None
+        for title, step_mask in FUNNEL_STEPS:
+            unique = sum(1 for mask in users.values() if mask & step_mask)
+            reached = [mask for mask in reached if mask & step_mask]
+            conversion = len(reached) / previous if previous else None
+            steps.append({'title': title, 'users': len(reached), 'unique': unique, 'conversion': conversion})
+            previous = len(reached)
+
+        branches = []
+        for title, branch_mask, result_mask in FUNNEL_BRANCHES:
+            entered = sum(1 for mask in users.values() if mask & branch_mask)
+            converted = sum(1 for mask in users.values() if mask & branch_mask and mask & result_mask)
+            branches.append({
+                'title': title,
+                'entered': entered,
+                'converted': converted,
+                'conversion': converted / entered if entered else None,
+            })
+
+        return {'date_from': date_from, 'date_to': date_to, 'steps': steps, 'branches': branches}
+
+def iter_days(date_from, date_to):
+    day = date.fromisoformat(date_from)
+    last = date.fromisoformat(date_to)
+    while day <= last:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+def format_funnel(funnel):
+    def percent(value):
+        return f"{value * 100:.1f}%" if value is not None else "—"
+
+    if funnel['date_from'] == funnel['date_to']:
+        period = f"за {funnel['date_from']}"
+    else:
+        period = f"с {funnel['date_from']} по {funnel['date_to']}"
+
+    text = f"🔻 Воронка {period}\n\n"
+    first = funnel['steps'][0]['users'] if funnel['steps'] else 0
+    for step in funnel['steps']:
+        text += f"{step['title']}: {step['users']}"
+        if step['conversion'] is not None:
+            text += f" ({percent(step['conversion'])} от прошлого шага, {percent(step['users'] / first if first else None)} от старта)"
+        if step['unique'] != step['users']:
+            text += f"\n   всего с этим действием: {step['unique']}"
+        text += "\n"
+
+    text += "\nВетки:\n"
+    for branch in funnel['branches']:
+        text += f"{branch['title']}: {branch['converted']} из {branch['entered']} ({percent(branch['conversion'])})\n"
+    return text
@@ -1,14 +1,88 @@
-# init_db.py
-from database import db
-import logging
-
-def init_database():
-    """Инициализация базы данных - создание таблиц"""
-    try:
-        db.create_tables()
-        print("✅ База данных инициализирована успешно!")
-    except Exception as e:
-        print(f"❌ Ошибка инициализации базы данных: {e}")
-
-if __name__ == "__main__":
-    init_database()
+# init_db.py
+import argparse
+import sys
+from database import db
+import logging
+
+def init_database():
+    """Инициализация базы данных - создание таблиц. False - миграция не прошла"""
+    try:
+        if not db.migrate():
+            print("❌ Ошибка миграции базы данных (подробности в логе)")
+            return False
+        print("✅ База данных инициализирована успешно!")
+        return True
+    except Exception as e:
+        print(f"❌ Ошибка инициализации базы данных: {e}")
+        return False
+
+def rebuild_aggregates(chunk_size):
+    """Пересборка дневных счетчиков из таблицы interactions"""
+    if db.rebuild_daily_aggregates(chunk_size):
+        print("✅ Дневные счетчики пересобраны")
+    else:
+        print("❌ Ошибка пересборки дневных счетчиков")
+
+def check_aggregates():
+    """Сверка дневных счетчиков с сырыми данными"""
+    mismatches = db.check_daily_aggregates()
+    if mismatches is None:
+        print("❌ Ошибка проверки дневных счетчиков")
+    elif not mismatches:
+        print("✅ Дневные счетчики совпадают с сырыми данными")
+    else:
+        print(f"⚠️ Найдено расхождений: {len(mismatches)}")
+        for item in mismatches:
+            print(f"   {item['day']} {item['action']}: данные {item['raw']}, счетчик {item['aggregated']}")
+
+def archive_interactions(retention_days, chunk_size):
+    """Перенос старых взаимодействий в помесячные архивы"""
+    moved = db.archive_interactions(retention_days, chunk_size)
+    print(f"✅ В архив перенесено взаимодействий: {moved}")
+    for table, month, rows in db.get_archive_summary():
+        print(f"   {month}: {rows} ({table})")
+
+def import_json_users(path):
+    """Загрузка пользователей из users.json (или users.jsonl) в SQLite"""
+    from simpledb import import_users_to_sqlite
+    try:
+        result = import_users_to_sqlite(path, db)
+    except Exception as e:
+        print(f"❌ Ошибка чтения {path}: {e}")
+        return
+    if result is None:
+        print("❌ Ошибка импорта пользователей")
+    else:
+        print(f"✅ Импортировано из {path}: добавлено {result[0]}, обновлено {result[1]}")
+
+def vacuum():
+    """Полный VACUUM с переводом БД в режим auto_vacuum=INCREMENTAL"""
+    if db.compact_database(full=True):
+        print("✅ База данных сжата, включен инкрементальный auto_vacuum")
+    else:
+        print("❌ Ошибка сжатия базы данных")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обслуживание базы данных бота")
+    parser.add_argument('--rebuild-aggregates', action='store_true', help="пересобрать дневные счетчики")
+    parser.add_argument('--check-aggregates', action='store_true', help="сверить дневные счетчики с данными")
+    parser.add_argument('--archive', action='store_true', help="перенести старые взаимодействия в архив")
+    parser.add_argument('--retention-days', type=int, default=90, help="сколько дней хранить в горячей таблице")
+    parser.add_argument('--import-json', metavar='PATH', help="импортировать пользователей из users.json")
+    parser.add_argument('--vacuum', action='store_true', help="полный VACUUM (блокирует базу)")
+    parser.add_argument('--chunk-size', type=int, default=10000, help="размер порции при пересборке и архивации")
+    args = parser.parse_args()
+
+    if not init_database():
+        # Остальные команды на недомигрированной схеме не запускаем
+        sys.exit(1)
+    if args.rebuild_aggregates:
+        rebuild_aggregates(args.chunk_size)
+    if args.import_json:
+        import_json_users(args.import_json)
+    if args.archive:
+        archive_interactions(args.retention_days, args.chunk_size)
+    if args.vacuum:
+        vacuum()
+    if args.check_aggregates:
+        check_aggregates()
@@ -0,0 +1,269 @@
+# loadtest.py
+"""Нагрузочный тест обработчиков бота без обращения к Telegram.
+
+Синтетические апдейты каждого сценария прогоняются через dp.feed_update,
+ответы API отдает локальная фейковая сессия с заданной задержкой, данные
+пишутся во временную SQLite-базу. Результат - p50/p95/p99 времени обработки
+апдейта и апдейтов в секунду по каждому сценарию, сохраняется в JSON:
+
+    python loadtest.py --users 500 --output results.json
+    python loadtest.py --users 500 --baseline results.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import SendMessage, EditMessageText, SendDocument
+from aiogram.types import Message
+
+# Сценарии в порядке прогона: после completed_registration пользователь
+# ждет данные регистрации, поэтому свободный текст идет раньше
+FLOWS = (
+    'start', 'vip_benefits', 'has_broker', 'make_payment', 'free_text',
+    'dialog_message', 'completed_registration', 'registration_data'
+)
+CALLBACK_FLOWS = ('vip_benefits', 'has_broker', 'make_payment', 'completed_registration')
+FIRST_USER_ID = 1_000_000
+LOADTEST_ADMIN_ID = 999
+
+class FakeSession(BaseSession):
+    """Сессия Bot API, которая отвечает локально через latency секунд"""
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+        self.message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(method, (SendMessage, EditMessageText, SendDocument)):
+            self.message_id += 1
+            chat_id = int(method.chat_id) if method.chat_id is not None else 0
+            return Message.model_validate({
+                'message_id': self.message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': getattr(method, 'text', None),
+            }, context={'bot': bot})
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+def build_update(update_id, flow, user_id):
+    """JSON апдейта Telegram для сценария flow от пользователя user_id"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+    chat = {'id': user_id, 'type': 'private'}
+    now = int(time.time())
+
+    if flow in CALLBACK_FLOWS:
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': user,
+                'chat_instance': str(user_id),
+                'data': flow,
+                'message': {'message_id': update_id, 'date': now, 'chat': chat, 'text': 'menu'},
+            }
+        }
+
+    text = {
+        'start': '/start',
+        'free_text': 'Сколько стоит подписка?',
+        'dialog_message': 'Здравствуйте, у меня вопрос по оплате',
+        'registration_data': 'Иван Иванов\nСчет 12345678\nКапитал 1000$',
+    }[flow]
+    return {
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'date': now, 'chat': chat, 'from': user, 'text': text}
+    }
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    index = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return values[index]
+
+def summarize(latencies, elapsed, errors):
+    latencies = sorted(latencies)
+    return {
+        'updates': len(latencies),
+        'errors': sum(errors.values()),
+        'error_types': dict(errors),
+        'updates_per_sec': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+async def run_flow(app, flow, user_ids, concurrency, first_update_id):
+    """Прогоняем сценарий: по одному апдейту от каждого пользователя"""
+    from aiogram.types import Update
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = Counter()
+
+    async def feed(update_id, user_id):
+        async with semaphore:
+            update = Update.model_validate(build_update(update_id, flow, user_id), context={'bot': app.bot})
+            started = time.perf_counter()
+            try:
+                await app.dp.feed_update(app.bot, update)
+            except Exception as e:
+                errors[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        feed(first_update_id + index, user_id) for index, user_id in enumerate(user_ids)
+    ))
+    return summarize(latencies, time.perf_counter() - started, errors)
+
+async def run(args):
+    import bot as app
+    from outbound import OutboundRequestMiddleware
+    from perf import RequestTimingMiddleware
+
+    if not args.verbose:
+        # Лог каждого апдейта искажает замер сильнее самих обработчиков
+        logging.getLogger().setLevel(logging.WARNING)
+
+    session = FakeSession(args.latency / 1000)
+    # Middleware висят на сессии - переносим их на фейковую в том же порядке
+    session.middleware(OutboundRequestMiddleware(app.outbound))
+    if app.perf.enabled:
+        session.middleware(RequestTimingMiddleware())
+    app.bot.session = session
+    app.ADMIN_IDS.add(LOADTEST_ADMIN_ID)
+    # Лимиты Telegram здесь не измеряем - иначе сценарии с пересылкой админу упрутся в 30 сообщ./с
+    app.outbound.bucket.rate = app.outbound.bucket.capacity = args.api_rate
+    app.outbound.per_chat_interval = 0
+    # Ответы обработчиков тоже идут через очередь - воркеров не меньше параллельных апдейтов
+    app.outbound.workers_count = max(app.outbound.workers_count, args.concurrency)
+    # Одни и те же пользователи проходят все сценарии подряд - антифлуд отбросил бы часть апдейтов
+    app.antiflood.limit = 0
+
+    await app.async_db.migrate()
+    await app.start_services(background_tasks=False)
+
+    user_ids = list(range(FIRST_USER_ID, FIRST_USER_ID + args.users))
+    results = {}
+    total_updates = 0
+    total_elapsed = 0.0
+    update_id = 1
+
+    try:
+        for flow in args.flows:
+            if flow == 'dialog_message':
+                for user_id in user_ids:
+                    await app.dialogs.open(user_id, LOADTEST_ADMIN_ID)
+
+            results[flow] = await run_flow(app, flow, user_ids, args.concurrency, update_id)
+            update_id += len(user_ids)
+            total_updates += results[flow]['updates']
+            total_elapsed += results[flow]['updates'] / results[flow]['updates_per_sec'] if results[flow]['updates_per_sec'] else 0
+            print(f"  {flow:<24} {results[flow]['updates_per_sec']:>9} upd/s   "
+                  f"p50 {results[flow]['p50_ms']:>8} мс   p95 {results[flow]['p95_ms']:>8} мс   "
+                  f"p99 {results[flow]['p99_ms']:>8} мс   ошибок {results[flow]['errors']}")
+
+            if flow == 'dialog_message':
+                for user_id in user_ids:
+                    await app.dialogs.close(user_id)
+    finally:
+        await app.stop_services()
+
+    return {
+        'commit': git_commit(),
+        'created_at': datetime.now().isoformat(),
+        'config': {
+            'users': args.users,
+            'concurrency': args.concurrency,
+            'latency_ms': args.latency,
+            'api_rate': args.api_rate,
+            'flows': list(args.flows),
+        },
+        'flows': results,
+        'total': {
+            'updates': total_updates,
+            'updates_per_sec': round(total_updates / total_elapsed, 1) if total_elapsed else 0.0,
+            'api_calls': session.calls,
+        },
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+def compare(result, baseline):
+    """Печатаем изменение p95 и пропускной способности относительно прошлого прогона"""
+    print(f"\n📊 Сравнение с {baseline.get('commit') or 'baseline'}:")
+    for flow, current in result['flows'].items():
+        previous = baseline.get('flows', {}).get(flow)
+        if not previous:
+            continue
+        p95_delta = (current['p95_ms'] / previous['p95_ms'] - 1) * 100 if previous['p95_ms'] else 0
+        ups_delta = (current['updates_per_sec'] / previous['updates_per_sec'] - 1) * 100 if previous['updates_per_sec'] else 0
+        print(f"  {flow:<24} p95 {p95_delta:+6.1f}%   upd/s {ups_delta:+6.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест обработчиков бота")
+    parser.add_argument('--users', type=int, default=200, help="синтетических пользователей (апдейтов на сценарий)")
+    parser.add_argument('--concurrency', type=int, default=50, help="апдейтов в обработке одновременно")
+    parser.add_argument('--latency', type=float, default=50.0, help="задержка ответа Bot API, мс")
+    parser.add_argument('--api-rate', type=float, default=1e6, help="лимит исходящих сообщений в секунду")
+    parser.add_argument('--flows', nargs='+', choices=FLOWS, default=list(FLOWS), help="сценарии для прогона")
+    parser.add_argument('--verbose', action='store_true', help="не отключать INFO-логи бота")
+    parser.add_argument('--output', help="куда сохранить результаты в JSON")
+    parser.add_argument('--baseline', help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    # Временная база и фиктивный токен выставляются до импорта бота
+    workdir = tempfile.mkdtemp(prefix='bot_loadtest_')
+    os.environ['DB_PATH'] = os.path.join(workdir, 'loadtest.db')
+    os.environ['BOT_TOKEN'] = '123456:LOADTEST'
+
+    print(f"🚀 Нагрузочный тест: {args.users} пользователей, параллельно {args.concurrency}, "
+          f"задержка API {args.latency} мс")
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(f"  {'всего':<24} {result['total']['updates_per_sec']:>9} upd/s   "
+          f"апдейтов {result['total']['updates']}, вызовов API {result['total']['api_calls']}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(result, file, ensure_ascii=False, indent=2)
+        print(f"💾 Результаты сохранены в {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            compare(result, json.load(file))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+# migrations.py
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Версионированные миграции схемы: (версия, описание, список SQL)
+# Новые миграции добавляются только в конец списка
+MIGRATIONS = [
+    (1, 'Базовые таблицы', [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE NOT NULL,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            source TEXT,
+            registration_data TEXT,
+            registration_date TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS interactions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            action TEXT NOT NULL,
+            data TEXT,
+            timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS reminders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            reminder_type TEXT NOT NULL,
+            scheduled_time TEXT NOT NULL,
+            sent BOOLEAN DEFAULT FALSE,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (2, 'Индексы для статистики и напоминаний', [
+        'CREATE INDEX IF NOT EXISTS idx_interactions_user_timestamp ON interactions (user_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_interactions_timestamp ON interactions (timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_reminders_sent_scheduled ON reminders (sent, scheduled_time)',
+    ]),
+    (3, 'Дневные счетчики для /stats', [
+        '''
+        CREATE TABLE IF NOT EXISTS daily_user_counts (
+            day TEXT PRIMARY KEY,
+            new_users INTEGER NOT NULL DEFAULT 0
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS daily_action_counts (
+            day TEXT NOT NULL,
+            action TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, action)
+        ) WITHOUT ROWID
+        ''',
+        # Начальное заполнение из уже накопленных данных
+        '''
+        INSERT OR REPLACE INTO daily_user_counts (day, new_users)
+        SELECT substr(created_at, 1, 10), COUNT(*) FROM users GROUP BY 1
+        ''',
+        '''
+        INSERT OR REPLACE INTO daily_action_counts (day, action, count)
+        SELECT substr(timestamp, 1, 10), action, COUNT(*) FROM interactions GROUP BY 1, 2
+        ''',
+    ]),
+    (4, 'Рассылки и заблокировавшие бота пользователи', [
+        'ALTER TABLE users ADD COLUMN blocked_at TEXT',
+        '''
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            admin_chat_id INTEGER,
+            progress_message_id INTEGER,
+            last_user_id INTEGER NOT NULL DEFAULT 0,
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            finished_at TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            job_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            PRIMARY KEY (job_id, user_id)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (5, 'Хранилище состояний FSM', [
+        '''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states (updated_at)',
+    ]),
+    (6, 'Активные диалоги админов', [
+        '''
+        CREATE TABLE IF NOT EXISTS dialogs (
+            user_id INTEGER PRIMARY KEY,
+            admin_id INTEGER NOT NULL,
+            last_activity REAL NOT NULL
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_dialogs_admin ON dialogs (admin_id)',
+        'CREATE INDEX IF NOT EXISTS idx_dialogs_last_activity ON dialogs (last_activity)',
+    ]),
+    (7, 'Реестр помесячных архивов взаимодействий', [
+        '''
+        CREATE TABLE IF NOT EXISTS interaction_archives (
+            table_name TEXT PRIMARY KEY,
+            month_start TEXT NOT NULL,
+            month_end TEXT NOT NULL,
+            rows INTEGER NOT NULL DEFAULT 0,
+            archived_at TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_interaction_archives_month ON interaction_archives (month_start, month_end)',
+    ]),
+    (8, 'Матрица удержания когорт', [
+        '''
+        CREATE TABLE IF NOT EXISTS retention_cohorts (
+            cohort_day TEXT NOT NULL,
+            segment INTEGER NOT NULL,
+            users INTEGER NOT NULL,
+            d1 INTEGER NOT NULL DEFAULT 0,
+            d3 INTEGER NOT NULL DEFAULT 0,
+            d7 INTEGER NOT NULL DEFAULT 0,
+            final INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (cohort_day, segment)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (9, 'Очередь исходящих сообщений (outbox)', [
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            method TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 1,
+            dedupe_key TEXT UNIQUE,
+            sent_action TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            created_at REAL NOT NULL,
+            finished_at REAL,
+            last_error TEXT
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (status, next_attempt_at)',
+        'CREATE INDEX IF NOT EXISTS idx_outbox_finished ON outbox (finished_at)',
+    ]),
+    (10, 'Отмена напоминаний и уникальность (user_id, reminder_type)', [
+        # Отмененное напоминание закрывается как отправленное (sent = TRUE) с причиной
+        'ALTER TABLE reminders ADD COLUMN cancel_reason TEXT',
+        # Из дубликатов оставляем уже отправленное, иначе самое раннее
+        '''
+        DELETE FROM reminders WHERE id NOT IN (
+            SELECT COALESCE(MIN(CASE WHEN sent THEN id END), MIN(id))
+            FROM reminders GROUP BY user_id, reminder_type
+        )
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_reminders_user_type ON reminders (user_id, reminder_type)',
+        # Заблокировавшим бота напоминания уже не уйдут
+        '''
+        UPDATE reminders SET sent = TRUE, cancel_reason = 'blocked'
+        WHERE sent = FALSE AND user_id IN (SELECT user_id FROM users WHERE blocked_at IS NOT NULL)
+        ''',
+    ]),
+    (11, 'Пересчет удержания: возвратом считаются только действия пользователя', [
+        # Матрица досчитается заново с первой когорты при следующем пересчете
+        'DELETE FROM retention_cohorts',
+    ]),
+]
+
+def get_schema_version(conn):
+    """Текущая версия схемы (0 - миграции не применялись)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT
+        )
+    ''')
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+def apply_migrations(conn):
+    """Применяем по порядку все миграции новее текущей версии.
+
+    Каждая миграция выполняется в своей транзакции вместе с записью
+    в schema_version, поэтому при ошибке схема остается на прошлой версии.
+    Возвращает список примененных версий.
+    """
+    current = get_schema_version(conn)
+    applied = []
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+
+        try:
+            conn.execute('BEGIN')
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute('''
+                INSERT INTO schema_version (version, description, applied_at)
+                VALUES (?, ?, ?)
+            ''', (version, description, datetime.now().isoformat()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        logger.info(f"🧱 Применена миграция {version}: {description}")
+        applied.append(version)
+
+    return applied
@@ -0,0 +1,209 @@
+# outbound.py
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: меньше - раньше
+PRIORITY_DIALOG = 0   # переписка админа с пользователем
+PRIORITY_NORMAL = 1   # уведомления админу, служебные сообщения
+PRIORITY_BULK = 2     # напоминания, рассылки
+
+# Методы Bot API, которые отправляют что-то пользователю и идут через очередь
+# (getUpdates, setWebhook и прочие служебные вызовы - напрямую)
+OUTBOUND_METHOD_PREFIXES = ('send', 'edit', 'copy', 'forward', 'answer')
+
+# Вызов идет из самой очереди - повторно в нее не ставим
+_dispatching = ContextVar('outbound_dispatching', default=False)
+
+class TokenBucket:
+    """Глобальный лимит отправки (сообщений в секунду)"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        """Останавливаем отправку целиком (Telegram вернул RetryAfter)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class OutboundDispatcher:
+    """Единая очередь исходящих сообщений.
+
+    Глобальный token bucket (~30 сообщений/с), не чаще одного сообщения
+    в секунду в один чат, ограниченное число воркеров и автоматический
+    повтор после RetryAfter. Диалоги админа идут отдельной полосой
+    приоритета и не ждут за очередью напоминаний.
+
+    У каждого чата своя очередь (heap по приоритету), а в общую очередь
+    воркеров попадает только голова чата, которому уже можно писать.
+    Чат, для которого еще не прошел per_chat_interval, откладывается
+    таймером цикла событий (call_at) и не занимает воркер, поэтому
+    очередь в один чат (например, админу) не тормозит остальные чаты.
+    """
+
+    def __init__(self, bot, global_rate=30, per_chat_interval=1.0, workers=8, max_queue=10000, max_retries=3):
+        self.bot = bot
+        self.bucket = TokenBucket(global_rate)
+        self.per_chat_interval = per_chat_interval
+        self.workers_count = workers
+        self.max_retries = max_retries
+        # Чаты, готовые к отправке: (приоритет головы, порядковый номер, chat_id)
+        self.ready = asyncio.PriorityQueue()
+        self.counter = itertools.count()
+        # chat_id -> heap [(priority, номер, method, future)]
+        self.chat_queues = {}
+        # Чаты, которые стоят в ready, ждут таймера или отправляются прямо сейчас
+        self.scheduled = set()
+        self.chat_next_time = {}
+        # Ограничение размера очереди: send ждет свободного места
+        self.slots = asyncio.Semaphore(max_queue)
+        self.pending = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.workers = []
+
+    def start(self):
+        if not self.workers:
+            self.workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+
+    async def stop(self, timeout=10):
+        """Дожидаемся отправки очереди (не дольше timeout) и останавливаем воркеры"""
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Не отправлено сообщений при остановке: {self.pending}")
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+
+    async def send(self, method, priority=PRIORITY_NORMAL):
+        """Ставим метод Bot API в очередь и ждем результата отправки"""
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            # Ответ на callback/inline-запрос ничего не пишет в чат:
+            # только общий лимит и повтор после RetryAfter
+            return await self._call(method, None)
+        await self.slots.acquire()
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.chat_queues.setdefault(chat_id, []), (priority, next(self.counter), method, future))
+        self.pending += 1
+        self.idle.clear()
+        if chat_id not in self.scheduled:
+            self.scheduled.add(chat_id)
+            self._schedule(chat_id)
+        return await future
+
+    async def send_message(self, chat_id, text, priority=PRIORITY_NORMAL, **kwargs):
+        return await self.send(SendMessage(chat_id=chat_id, text=text, **kwargs), priority)
+
+    def _schedule(self, chat_id):
+        """Ставим голову чата в ready сейчас или по таймеру, когда чату снова можно писать"""
+        queue = self.chat_queues.get(chat_id)
+        if not queue:
+            self.chat_queues.pop(chat_id, None)
+            self.scheduled.discard(chat_id)
+            self._prune_chat_times()
+            return
+        wait = self.chat_next_time.get(chat_id, 0) - time.monotonic()
+        if wait > 0:
+            asyncio.get_running_loop().call_later(wait, self._make_ready, chat_id)
+        else:
+            self._make_ready(chat_id)
+
+    def _make_ready(self, chat_id):
+        priority, number, _, _ = self.chat_queues[chat_id][0]
+        self.ready.put_nowait((priority, number, chat_id))
+
+    async def _worker(self):
+        while True:
+            _, _, chat_id = await self.ready.get()
+            # Голова могла смениться: в чат пришло сообщение приоритетнее
+            _, _, method, future = heapq.heappop(self.chat_queues[chat_id])
+            try:
+                result = await self._call(method, chat_id)
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                self.slots.release()
+                self.pending -= 1
+                if not self.pending:
+                    self.idle.set()
+                # Следующее сообщение чата - не раньше per_chat_interval
+                self._schedule(chat_id)
+                self.ready.task_done()
+
+    async def _call(self, method, chat_id):
+        token = _dispatching.set(True)
+        try:
+            for attempt in range(self.max_retries + 1):
+                await self.bucket.acquire()
+                try:
+                    return await self.bot(method)
+                except TelegramRetryAfter as e:
+                    if attempt == self.max_retries:
+                        raise
+                    logger.warning(f"⏳ Flood limit для чата {chat_id}: ждем {e.retry_after} с")
+                    self.bucket.pause(e.retry_after)
+                finally:
+                    if chat_id is not None:
+                        self.chat_next_time[chat_id] = time.monotonic() + self.per_chat_interval
+        finally:
+            _dispatching.reset(token)
+
+    def _prune_chat_times(self):
+        """Не даем словарю времен расти бесконечно: убираем истекшие записи"""
+        if len(self.chat_next_time) < 10000:
+            return
+        now = time.monotonic()
+        for chat_id in [c for c, t in self.chat_next_time.items() if t <= now]:
+            del self.chat_next_time[chat_id]
+
+class OutboundRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: отправки в обход очереди (message.answer,
+    callback.answer, edit_text и т.п. в обработчиках) тоже ставятся в нее,
+    поэтому общий лимит, лимит на чат и повтор после RetryAfter действуют
+    на весь исходящий трафик. Пока воркеры очереди не запущены (скрипты,
+    остановка), вызовы идут напрямую.
+
+    Регистрируется раньше замера вызовов API, чтобы время ожидания в
+    очереди не попадало в метрики api.
+    """
+
+    def __init__(self, outbound):
+        self.outbound = outbound
+
+    async def __call__(self, make_request, bot, method):
+        if (_dispatching.get() or not self.outbound.workers
+                or not method.__api_method__.startswith(OUTBOUND_METHOD_PREFIXES)):
+            return await make_request(bot, method)
+        return await self.outbound.send(method)
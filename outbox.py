@@ -0,0 +1,256 @@
+# outbox.py
+import asyncio
+import logging
+import random
+import time
+
+from aiogram.client.default import Default
+from aiogram.exceptions import (
+    TelegramBadRequest, TelegramForbiddenError, TelegramNotFound,
+    TelegramRetryAfter, TelegramUnauthorizedError
+)
+from aiogram.methods import SendMessage
+
+from broadcast import BLOCKED_ERRORS
+from outbound import PRIORITY_DIALOG, PRIORITY_NORMAL
+
+logger = logging.getLogger(__name__)
+
+# Методы, которые можно положить в outbox
+OUTBOX_METHODS = {'SendMessage': SendMessage}
+
+def classify_error(error):
+    """Статус после ошибки: 'blocked' и 'failed' не повторяем, 'retry' - повторим позже"""
+    if isinstance(error, TelegramForbiddenError):
+        return 'blocked'
+    if isinstance(error, TelegramBadRequest):
+        if any(text in str(error).lower() for text in BLOCKED_ERRORS):
+            return 'blocked'
+        # Некорректный запрос не исправится повтором
+        return 'failed'
+    if isinstance(error, (TelegramNotFound, TelegramUnauthorizedError)):
+        return 'failed'
+    return 'retry'
+
+class Outbox:
+    """Надежная отправка сообщений через таблицу outbox.
+
+    Сообщение сначала сохраняется в SQLite и только потом отправляется
+    фоновым воркером через общую очередь исходящих (лимиты Telegram).
+    Временные ошибки повторяются с экспоненциальной задержкой, RetryAfter -
+    через указанное Telegram время, а заблокированный бот и неверный чат
+    фиксируются без повторов. Неотправленное переживает перезапуск.
+
+    Сообщения забираются непрерывно, как только освобождается место:
+    в отправке одновременно не больше max_in_flight обычных сообщений и
+    отдельно до dialog_in_flight сообщений диалогов - переписка админа
+    не ждет, пока отправятся напоминания. Аренда забранных сообщений
+    продлевается каждые lease / 3 секунд, пока они в отправке, поэтому
+    другой процесс не заберет их повторно, даже если очередь исходящих
+    держит сообщение дольше lease.
+    """
+
+    def __init__(self, database, outbound, max_in_flight=50, dialog_in_flight=10, lease=60, poll_interval=5.0,
+                 max_attempts=8, base_delay=2.0, max_delay=600.0, keep_finished_days=7, wait_timeout=30.0):
+        self.database = database
+        self.outbound = outbound
+        self.max_in_flight = max_in_flight
+        self.dialog_in_flight = dialog_in_flight
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.keep_finished_days = keep_finished_days
+        self.wait_timeout = wait_timeout
+        self.wake = asyncio.Event()
+        # id -> future для тех, кто ждет результат отправки (wait=True)
+        self.waiters = {}
+        # id -> True для сообщений диалога, которые сейчас отправляются
+        self.in_flight = {}
+        self.tasks = set()
+        self.runner = None
+        self.last_purge = 0
+        self.last_renew = 0
+
+    async def send_message(self, chat_id, text, priority=PRIORITY_NORMAL, dedupe_key=None,
+                           sent_action=None, wait=False, **kwargs):
+        """Кладем сообщение в outbox.
+
+        dedupe_key защищает от повторной постановки (например, напоминания),
+        sent_action записывается в interactions после успешной доставки.
+        С wait=True ждем итог: возвращает 'sent', 'blocked', 'failed' или
+        'pending' (будет повторено позже).
+        """
+        method = SendMessage(chat_id=chat_id, text=text, **kwargs)
+        # Поля со значением Default (parse_mode бота и т.п.) подставит бот при отправке
+        defaults = {name for name, value in method if isinstance(value, Default)}
+        payload = method.model_dump_json(exclude_none=True, exclude=defaults)
+        outbox_id = await self.database.enqueue_outbox(
+            chat_id, 'SendMessage', payload, priority, dedupe_key, sent_action
+        )
+        if outbox_id is None:
+            return None
+
+        if not wait:
+            self.wake.set()
+            return outbox_id
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[outbox_id] = future
+        # Отправляем сами, иначе сообщение может забрать воркер другого процесса
+        row = await self.database.claim_outbox_message(outbox_id, self.lease)
+        if row:
+            self._start(row)
+        try:
+            return await asyncio.wait_for(future, self.wait_timeout)
+        except asyncio.TimeoutError:
+            return 'pending'
+        finally:
+            self.waiters.pop(outbox_id, None)
+
+    def start(self):
+        if self.runner is None:
+            self.runner = asyncio.create_task(self.run())
+
+    async def stop(self, timeout=10):
+        """Перестаем забирать сообщения и ждем начатые отправки (не дольше timeout).
+
+        Недосланные остаются pending и уйдут после перезапуска, когда истечет аренда.
+        """
+        if self.runner is not None:
+            self.runner.cancel()
+            self.runner = None
+        if self.tasks:
+            _, pending = await asyncio.wait(set(self.tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"⚠️ Outbox: не дождались отправки при остановке: {len(pending)}")
+
+    async def run(self):
+        """Воркер: забираем готовые сообщения, пока есть свободные места для отправки"""
+        while True:
+            claimed = 0
+            # Сбрасываем до выборки: сигнал, пришедший во время нее, не потеряется
+            self.wake.clear()
+            try:
+                claimed = await self._claim()
+                if time.monotonic() - self.last_renew >= self.lease / 3:
+                    await self._renew()
+                if not self.in_flight:
+                    await self._purge()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки outbox: {e}")
+
+            # Ждем новое сообщение, завершение отправки, ближайший повтор или продление аренды
+            lanes = self._free_lanes()
+            if claimed and lanes:
+                continue
+            timeout = min(self.poll_interval, self.lease / 3)
+            # Повторы смотрим только в полосах со свободными местами: готовые
+            # сообщения заполненной полосы ждут завершения отправки (wake), а не
+            # крутят выборку в потоке БД
+            for min_priority, max_priority in lanes:
+                next_attempt = await self.database.get_next_outbox_attempt(min_priority, max_priority)
+                if next_attempt is not None:
+                    timeout = min(timeout, max(0.0, next_attempt - time.time()))
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _free_slots(self):
+        dialogs = sum(1 for is_dialog in self.in_flight.values() if is_dialog)
+        return self.dialog_in_flight - dialogs, self.max_in_flight - (len(self.in_flight) - dialogs)
+
+    def _free_lanes(self):
+        """Диапазоны приоритетов (min, max) полос, в которых есть свободные места"""
+        dialog_free, general_free = self._free_slots()
+        if dialog_free > 0 and general_free > 0:
+            return [(0, None)]
+        if dialog_free > 0:
+            return [(0, PRIORITY_DIALOG)]
+        if general_free > 0:
+            return [(PRIORITY_DIALOG + 1, None)]
+        return []
+
+    async def _claim(self):
+        """Забираем сообщения диалогов и остальные в пределах свободных мест"""
+        dialog_free, general_free = self._free_slots()
+        rows = []
+        if dialog_free > 0:
+            rows += await self.database.claim_outbox(dialog_free, self.lease, max_priority=PRIORITY_DIALOG)
+        if general_free > 0:
+            rows += await self.database.claim_outbox(general_free, self.lease, min_priority=PRIORITY_DIALOG + 1)
+        for row in rows:
+            self._start(row)
+        return len(rows)
+
+    def _start(self, row):
+        self.in_flight[row['id']] = row['priority'] <= PRIORITY_DIALOG
+        task = asyncio.create_task(self._process(row))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _renew(self):
+        self.last_renew = time.monotonic()
+        if self.in_flight:
+            await self.database.renew_outbox_lease(list(self.in_flight), self.lease)
+
+    async def _process(self, row):
+        try:
+            outbox_id, status, _, _, _ = result = await self._send(row)
+            # Убираем из аренды до записи результата: продление, поставленное
+            # в поток БД раньше, выполнится раньше и не перетрет next_attempt_at
+            self.in_flight.pop(outbox_id, None)
+            await self.database.complete_outbox([result])
+
+            if status == 'sent' and row['sent_action']:
+                await self.database.log_interaction(row['chat_id'], row['sent_action'])
+            elif status == 'blocked':
+                await self.database.mark_user_blocked(row['chat_id'])
+            future = self.waiters.pop(outbox_id, None)
+            if future and not future.done():
+                future.set_result(status)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки outbox #{row['id']}: {e}")
+        finally:
+            self.in_flight.pop(row['id'], None)
+            self.wake.set()
+
+    async def _send(self, row):
+        """Одна попытка отправки, возвращает (id, status, attempts, next_attempt_at, error)"""
+        attempts = row['attempts'] + 1
+        try:
+            method = OUTBOX_METHODS[row['method']].model_validate_json(row['payload'])
+            await self.outbound.send(method, priority=row['priority'])
+            return row['id'], 'sent', attempts, time.time(), None
+        except TelegramRetryAfter as e:
+            # Очередь исходящих уже исчерпала свои повторы - ждем, сколько просит Telegram
+            return row['id'], 'pending', attempts, time.time() + e.retry_after, str(e)
+        except Exception as e:
+            status = classify_error(e) if row['method'] in OUTBOX_METHODS else 'failed'
+            if status == 'retry':
+                if attempts >= self.max_attempts:
+                    status = 'failed'
+                else:
+                    delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+                    delay *= random.uniform(0.8, 1.2)
+                    logger.warning(f"⚠️ Outbox #{row['id']}: попытка {attempts} не удалась ({e}), повтор через {delay:.0f} с")
+                    return row['id'], 'pending', attempts, time.time() + delay, str(e)
+            logger.warning(f"⚠️ Outbox #{row['id']} для {row['chat_id']}: {status} ({e})")
+            return row['id'], status, attempts, time.time(), str(e)[:200]
+
+    async def _purge(self):
+        if time.time() - self.last_purge < 3600:
+            return
+        self.last_purge = time.time()
+        removed = await self.database.purge_outbox(time.time() - self.keep_finished_days * 86400)
+        if removed:
+            logger.info(f"🧹 Из outbox удалено завершенных сообщений: {removed}")
+
+    async def stats(self):
+        return await self.database.get_outbox_stats(time.time() - 86400)
@@ -0,0 +1,163 @@
+# perf.py
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Метрики производительности можно отключить: PERF_ENABLED=0
+PERF_ENABLED = os.getenv('PERF_ENABLED', '1') not in ('0', 'false', 'no')
+
+def percentile(values, p):
+    """Перцентиль по отсортированному списку"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+class RollingWindow:
+    """Последние замеры одной метрики за window секунд.
+
+    Замеры пишут поток записи БД, потоки пула чтения и цикл событий.
+    deque.append атомарен под GIL, а накопительные count/total - это
+    read-modify-write, поэтому они меняются под блокировкой: иначе
+    параллельные замеры теряют приращения, а счетчики Prometheus должны
+    только расти. Старые замеры вытесняет maxlen и отбрасывает фильтр по
+    времени при чтении.
+    """
+
+    def __init__(self, window=300, maxlen=2048):
+        self.window = window
+        self.samples = deque(maxlen=maxlen)
+        # Накопительные значения с запуска - для счетчиков Prometheus
+        self.count = 0
+        self.total = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, duration):
+        self.samples.append((time.monotonic(), duration))
+        with self.lock:
+            self.count += 1
+            self.total += duration
+
+    def totals(self):
+        """Согласованная пара (count, total) с запуска"""
+        with self.lock:
+            return self.count, self.total
+
+    def stats(self):
+        cutoff = time.monotonic() - self.window
+        # copy() выполняется целиком в C и не видит параллельных append
+        durations = sorted(duration for moment, duration in self.samples.copy() if moment >= cutoff)
+        return {
+            'count': len(durations),
+            'mean': sum(durations) / len(durations) if durations else 0.0,
+            'p50': percentile(durations, 50),
+            'p95': percentile(durations, 95),
+            'p99': percentile(durations, 99),
+            'max': durations[-1] if durations else 0.0,
+        }
+
+class PerfRegistry:
+    """Метрики по видам: handler, update, db, api -> имя -> RollingWindow"""
+
+    KINDS = ('update', 'handler', 'db', 'api')
+
+    def __init__(self, enabled=True, window=300):
+        self.enabled = enabled
+        self.window = window
+        self.metrics = {kind: {} for kind in self.KINDS}
+
+    def record(self, kind, name, duration):
+        metrics = self.metrics[kind]
+        metric = metrics.get(name)
+        if metric is None:
+            metric = metrics.setdefault(name, RollingWindow(self.window))
+        metric.add(duration)
+
+    def report(self, kind):
+        """Статистика за окно по каждой метрике вида, самые медленные (p95) - первыми"""
+        rows = [(name, metric.stats()) for name, metric in list(self.metrics[kind].items())]
+        rows = [row for row in rows if row[1]['count']]
+        return sorted(rows, key=lambda row: row[1]['p95'], reverse=True)
+
+    def render_prometheus(self):
+        """Метрики в текстовом формате Prometheus (summary по каждому виду)"""
+        lines = []
+        for kind in self.KINDS:
+            metric_name = f'bot_{kind}_duration_seconds'
+            lines.append(f'# HELP {metric_name} {kind} latency, quantiles over the last {self.window}s')
+            lines.append(f'# TYPE {metric_name} summary')
+            for name, metric in sorted(list(self.metrics[kind].items())):
+                stats = metric.stats()
+                count, total = metric.totals()
+                label = name.replace('\\', '\\\\').replace('"', '\\"')
+                for quantile in ('0.5', '0.95', '0.99'):
+                    value = stats['p' + str(round(float(quantile) * 100))]
+                    lines.append(f'{metric_name}{{name="{label}",quantile="{quantile}"}} {value:.6f}')
+                lines.append(f'{metric_name}_sum{{name="{label}"}} {total:.6f}')
+                lines.append(f'{metric_name}_count{{name="{label}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+perf = PerfRegistry(enabled=PERF_ENABLED)
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """Внешний middleware: полное время обработки апдейта по типу события"""
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            perf.record('update', event.event_type, time.perf_counter() - started)
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Внутренний middleware: время конкретного обработчика (известен после фильтров)"""
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_object = data.get('handler')
+            name = handler_object.callback.__name__ if handler_object else 'unknown'
+            perf.record('handler', name, time.perf_counter() - started)
+
+class RequestTimingMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время каждого вызова Bot API по методу"""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            perf.record('api', type(method).__name__, time.perf_counter() - started)
+
+def setup_perf(dp, bot):
+    """Подключаем замеры к диспетчеру и сессии бота (если метрики включены)"""
+    if not perf.enabled:
+        return
+    dp.update.outer_middleware(UpdateTimingMiddleware())
+    handler_middleware = HandlerTimingMiddleware()
+    dp.message.middleware(handler_middleware)
+    dp.callback_query.middleware(handler_middleware)
+    bot.session.middleware(RequestTimingMiddleware())
+
+async def metrics_handler(request):
+    return web.Response(text=perf.render_prometheus(), content_type='text/plain', charset='utf-8')
+
+async def start_metrics_server(host, port, path='/metrics'):
+    """Отдельный HTTP-сервер для Prometheus, возвращает runner для остановки"""
+    app = web.Application()
+    app.router.add_get(path, metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"📈 Метрики Prometheus: http://{host}:{port}{path}")
+    return runner
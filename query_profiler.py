@@ -0,0 +1,162 @@
+# query_profiler.py
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Порог медленного запроса в мс; не задан - профайлер выключен
+DB_SLOW_QUERY_MS = os.getenv('DB_SLOW_QUERY_MS')
+
+# Для таких запросов имеет смысл EXPLAIN QUERY PLAN
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+def normalize_sql(sql):
+    """Запрос без лишних пробелов - ключ агрегированной статистики"""
+    return re.sub(r'\s+', ' ', sql).strip()
+
+def params_shape(parameters):
+    """Типы параметров без значений (в лог не попадают данные пользователей)"""
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in parameters.items()) + '}'
+    return '(' + ', '.join(type(value).__name__ for value in parameters) + ')'
+
+def format_plan(rows):
+    """Строки EXPLAIN QUERY PLAN (id, parent, notused, detail) в виде дерева"""
+    depth = {0: 0}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, 0) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return '\n'.join(lines)
+
+def has_full_scan(plan):
+    """В плане есть полный проход по таблице (SCAN без индекса)"""
+    return any(
+        line.strip().startswith('SCAN ') and 'USING' not in line and 'CONSTANT ROW' not in line
+        for line in (plan or '').splitlines()
+    )
+
+class QueryProfiler:
+    """Профайлер запросов SQLite.
+
+    Соединения с ProfilingConnection замеряют каждый execute/executemany.
+    По каждому запросу копится статистика (число, суммарное и максимальное
+    время), запросы дольше порога пишутся в лог вместе с типами параметров
+    и планом EXPLAIN QUERY PLAN. План снимается один раз на запрос.
+    Замеряется выполнение execute - время последующих fetch в него не входит.
+    """
+
+    def __init__(self, threshold_ms=None):
+        self.enabled = threshold_ms is not None
+        self.threshold = (threshold_ms or 0) / 1000
+        self.lock = threading.Lock()
+        # sql -> {'count', 'total', 'max', 'slow', 'rows', 'plan'}
+        self.stats = {}
+
+    def record(self, connection, sql, parameters, duration, many=False, rows=None):
+        key = normalize_sql(sql)
+        with self.lock:
+            stat = self.stats.get(key)
+            if stat is None:
+                stat = self.stats[key] = {'count': 0, 'total': 0.0, 'max': 0.0, 'slow': 0, 'rows': 0, 'plan': None}
+            stat['count'] += 1
+            stat['total'] += duration
+            stat['max'] = max(stat['max'], duration)
+            if rows and rows > 0:
+                stat['rows'] += rows
+            is_slow = duration >= self.threshold
+            if is_slow:
+                stat['slow'] += 1
+            need_plan = is_slow and stat['plan'] is None
+
+        if not is_slow:
+            return
+
+        if need_plan:
+            plan = self.explain(connection, sql, parameters)
+            with self.lock:
+                stat['plan'] = plan
+        shape = params_shape(parameters) if parameters is not None else '()'
+        if many:
+            shape = f"executemany × {rows if rows is not None and rows >= 0 else '?'}, {shape}"
+        logger.warning(
+            f"🐢 Медленный запрос {duration * 1000:.1f} мс: {key[:300]}\n"
+            f"   параметры: {shape}\n{stat['plan'] or '   (план недоступен)'}"
+        )
+
+    def explain(self, connection, sql, parameters):
+        """План запроса через отдельный курсор, чтобы не сбить результат исходного"""
+        if not normalize_sql(sql).upper().startswith(EXPLAINABLE):
+            return None
+        try:
+            cursor = sqlite3.Cursor(connection)
+            rows = cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parameters or ()).fetchall()
+            cursor.close()
+            return format_plan(tuple(row) for row in rows)
+        except Exception as e:
+            logger.debug(f"EXPLAIN QUERY PLAN не выполнен: {e}")
+            return None
+
+    def report(self, limit=20, order='total'):
+        """Запросы, отсортированные по суммарному (или max/count/slow) времени"""
+        with self.lock:
+            items = [(sql, dict(stat)) for sql, stat in self.stats.items()]
+        items.sort(key=lambda item: item[1][order], reverse=True)
+        return items[:limit]
+
+    def format_report(self, limit=10, order='total', with_plans=True):
+        lines = [f"🐢 Запросы к БД по {order} (порог медленного: {self.threshold * 1000:g} мс)"]
+        for index, (sql, stat) in enumerate(self.report(limit, order), 1):
+            mean = stat['total'] / stat['count'] if stat['count'] else 0
+            scan = " ⚠️ SCAN" if has_full_scan(stat['plan']) else ""
+            lines.append(
+                f"\n{index}. {stat['total'] * 1000:.0f} мс всего, {stat['count']} раз, "
+                f"ср. {mean * 1000:.2f} мс, макс. {stat['max'] * 1000:.1f} мс, медленных {stat['slow']}{scan}"
+            )
+            lines.append(f"   {sql[:200]}")
+            if with_plans and stat['plan']:
+                lines.append(stat['plan'])
+        return '\n'.join(lines)
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+query_profiler = QueryProfiler(float(DB_SLOW_QUERY_MS) if DB_SLOW_QUERY_MS else None)
+
+class ProfilingCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        result = super().execute(sql, parameters)
+        query_profiler.record(self.connection, sql, parameters, time.perf_counter() - started)
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        # Генератор параметров нельзя просмотреть заранее - тогда план без параметров
+        first = seq_of_parameters[0] if isinstance(seq_of_parameters, (list, tuple)) and seq_of_parameters else None
+        started = time.perf_counter()
+        result = super().executemany(sql, seq_of_parameters)
+        query_profiler.record(
+            self.connection, sql, first, time.perf_counter() - started, many=True, rows=self.rowcount
+        )
+        return result
+
+class ProfilingConnection(sqlite3.Connection):
+    """Соединение, все запросы которого проходят через ProfilingCursor"""
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def connection_factory():
+    """Класс соединения для sqlite3.connect(factory=...)"""
+    return ProfilingConnection if query_profiler.enabled else sqlite3.Connection
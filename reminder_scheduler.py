@@ -0,0 +1,104 @@
+# reminder_scheduler.py
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+class ReminderScheduler:
+    """Планировщик напоминаний по событиям вместо опроса раз в минуту.
+
+    В памяти держим min-heap ближайших сроков (не больше preload_limit),
+    спим до самого раннего и просыпаемся сразу, когда schedule_reminder
+    добавляет новое напоминание. Сами напоминания забираются из БД пачками
+    через claim_due_reminders, поэтому heap - только подсказка о сроках.
+    """
+
+    def __init__(self, database, send_callback, batch_size=50, preload_limit=1000, idle_timeout=3600, reload_interval=None):
+        self.database = database
+        self.send_callback = send_callback
+        self.batch_size = batch_size
+        self.preload_limit = preload_limit
+        self.idle_timeout = idle_timeout
+        # Периодическая перезагрузка из БД: нужна, если напоминания
+        # добавляют другие процессы и notify() до нас не доходит
+        self.reload_interval = reload_interval
+        self.loaded_at = 0.0
+        self.heap = []
+        # Если в heap загружены не все напоминания - время последнего загруженного
+        self.horizon = None
+        self.wakeup = asyncio.Event()
+
+    def notify(self, reminder_id, scheduled_time):
+        """Сообщаем о новом напоминании (вызывается после schedule_reminder)"""
+        if self.horizon is not None and scheduled_time > self.horizon:
+            # Догрузим из БД, когда дойдем до горизонта
+            return
+        heapq.heappush(self.heap, (scheduled_time, reminder_id))
+        if len(self.heap) > self.preload_limit * 2:
+            self._trim()
+        self.wakeup.set()
+
+    def _trim(self):
+        """Оставляем в памяти только preload_limit ближайших сроков"""
+        self.heap = heapq.nsmallest(self.preload_limit, self.heap)
+        self.horizon = self.heap[-1][0]
+        heapq.heapify(self.heap)
+
+    async def load(self):
+        """Восстанавливаем ближайшие сроки из таблицы reminders"""
+        upcoming = await self.database.get_upcoming_reminders(self.preload_limit)
+        self.heap = [(scheduled_time, reminder_id) for reminder_id, scheduled_time in upcoming]
+        heapq.heapify(self.heap)
+        self.horizon = upcoming[-1][1] if len(upcoming) >= self.preload_limit else None
+        self.loaded_at = time.monotonic()
+        logger.info(f"⏰ Загружено напоминаний в планировщик: {len(self.heap)}")
+
+    async def process_due(self):
+        """Отправляем все наступившие напоминания пачками"""
+        while True:
+            reminders = await self.database.claim_due_reminders(self.batch_size)
+            # Пачку отправляем параллельно: темп ограничивает очередь исходящих
+            await asyncio.gather(*(self._send(reminder) for reminder in reminders))
+            if len(reminders) < self.batch_size:
+                break
+
+    async def _send(self, reminder):
+        try:
+            await self.send_callback(reminder)
+        except Exception as e:
+            logger.error(f"❌ Ошибка отправки напоминания {reminder['id']}: {e}")
+
+    async def run(self):
+        await self.load()
+        while True:
+            try:
+                now = datetime.now()
+                if self.heap and self.heap[0][0] <= now:
+                    while self.heap and self.heap[0][0] <= now:
+                        heapq.heappop(self.heap)
+                    await self.process_due()
+                    continue
+
+                if not self.heap and self.horizon is not None:
+                    await self.load()
+                    continue
+
+                timeout = (self.heap[0][0] - now).total_seconds() if self.heap else self.idle_timeout
+                if self.reload_interval:
+                    timeout = min(timeout, self.reload_interval)
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    reload_due = self.reload_interval and time.monotonic() - self.loaded_at >= self.reload_interval
+                    if not self.heap or reload_due:
+                        # Страховка: периодически сверяемся с БД
+                        await self.load()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка в планировщике напоминаний: {e}")
+                await asyncio.sleep(5)
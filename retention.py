@@ -0,0 +1,82 @@
+# retention.py
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Сегменты когорты по полученным напоминаниям (маска: 1 - 30 часов, 2 - 72 часа)
+SEGMENT_NAMES = {0: 'без напоминаний', 1: 'только 30ч', 2: 'только 72ч', 3: '30ч и 72ч'}
+
+async def update_retention(database, chunk_days=7):
+    """Досчитываем матрицу удержания: незавершенные и новые когорты до вчера.
+
+    Когорты пересчитываются порциями по chunk_days дней. Агрегация идет
+    через пул чтения (снапшот WAL), в поток записи БД попадает только
+    замена готовых строк, поэтому /start и буфер взаимодействий ее не ждут.
+    Возвращает число пересчитанных строк.
+    """
+    start = await database.get_retention_start()
+    if not start:
+        return 0
+
+    last = date.today() - timedelta(days=1)
+    day = date.fromisoformat(start)
+    updated = 0
+    while day <= last:
+        chunk_end = min(day + timedelta(days=chunk_days - 1), last)
+        rows = await database.aggregate_retention(day.isoformat(), chunk_end.isoformat())
+        if rows is None:
+            break
+        saved = await database.save_retention(day.isoformat(), chunk_end.isoformat(), rows)
+        if saved is None:
+            break
+        updated += saved
+        day = chunk_end + timedelta(days=1)
+
+    logger.info(f"📅 Удержание когорт обновлено с {start}: {updated} строк")
+    return updated
+
+def seconds_until(hour):
+    now = datetime.now()
+    run_at = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if run_at <= now:
+        run_at += timedelta(days=1)
+    return (run_at - now).total_seconds()
+
+async def run_nightly(database, hour=3):
+    """Пересчет при запуске и затем каждую ночь в hour часов"""
+    while True:
+        try:
+            await update_retention(database)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обновления удержания: {e}")
+        await asyncio.sleep(seconds_until(hour))
+
+def format_retention(rows):
+    """Таблица удержания по строкам (день, сегмент, users, d1, d3, d7)"""
+    if not rows:
+        return "📅 Удержание когорт\n\nДанных пока нет - матрица считается ночью"
+
+    cohorts = {}
+    for day, segment, users, d1, d3, d7 in rows:
+        cohorts.setdefault(day, {})[segment] = (users, d1, d3, d7)
+
+    def line(title, values):
+        users = values[0]
+        percents = ' | '.join(f"{value / users * 100:4.0f}%" if users else "   —" for value in values[1:])
+        return f"{title}: {users} | {percents}\n"
+
+    def total(segments, keys):
+        values = [segments[key] for key in keys if key in segments]
+        return tuple(sum(column) for column in zip(*values)) if values else (0, 0, 0, 0)
+
+    text = "📅 Удержание когорт (пользователи | D1 | D3 | D7)\n"
+    for day, segments in cohorts.items():
+        text += f"\n{day}\n"
+        text += line("  все", total(segments, SEGMENT_NAMES))
+        reminded = total(segments, (1, 2, 3))
+        if reminded[0]:
+            text += line("  🔔 с напоминаниями", reminded)
+            text += line("  🔕 без напоминаний", total(segments, (0,)))
+    return text
@@ -0,0 +1,157 @@
+# sharding.py
+import asyncio
+import logging
+import multiprocessing
+
+logger = logging.getLogger(__name__)
+
+# Типы апдейтов, которые обрабатывает бот
+ALLOWED_UPDATES = ['message', 'callback_query']
+
+def shard_for(update, workers):
+    """Номер процесса для апдейта: все апдейты одного пользователя - в один процесс"""
+    event = update.event
+    user = getattr(event, 'from_user', None)
+    if user is not None:
+        return user.id % workers
+    chat = getattr(event, 'chat', None)
+    return chat.id % workers if chat is not None else 0
+
+async def _front(queues):
+    """Фронт-процесс: получает апдейты long polling и раскладывает по воркерам"""
+    import bot as app
+
+    try:
+        bot_info = await app.bot.get_me()
+        print(f"✅ Бот @{bot_info.username} авторизован")
+    except Exception as e:
+        print(f"❌ Ошибка авторизации бота: {e}")
+        return
+
+    await app.bot.delete_webhook()
+    print(f"🟢 Бот запущен: {len(queues)} процессов-обработчиков")
+
+    loop = asyncio.get_running_loop()
+    offset = None
+    try:
+        while True:
+            try:
+                updates = await app.bot.get_updates(offset=offset, timeout=30, allowed_updates=ALLOWED_UPDATES)
+            except Exception as e:
+                logger.error(f"❌ Ошибка получения апдейтов: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            for update in updates:
+                offset = update.update_id + 1
+                queue = queues[shard_for(update, len(queues))]
+                payload = update.model_dump_json(exclude_unset=True)
+                # put блокирует при заполненной очереди воркера - это и есть backpressure
+                await loop.run_in_executor(None, queue.put, payload)
+    finally:
+        await app.bot.session.close()
+        app.async_db.close()
+
+async def _worker(index, workers, queue, ready=None):
+    """Процесс-обработчик: выполняет обработчики dp для своей доли пользователей.
+
+    ready (multiprocessing.Event) выставляется, когда сервисы запущены и
+    процесс начинает забирать апдейты.
+    """
+    import bot as app
+    from aiogram.types import Update
+
+    # Лимит Telegram общий на бота - делим его между процессами
+    app.outbound.bucket.rate /= workers
+    app.outbound.bucket.capacity /= workers
+    # Напоминания добавляют все процессы, а отправляет только первый
+    app.reminder_scheduler.reload_interval = 60
+
+    await app.start_services(background_tasks=index == 0)
+    asyncio.create_task(app.dialogs.run_sync())
+    if ready is not None:
+        ready.set()
+
+    loop = asyncio.get_running_loop()
+    # Апдейты одного пользователя обрабатываются строго по очереди
+    user_locks = {}
+    user_pending = {}
+    in_flight = asyncio.Semaphore(100)
+
+    async def process(update, key):
+        try:
+            async with user_locks[key]:
+                await app.dp.feed_update(app.bot, update)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки апдейта {update.update_id}: {e}")
+        finally:
+            in_flight.release()
+            user_pending[key] -= 1
+            if not user_pending[key]:
+                del user_pending[key]
+                del user_locks[key]
+
+    try:
+        while True:
+            payload = await loop.run_in_executor(None, queue.get)
+            if payload is None:
+                break
+            update = Update.model_validate_json(payload, context={'bot': app.bot})
+            key = getattr(update.event, 'from_user', None)
+            key = key.id if key is not None else None
+            if key not in user_locks:
+                user_locks[key] = asyncio.Lock()
+            user_pending[key] = user_pending.get(key, 0) + 1
+            await in_flight.acquire()
+            asyncio.create_task(process(update, key))
+    finally:
+        # Дожидаемся обработки уже принятых апдейтов
+        while user_pending:
+            await asyncio.sleep(0.1)
+        await app.stop_services()
+        await app.bot.session.close()
+
+def _worker_main(index, workers, queue):
+    logging.basicConfig(
+        format=f'%(asctime)s - worker{index} - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    try:
+        asyncio.run(_worker(index, workers, queue))
+    except KeyboardInterrupt:
+        pass
+
+def run_sharded(workers, queue_size=1000):
+    """Запуск фронт-процесса и workers процессов-обработчиков.
+
+    Апдейты раскладываются по процессам по from_user.id, поэтому порядок
+    апдейтов одного пользователя сохраняется, а разные пользователи
+    обрабатываются параллельно. Все процессы пишут в один SQLite-файл
+    в режиме WAL (busy_timeout ждет освобождения блокировки записи).
+    """
+    from database import db
+
+    # Схему обновляем до старта воркеров: их start_services уже читает
+    # outbox, dialogs и напоминания и полагается на новые индексы
+    if not db.migrate():
+        print("❌ Не удалось обновить схему БД - процессы-обработчики не запущены")
+        return
+
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue(maxsize=queue_size) for _ in range(workers)]
+    processes = [
+        context.Process(target=_worker_main, args=(index, workers, queue), name=f'bot-worker-{index}')
+        for index, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        asyncio.run(_front(queues))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(timeout=30)
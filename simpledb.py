@@ -1,52 +1,194 @@
 import json
 import os
+import threading
 from datetime import datetime
 import logging
 
 class SimpleDB:
-    def __init__(self):
-        self.users_file = 'users.json'
-        self._ensure_files_exist()
+    """Пользователи в JSONL-журнале.
 
-    def _ensure_files_exist(self):
-        if not os.path.exists(self.users_file):
-            with open(self.users_file, 'w', encoding='utf-8') as f:
-                json.dump([], f, ensure_ascii=False, indent=2)
+    Каждое изменение дописывается в конец users.jsonl одной строкой - полной
+    записью пользователя, при чтении журнала последняя запись побеждает.
+    В памяти держится индекс user_id -> запись, поэтому проверка дубликата
+    не читает файл. Когда устаревших строк становится много, журнал
+    переписывается во временный файл и атомарно подменяется через os.replace.
+    Старый users.json (JSON-массив) при первом запуске переносится в журнал.
+    Если он не читается, журнал не создается: новые записи держатся в памяти,
+    а перенос повторяется перед каждой записью, пока файл не исправят.
+    """
+
+    def __init__(self, users_file='users.jsonl', legacy_file='users.json', compact_ratio=2.0, min_compact_lines=1000):
+        self.users_file = users_file
+        self.legacy_file = legacy_file
+        self.compact_ratio = compact_ratio
+        self.min_compact_lines = min_compact_lines
+        self.lock = threading.Lock()
+        self.users = {}
+        self.log_lines = 0
+        # Старый файл еще не перенесен - журнал создавать нельзя, иначе он потеряется
+        self.legacy_pending = False
+        self._load()
 
-    def _load_data(self):
+    def _load(self):
         try:
-            with open(self.users_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            self._read_log()
         except Exception as e:
             logging.error(f"Ошибка загрузки {self.users_file}: {e}")
-            return []
 
-    def _save_data(self, data):
+    def _read_log(self):
+        if not os.path.exists(self.users_file):
+            if os.path.exists(self.legacy_file):
+                self._migrate_legacy()
+            else:
+                open(self.users_file, 'a', encoding='utf-8').close()
+            return
+
+        damaged = False
+        with open(self.users_file, 'r', encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    user = json.loads(line)
+                except ValueError:
+                    # Недописанная строка после сбоя - пропускаем и переписываем журнал
+                    logging.warning(f"⚠️ Пропущена поврежденная строка {number} в {self.users_file}")
+                    damaged = True
+                    continue
+                self.users[user.get('user_id')] = user
+                self.log_lines += 1
+
+        if damaged:
+            # Иначе следующая запись приклеится к недописанной строке
+            self._compact()
+
+    def _migrate_legacy(self):
+        """Переносим старый файл в журнал; False - файл не читается, перенос отложен"""
         try:
-            with open(self.users_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            users = load_legacy_users(self.legacy_file)
         except Exception as e:
-            logging.error(f"Ошибка сохранения {self.users_file}: {e}")
+            # Старый файл не трогаем и журнал не создаем - перенос повторится при следующей записи
+            logging.error(f"Ошибка загрузки {self.legacy_file}: {e}")
+            self.legacy_pending = True
+            return False
+        # Записи, сделанные, пока файл не читался, новее старых
+        pending = self.users
+        self.users = {user.get('user_id'): user for user in users}
+        self.users.update(pending)
+        if not self._compact():
+            self.legacy_pending = True
+            return False
+        self.legacy_pending = False
+        logging.info(f"✅ {self.legacy_file} перенесен в журнал {self.users_file}: {len(self.users)} пользователей")
+        return True
 
-    def add_user(self, user_data):
-        users = self._load_data()
-        if not any(u.get('user_id') == user_data.get('user_id') for u in users):
-            user_data['created_at'] = datetime.now().isoformat()
-            users.append(user_data)
-            self._save_data(users)
-            logging.info(f"✅ Добавлен пользователь: {user_data.get('user_id')}")
+    def _append(self, user):
+        """Дописываем запись одним write в файл, открытый на добавление"""
+        if self.legacy_pending:
+            # Запись попадет в журнал вместе со старыми пользователями при переносе
+            self.users[user.get('user_id')] = user
+            if not self._migrate_legacy():
+                logging.warning(f"⚠️ {self.legacy_file} не перенесен, пользователь {user.get('user_id')} сохранен только в памяти")
+            return
+        line = (json.dumps(user, ensure_ascii=False) + '\n').encode('utf-8')
+        fd = os.open(self.users_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.log_lines += 1
+
+        if self.log_lines >= self.min_compact_lines and self.log_lines > len(self.users) * self.compact_ratio:
+            self._compact()
+
+    def _compact(self):
+        """Переписываем журнал по одной строке на пользователя"""
+        temp_file = self.users_file + '.tmp'
+        try:
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                for user in self.users.values():
+                    f.write(json.dumps(user, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.users_file)
+            self.log_lines = len(self.users)
             return True
-        return False
+        except Exception as e:
+            logging.error(f"Ошибка сжатия {self.users_file}: {e}")
+            return False
+
+    def add_user(self, user_data):
+        with self.lock:
+            if user_data.get('user_id') in self.users:
+                return False
+            try:
+                user = dict(user_data, created_at=datetime.now().isoformat())
+                self._append(user)
+                self.users[user['user_id']] = user
+            except Exception as e:
+                logging.error(f"Ошибка сохранения {self.users_file}: {e}")
+                return False
+        logging.info(f"✅ Добавлен пользователь: {user_data.get('user_id')}")
+        return True
 
     def save_registration_data(self, user_id, data):
-        users = self._load_data()
-        for user in users:
-            if user.get('user_id') == user_id:
-                user['registration_data'] = data
-                user['registration_date'] = datetime.now().isoformat()
-                break
-        self._save_data(users)
+        with self.lock:
+            user = self.users.get(user_id)
+            if user is None:
+                return
+            try:
+                user = dict(user, registration_data=data, registration_date=datetime.now().isoformat())
+                self._append(user)
+                self.users[user_id] = user
+            except Exception as e:
+                logging.error(f"Ошибка сохранения {self.users_file}: {e}")
+                return
         logging.info(f"💾 Сохранены данные регистрации для: {user_id}")
 
-# глобальный экземпляр JSON
-json_db = SimpleDB()
+    def compact(self):
+        with self.lock:
+            if self.legacy_pending:
+                self._migrate_legacy()
+            else:
+                self._compact()
+
+def load_legacy_users(path):
+    """Пользователи из файла: JSON-массив (старый users.json) или JSONL-журнал"""
+    with open(path, 'r', encoding='utf-8') as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        f.seek(0)
+        if first == '[':
+            return json.load(f)
+        users = {}
+        for line in f:
+            if line.strip():
+                try:
+                    user = json.loads(line)
+                except ValueError:
+                    continue
+                users[user.get('user_id')] = user
+        return list(users.values())
+
+def import_users_to_sqlite(path, database):
+    """Загружаем пользователей из users.json/users.jsonl в таблицу users SQLite"""
+    users = load_legacy_users(path)
+    return database.import_users(users)
+
+# Глобальный экземпляр JSON создается при первом обращении: импорт модуля
+# (например, init_db.py --import-json) не должен создавать users.jsonl
+_json_db = None
+
+def get_json_db():
+    global _json_db
+    if _json_db is None:
+        _json_db = SimpleDB()
+    return _json_db
+
+def __getattr__(name):
+    # Совместимость с `from simpledb import json_db`
+    if name == 'json_db':
+        return get_json_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
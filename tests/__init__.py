@@ -0,0 +1,4 @@
+"""Проверки поведения бота. Запускаются из корня репозитория:
+
+    python -m pytest -q tests
+"""
@@ -0,0 +1,27 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# database.py создает глобальную базу при импорте - уводим ее во временную папку
+os.environ.setdefault('DB_PATH', os.path.join(tempfile.mkdtemp(prefix='bot_tests_'), 'bot.db'))
+os.environ.setdefault('BOT_TOKEN', '123456:TEST')
+# Без админов: уведомления о регистрации не нужны тестам обработчиков
+os.environ.setdefault('ADMIN_IDS', '')
+
+from database import Database
+
+@pytest.fixture
+def database(tmp_path):
+    """Чистая база с актуальной схемой"""
+    database = Database(str(tmp_path / 'test.db'))
+    assert database.migrate()
+    yield database
+    database.flush_interactions()
+    database.read_pool.close()
+    database.conn.close()
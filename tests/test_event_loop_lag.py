@@ -0,0 +1,67 @@
+# tests/test_event_loop_lag.py
+"""Задержка цикла событий во время тяжелой записи в БД.
+
+До переноса запросов в поток БД обработчик вызывал Database напрямую, и
+цикл событий стоял все время запроса. Через AsyncDatabase тот же запрос
+выполняется в потоке-писателе, а цикл продолжает обслуживать другие задачи.
+"""
+import asyncio
+import time
+
+from database import AsyncDatabase
+
+USERS = 100_000
+TICK = 0.005
+
+def make_users(first_id, count):
+    return [
+        {'user_id': user_id, 'username': f'user{user_id}', 'first_name': 'Test', 'source': 'test'}
+        for user_id in range(first_id, first_id + count)
+    ]
+
+async def max_loop_lag(work):
+    """Максимальное опоздание тика цикла событий, пока выполняется work()"""
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - started - TICK)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK * 4)
+    started = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - started
+    done.set()
+    await task
+    return max(lags), elapsed
+
+def test_db_thread_keeps_event_loop_responsive(database):
+    async_database = AsyncDatabase(database)
+    first, second = make_users(1, USERS), make_users(1 + USERS, USERS)
+
+    async def blocking():
+        # Как до изменения: синхронный вызов прямо в обработчике
+        database.import_users(first)
+
+    async def threaded():
+        await async_database.import_users(second)
+
+    try:
+        before, before_elapsed = asyncio.run(max_loop_lag(blocking))
+        after, after_elapsed = asyncio.run(max_loop_lag(threaded))
+    finally:
+        async_database.executor.shutdown(wait=True)
+        async_database.read_executor.shutdown(wait=True)
+
+    print(f"\nзадержка цикла: напрямую {before * 1000:.0f} мс за {before_elapsed * 1000:.0f} мс запроса, "
+          f"через поток БД {after * 1000:.0f} мс за {after_elapsed * 1000:.0f} мс")
+    assert database.conn.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 2 * USERS
+    # Напрямую цикл стоит почти весь запрос
+    assert before >= before_elapsed * 0.5
+    # Через поток БД - опоздания на порядок меньше и не растут с длительностью запроса
+    assert after < before / 5
+    assert after < 0.1
@@ -0,0 +1,62 @@
+# tests/test_export_memory.py
+"""Выгрузка большой таблицы не держит ее в памяти.
+
+База с несколькими миллионами взаимодействий выгружается в gzip CSV,
+tracemalloc замеряет пик памяти Python во время выгрузки. Строки читаются
+порциями fetchmany и сразу сжимаются, поэтому пик ограничен размером
+порции, а не таблицы. Размер базы: EXPORT_TEST_ROWS (по умолчанию 2 млн).
+JSONL пишется тем же циклом по порциям - его проверяем на базе поменьше,
+под tracemalloc json.dumps на каждую строку заметно медленнее.
+"""
+import gzip
+import os
+import tracemalloc
+
+from export import export_table
+
+ROWS = int(os.getenv('EXPORT_TEST_ROWS', '2000000'))
+JSONL_ROWS = ROWS // 10
+# Полная таблица в памяти заняла бы сотни МБ; порция по 1000 строк - около мегабайта
+MEMORY_LIMIT = 16 * 1024 * 1024
+
+def fill_interactions(database, rows):
+    # Строки генерирует сама SQLite - заливка без списков в памяти теста
+    with database.conn:
+        database.conn.execute('''
+            INSERT INTO interactions (user_id, action, data, timestamp)
+            WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+            SELECT n % 50000, 'clicked_vip_benefits', 'синтетическое событие ' || n,
+                   '2026-01-01T00:00:00.' || substr('000000' || n, -6)
+            FROM seq
+        ''', (rows,))
+
+def export_with_peak(database, fmt, path):
+    """Выгружаем interactions, возвращаем (строк, пик памяти Python в байтах)"""
+    tracemalloc.start()
+    try:
+        _, count = export_table(database, 'interactions', fmt, path)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    print(f"\n{fmt}: {count} строк, файл {os.path.getsize(path) / 2 ** 20:.1f} МБ, пик памяти {peak / 2 ** 20:.1f} МБ")
+    return count, peak
+
+def count_lines(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as exported:
+        return sum(1 for _ in exported)
+
+def test_csv_export_of_large_table_is_bounded(database, tmp_path):
+    fill_interactions(database, ROWS)
+    path = str(tmp_path / 'interactions.csv.gz')
+    count, peak = export_with_peak(database, 'csv', path)
+    assert count == ROWS
+    assert peak < MEMORY_LIMIT
+    assert count_lines(path) == ROWS + 1
+
+def test_jsonl_export_is_bounded(database, tmp_path):
+    fill_interactions(database, JSONL_ROWS)
+    path = str(tmp_path / 'interactions.jsonl.gz')
+    count, peak = export_with_peak(database, 'jsonl', path)
+    assert count == JSONL_ROWS
+    assert peak < MEMORY_LIMIT
+    assert count_lines(path) == JSONL_ROWS
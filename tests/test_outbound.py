@@ -0,0 +1,81 @@
+# tests/test_outbound.py
+"""Лимиты очереди исходящих на фейковой сессии, которая записывает время вызовов.
+
+Сообщения отправляются так же, как в обработчиках - прямым вызовом бота
+(bot.send_message, callback.answer): их перехватывает middleware сессии.
+"""
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery
+
+from loadtest import FakeSession
+from outbound import OutboundDispatcher, OutboundRequestMiddleware
+
+class RecordingSession(FakeSession):
+    """Фейковая сессия: (время, метод, chat_id) каждого вызова; первые retry_after_calls вызовов - RetryAfter"""
+
+    def __init__(self, retry_after_calls=0):
+        super().__init__()
+        self.records = []
+        self.retry_after_calls = retry_after_calls
+
+    async def make_request(self, bot, method, timeout=None):
+        if self.retry_after_calls:
+            self.retry_after_calls -= 1
+            raise TelegramRetryAfter(method=method, message='Too Many Requests', retry_after=1)
+        self.records.append((time.monotonic(), type(method).__name__, getattr(method, 'chat_id', None)))
+        return await super().make_request(bot, method, timeout)
+
+def run_with_outbound(scenario, session, **kwargs):
+    async def main():
+        bot = Bot(token='123456:TEST', session=session)
+        outbound = OutboundDispatcher(bot, **kwargs)
+        session.middleware(OutboundRequestMiddleware(outbound))
+        outbound.start()
+        try:
+            await scenario(bot)
+        finally:
+            await outbound.stop()
+
+    asyncio.run(main())
+
+def test_global_and_per_chat_rates():
+    session = RecordingSession()
+    rate, interval = 40, 0.3
+
+    async def scenario(bot):
+        sends = [bot.send_message(chat_id, 'рассылка') for chat_id in range(1, 81)]
+        sends += [bot.send_message(1000, f'ответ {index}') for index in range(4)]
+        sends.append(bot(AnswerCallbackQuery(callback_query_id='1')))
+        await asyncio.gather(*sends)
+
+    run_with_outbound(scenario, session, global_rate=rate, per_chat_interval=interval)
+
+    assert len(session.records) == 85
+    times = sorted(moment for moment, _, _ in session.records)
+    # Token bucket: сразу не больше rate сообщений, дальше - rate в секунду
+    for index in range(rate, len(times)):
+        assert times[index] - times[0] >= (index - rate + 1) / rate - 0.02
+    one_chat = [moment for moment, _, chat_id in session.records if chat_id == 1000]
+    assert len(one_chat) == 4
+    assert all(later - earlier >= interval - 0.01 for earlier, later in zip(one_chat, one_chat[1:]))
+
+def test_retry_after_from_direct_reply_is_handled():
+    session = RecordingSession(retry_after_calls=1)
+    results = []
+
+    async def scenario(bot):
+        started = time.monotonic()
+        message = await bot.send_message(1, 'ответ на /start')
+        results.append((message.chat.id, time.monotonic() - started))
+
+    run_with_outbound(scenario, session)
+
+    chat_id, elapsed = results[0]
+    assert chat_id == 1
+    # Повтор после паузы из RetryAfter вместо исключения в обработчике
+    assert elapsed >= 1.0
+    assert len(session.records) == 1
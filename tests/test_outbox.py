@@ -0,0 +1,69 @@
+# tests/test_outbox.py
+"""Воркер outbox не крутит выборку, пока одна из полос занята целиком.
+
+Готовые сообщения заполненной полосы ждут освобождения места: воркер
+не должен раз за разом открывать BEGIN IMMEDIATE в потоке писателя.
+"""
+import asyncio
+from collections import Counter
+
+import pytest
+
+from database import AsyncDatabase
+from outbound import PRIORITY_BULK, PRIORITY_DIALOG
+from outbox import Outbox
+
+class SlowOutbound:
+    """Очередь исходящих, в которой каждая отправка занимает delay секунд"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.sent = 0
+
+    async def send(self, method, priority=None):
+        await asyncio.sleep(self.delay)
+        self.sent += 1
+
+class CountingDatabase:
+    """Считаем вызовы методов AsyncDatabase"""
+
+    def __init__(self, async_db):
+        self.async_db = async_db
+        self.calls = Counter()
+
+    def __getattr__(self, name):
+        method = getattr(self.async_db, name)
+
+        async def wrapper(*args, **kwargs):
+            self.calls[name] += 1
+            return await method(*args, **kwargs)
+
+        return wrapper
+
+@pytest.mark.parametrize('priority', [PRIORITY_BULK, PRIORITY_DIALOG])
+def test_claims_stay_bounded_while_lane_is_full(database, priority):
+    async_db = AsyncDatabase(database)
+    counting = CountingDatabase(async_db)
+    outbound = SlowOutbound(delay=2.0)
+
+    async def scenario():
+        outbox = Outbox(counting, outbound, max_in_flight=5, dialog_in_flight=5, poll_interval=5.0)
+        for index in range(15):
+            await outbox.send_message(1000 + index, f'сообщение {index}', priority=priority)
+        counting.calls.clear()
+        outbox.start()
+        await asyncio.sleep(1.0)
+        in_flight = len(outbox.in_flight)
+        await outbox.stop(timeout=0)
+        return in_flight
+
+    try:
+        in_flight = asyncio.run(scenario())
+    finally:
+        async_db.executor.shutdown(wait=True)
+        async_db.read_executor.shutdown(wait=True)
+
+    # Полоса заполнена, остальные 10 сообщений ждут - а не выбираются заново каждый тик
+    assert in_flight == 5
+    assert counting.calls['claim_outbox'] <= 4, counting.calls
+    assert counting.calls['get_next_outbox_attempt'] <= 4, counting.calls
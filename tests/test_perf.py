@@ -0,0 +1,31 @@
+# tests/test_perf.py
+"""Накопительные счетчики метрик при записи из нескольких потоков"""
+import sys
+import threading
+
+from perf import PerfRegistry
+
+def test_counters_do_not_lose_increments():
+    # Частое переключение потоков - чтобы гонка read-modify-write проявилась
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    registry = PerfRegistry()
+    threads_count, per_thread = 5, 20000
+
+    def writer():
+        for _ in range(per_thread):
+            registry.record('db', 'flush_interactions', 0.001)
+
+    threads = [threading.Thread(target=writer) for _ in range(threads_count)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    count, total = registry.metrics['db']['flush_interactions'].totals()
+    assert count == threads_count * per_thread
+    assert abs(total - threads_count * per_thread * 0.001) < 1e-6
+    assert f'bot_db_duration_seconds_count{{name="flush_interactions"}} {count}' in registry.render_prometheus()
@@ -0,0 +1,83 @@
+# tests/test_query_plans.py
+"""Запросы горячих путей и отчетов не проходят таблицы целиком.
+
+Методы Database выполняются на соединениях с профайлером (порог 0 мс),
+который снимает EXPLAIN QUERY PLAN каждого реального запроса с его
+параметрами. Ни в одном плане не должно быть SCAN по interactions
+(вместе с помесячными архивами), users или reminders.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import ARCHIVE_TABLE_PREFIX, Database
+from funnel import FUNNEL_ACTIONS
+from query_profiler import has_full_scan, query_profiler
+
+LARGE_TABLES = ('interactions', 'users', 'reminders')
+
+@pytest.fixture
+def profiled_database(tmp_path, monkeypatch):
+    # Класс соединения выбирается при подключении - включаем профайлер до него
+    monkeypatch.setattr(query_profiler, 'enabled', True)
+    monkeypatch.setattr(query_profiler, 'threshold', 0.0)
+    database = Database(str(tmp_path / 'plans.db'))
+    assert database.migrate()
+
+    old = (datetime.now() - timedelta(days=90)).isoformat()
+    for user_id in range(1, 201):
+        database.register_start({'user_id': user_id, 'first_name': f'user{user_id}'})
+        database.log_interaction(user_id, 'clicked_vip_benefits')
+    database.flush_interactions()
+    database.conn.executemany(
+        'INSERT INTO interactions (user_id, action, timestamp) VALUES (?, ?, ?)',
+        [(user_id, 'start_command', old) for user_id in range(1, 201)]
+    )
+    database.conn.commit()
+    assert database.archive_interactions(30) == 200
+    query_profiler.reset()
+    yield database
+    query_profiler.reset()
+    database.read_pool.close()
+    database.conn.close()
+
+def scanned_tables(plan):
+    """Большие таблицы, которые план проходит целиком"""
+    tables = set()
+    for line in (plan or '').splitlines():
+        if has_full_scan(line):
+            name = line.split()[1]
+            if name in LARGE_TABLES or name.startswith(ARCHIVE_TABLE_PREFIX):
+                tables.add(name)
+    return tables
+
+def test_hot_queries_use_indexes(profiled_database):
+    database = profiled_database
+    today = datetime.now().date().isoformat()
+    archived_day = (datetime.now() - timedelta(days=90)).date().isoformat()
+
+    database.register_start({'user_id': 5})
+    database.register_start({'user_id': 1000})
+    database.log_interaction(5, 'clicked_has_broker')
+    database.flush_interactions()
+    # Кеш пользователей отвечает без запроса - сбрасываем, чтобы проверить COUNT
+    database.user_cache.counts.clear()
+    assert database.get_user_interactions_count(5) == 5
+    assert database.check_user_exists(5)
+    database.save_registration_data(5, 'Иван, +70000000000')
+
+    assert database.get_today_stats(today)
+    assert database.get_user_stats_page(5, archived_day, today) is not None
+    assert database.get_new_users_page(today) is not None
+    assert database.get_funnel_masks(archived_day, today, FUNNEL_ACTIONS)
+    database.get_pending_reminders()
+    database.get_upcoming_reminders()
+    database.claim_due_reminders()
+    database.mark_user_blocked(7)
+
+    plans = {sql: stat['plan'] for sql, stat in query_profiler.report(limit=1000)}
+    assert any('interactions' in sql for sql in plans)
+    assert any(ARCHIVE_TABLE_PREFIX in sql for sql in plans), "запросы должны включать архив"
+    scans = {sql: scanned_tables(plan) for sql, plan in plans.items()}
+    offenders = {sql[:200]: sorted(tables) for sql, tables in scans.items() if tables}
+    assert not offenders, f"полный проход таблиц: {offenders}"
@@ -0,0 +1,22 @@
+# tests/test_register_start.py
+"""Счетчик взаимодействий при повторном /start учитывает архивы"""
+from datetime import datetime, timedelta
+
+def test_returning_user_count_includes_archives(database):
+    old = (datetime.now() - timedelta(days=90)).isoformat()
+    database.register_start({'user_id': 1})
+    with database.conn:
+        database.conn.executemany(
+            'INSERT INTO interactions (user_id, action, timestamp) VALUES (?, ?, ?)',
+            [(1, 'clicked_vip_benefits', old)] * 3
+        )
+    assert database.archive_interactions(30) == 3
+
+    # Перезапуск процесса: кеша пользователей еще нет
+    database.user_cache.counts.clear()
+    result = database.register_start({'user_id': 1})
+    assert not result['is_new']
+    assert result['interaction_count'] == 4
+
+    database.user_cache.counts.clear()
+    assert database.get_user_interactions_count(1) == 5
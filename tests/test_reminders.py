@@ -0,0 +1,35 @@
+# tests/test_reminders.py
+"""Напоминания пользователя, снова написавшего боту после блокировки"""
+import asyncio
+
+from reminder_scheduler import ReminderScheduler
+
+def test_unblocked_user_reminders_reach_scheduler(database):
+    scheduled = database.register_start({'user_id': 1})['scheduled_reminders']
+    assert len(scheduled) == 2
+    database.mark_user_blocked(1)
+    assert database.get_upcoming_reminders() == []
+
+    database.log_interaction(1, 'clicked_vip_benefits')
+    database.flush_interactions()
+
+    rearmed = database.take_rearmed_reminders()
+    assert sorted(rearmed) == sorted(scheduled)
+    assert database.take_rearmed_reminders() == []
+
+    async def notify():
+        scheduler = ReminderScheduler(database, send_callback=None)
+        for reminder_id, scheduled_time in rearmed:
+            scheduler.notify(reminder_id, scheduled_time)
+        return scheduler.wakeup.is_set(), sorted(scheduler.heap)
+
+    woken, heap = asyncio.run(notify())
+    assert woken
+    assert heap == sorted((scheduled_time, reminder_id) for reminder_id, scheduled_time in scheduled)
+
+def test_admin_message_does_not_rearm(database):
+    database.register_start({'user_id': 2})
+    database.mark_user_blocked(2)
+    database.log_interaction(2, 'admin_message', 'привет')
+    database.flush_interactions()
+    assert database.take_rearmed_reminders() == []
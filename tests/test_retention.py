@@ -0,0 +1,46 @@
+# tests/test_retention.py
+"""Матрица удержания: агрегация на пуле чтения, запись - короткой транзакцией"""
+import asyncio
+import threading
+from datetime import datetime, timedelta
+
+from database import AsyncDatabase
+from retention import update_retention
+
+def test_update_retention_aggregates_off_the_writer_thread(database):
+    cohort_day = datetime.now() - timedelta(days=10)
+    database.import_users([
+        {'user_id': user_id, 'created_at': cohort_day.isoformat()} for user_id in (1, 2, 3)
+    ])
+    with database.conn:
+        database.conn.executemany(
+            'INSERT INTO interactions (user_id, action, timestamp) VALUES (?, ?, ?)',
+            [
+                (1, 'clicked_vip_benefits', (cohort_day + timedelta(days=1)).isoformat()),
+                # Сообщение админа - не возврат пользователя
+                (2, 'admin_message', (cohort_day + timedelta(days=1)).isoformat()),
+                (3, 'start_command', (cohort_day + timedelta(days=7)).isoformat()),
+            ]
+        )
+
+    threads = {}
+    for name in ('aggregate_retention', 'save_retention'):
+        method = getattr(database, name)
+
+        def recorded(*args, method=method, name=name, **kwargs):
+            threads.setdefault(name, set()).add(threading.current_thread().name)
+            return method(*args, **kwargs)
+
+        setattr(database, name, recorded)
+
+    async_db = AsyncDatabase(database)
+    try:
+        assert asyncio.run(update_retention(async_db)) >= 1
+    finally:
+        async_db.executor.shutdown(wait=True)
+        async_db.read_executor.shutdown(wait=True)
+
+    assert all(name.startswith('db-read') for name in threads['aggregate_retention'])
+    assert all(not name.startswith('db-read') for name in threads['save_retention'])
+    rows = database.get_retention(31)
+    assert [row[2:] for row in rows if row[0] == cohort_day.date().isoformat()] == [(3, 1, 0, 1)]
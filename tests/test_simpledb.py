@@ -0,0 +1,36 @@
+# tests/test_simpledb.py
+"""Перенос старого users.json в журнал users.jsonl"""
+import json
+
+from simpledb import SimpleDB
+
+def make_db(tmp_path):
+    return SimpleDB(str(tmp_path / 'users.jsonl'), str(tmp_path / 'users.json'))
+
+def test_legacy_file_is_migrated(tmp_path):
+    (tmp_path / 'users.json').write_text(json.dumps([{'user_id': 1}]), encoding='utf-8')
+    db = make_db(tmp_path)
+    assert (tmp_path / 'users.jsonl').exists()
+    assert db.add_user({'user_id': 2})
+    assert set(make_db(tmp_path).users) == {1, 2}
+
+def test_broken_legacy_file_is_not_lost_after_append(tmp_path):
+    legacy = tmp_path / 'users.json'
+    legacy.write_text('[{"user_id": 1},', encoding='utf-8')
+
+    db = make_db(tmp_path)
+    assert db.legacy_pending
+    # Запись до исправления файла не создает журнал - иначе users.json больше не прочитается
+    assert db.add_user({'user_id': 2})
+    db.compact()
+    assert not (tmp_path / 'users.jsonl').exists()
+    assert set(db.users) == {2}
+
+    legacy.write_text(json.dumps([{'user_id': 1, 'first_name': 'Старый'}]), encoding='utf-8')
+    assert db.add_user({'user_id': 3})
+    assert not db.legacy_pending
+    assert set(db.users) == {1, 2, 3}
+
+    reloaded = make_db(tmp_path)
+    assert set(reloaded.users) == {1, 2, 3}
+    assert reloaded.users[1]['first_name'] == 'Старый'
@@ -0,0 +1,85 @@
+# tests/test_webhook.py
+"""Режим webhook от HTTP-запроса до записи в БД.
+
+Записанный апдейт /start отправляется POST-запросом в aiohttp-приложение
+WebhookServer, обработчики бота работают с фейковой сессией Bot API.
+"""
+import asyncio
+import time
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from loadtest import FakeSession
+from outbound import OutboundRequestMiddleware
+from webhook import SECRET_HEADER, WebhookServer
+
+SECRET = 'test-secret'
+USER_ID = 424242
+
+def start_update(update_id=1, user_id=USER_ID):
+    """Апдейт /start в том виде, в каком его присылает Telegram"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': 'Тест', 'username': 'webhook_test', 'language_code': 'ru'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'from': user,
+            'chat': {'id': user_id, 'first_name': 'Тест', 'username': 'webhook_test', 'type': 'private'},
+            'date': int(time.time()),
+            'text': '/start',
+            'entities': [{'offset': 0, 'length': 6, 'type': 'bot_command'}]
+        }
+    }
+
+async def post(server, update, headers=None):
+    async with TestClient(TestServer(server.build_app())) as client:
+        response = await client.post(server.path, json=update, headers=headers or {})
+        return response.status
+
+def test_rejects_request_without_secret():
+    server = WebhookServer(None, None, secret_token=SECRET, workers=0)
+    assert asyncio.run(post(server, start_update())) == 401
+    assert asyncio.run(post(server, start_update(), {SECRET_HEADER: 'wrong'})) == 401
+    assert server.queue.empty()
+
+def test_full_queue_answers_503():
+    server = WebhookServer(None, None, secret_token=SECRET, workers=0, max_queue=1)
+
+    async def scenario():
+        async with TestClient(TestServer(server.build_app())) as client:
+            headers = {SECRET_HEADER: SECRET}
+            first = await client.post(server.path, json=start_update(1), headers=headers)
+            second = await client.post(server.path, json=start_update(2), headers=headers)
+            # Воркеров нет - разбираем очередь сами, иначе остановка ждет ее 10 с
+            server.queue.get_nowait()
+            server.queue.task_done()
+            return first.status, second.status
+
+    assert asyncio.run(scenario()) == (200, 503)
+
+def test_start_update_creates_user():
+    import bot as app
+
+    session = FakeSession()
+    session.middleware(OutboundRequestMiddleware(app.outbound))
+    app.bot.session = session
+    server = WebhookServer(app.bot, app.dp, secret_token=SECRET, workers=2)
+
+    async def scenario():
+        await app.async_db.migrate()
+        await app.start_services(background_tasks=False)
+        try:
+            async with TestClient(TestServer(server.build_app())) as client:
+                response = await client.post(server.path, json=start_update(), headers={SECRET_HEADER: SECRET})
+                # Ответ приходит до обработки - ждем фоновые воркеры
+                await asyncio.wait_for(server.queue.join(), 10)
+                exists = await app.async_db.check_user_exists(USER_ID)
+                return response.status, exists
+        finally:
+            await app.stop_services()
+
+    status, exists = asyncio.run(scenario())
+    assert status == 200
+    assert exists
+    # Бот ответил на /start через фейковую сессию
+    assert session.calls >= 1
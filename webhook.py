@@ -0,0 +1,92 @@
+# webhook.py
+import asyncio
+import logging
+
+from aiohttp import web
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+class WebhookServer:
+    """Прием апдейтов Telegram через webhook на aiohttp.
+
+    Обработчик запроса только кладет JSON апдейта в ограниченную очередь и
+    сразу отвечает 200 OK; обработку выполняют фоновые воркеры через
+    dp.feed_update. Если очередь заполнена, отвечаем 503 - Telegram
+    повторит доставку позже.
+    """
+
+    def __init__(self, bot, dp, path='/webhook', secret_token=None, workers=8, max_queue=1000):
+        self.bot = bot
+        self.dp = dp
+        self.path = path
+        self.secret_token = secret_token
+        self.workers_count = workers
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.workers = []
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def _on_startup(self, app):
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+
+    async def _on_cleanup(self, app):
+        # Дорабатываем принятые апдейты, затем останавливаем воркеры
+        try:
+            await asyncio.wait_for(self.queue.join(), 10)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Не обработано апдейтов при остановке: {self.queue.qsize()}")
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+
+    async def handle(self, request):
+        if self.secret_token and request.headers.get(SECRET_HEADER) != self.secret_token:
+            return web.Response(status=401)
+
+        try:
+            data = await request.json()
+        except Exception:
+            return web.Response(status=400)
+
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            logger.warning("⚠️ Очередь апдейтов переполнена, просим Telegram повторить")
+            return web.Response(status=503)
+
+        return web.Response(status=200)
+
+    async def _worker(self):
+        while True:
+            data = await self.queue.get()
+            try:
+                update = Update.model_validate(data, context={'bot': self.bot})
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки апдейта: {e}")
+            finally:
+                self.queue.task_done()
+
+async def run_webhook(bot, dp, webhook_url, host='0.0.0.0', port=8080, path='/webhook', secret_token=None):
+    """Запускаем локальный сервер, регистрируем webhook и работаем до остановки"""
+    server = WebhookServer(bot, dp, path=path, secret_token=secret_token)
+    runner = web.AppRunner(server.build_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"🌐 Webhook-сервер слушает {host}:{port}{path}")
+
+    try:
+        await bot.set_webhook(webhook_url, secret_token=secret_token)
+        logger.info(f"🌐 Webhook установлен: {webhook_url}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()